@@ -1,12 +1,31 @@
+import os
 import random
 import string
+import time
 from datetime import datetime
+from itertools import chain, islice
 
-from database import Database, Model, Schema
+from database import Database, Model, Schema, ShardedDatabase
+from database.query import matches
+from database.storage import STORAGE_ENGINES
+
+# How each transaction type moves the account's balance
+BALANCE_EFFECT = {"deposit": 1, "received": 1, "withdraw": -1, "transfer": -1}
+STATS_FIELDS = ("count", "totals", "last_transaction")
+DETAIL_FIELDS = ("name", "age", "birth_date", "phone_number", "credits", "account_number")
+# Seconds an AccountSession stays open without being used
+SESSION_TTL = 15 * 60
+
+
+class SessionError(ValueError):
+    # The session is closed, expired, or its account changed credentials
+    pass
 
 
 class AccountManager:
-    def __init__(self):
+    def __init__(self, db_instance=None, columnar=False):
+        # columnar holds users in a compact column store instead of one dict
+        # each, for very large numbers of accounts
         user_schema = Schema(
             account_created_at=str,
             credits=int,
@@ -16,23 +35,59 @@ class AccountManager:
             age=int,
             birth_date=str,
             phone_number=str,
-            transaction_history=list,
         )
+        self.db = db_instance if db_instance is not None else Database()
         self.user_model = Model(
-            collection_name="users", schema=user_schema, db_instance=Database()
+            collection_name="users",
+            schema=user_schema,
+            db_instance=self.db,
+            indexes={"account_number": {"unique": True}},
+            columnar=columnar,
+        )
+        # Transactions live in their own append-only ledger instead of a list
+        # on the user document, so deposits don't grow the account record
+        transaction_schema = Schema(
+            account_number=str,
+            type=str,
+            amount=(int, float),
+            date=str,
+            recipient=(str, type(None)),
+        )
+        self.transaction_model = Model(
+            collection_name="transactions",
+            schema=transaction_schema,
+            db_instance=self.db,
+            indexes={"account_number": {"order_by": "date"}},
+        )
+        # Per-account aggregates kept up to date by _add_transaction, in the
+        # same commit as the ledger entry: the transaction count, the total
+        # amount per type, the last transaction date and the opening balance
+        # the totals are relative to
+        stats_schema = Schema(
+            account_number=str,
+            opening=(int, float),
+            count=int,
+            totals=dict,
+            last_transaction=(str, type(None)),
+        )
+        self.stats_model = Model(
+            collection_name="account_stats",
+            schema=stats_schema,
+            db_instance=self.db,
+            indexes={"account_number": {"unique": True}},
         )
 
     # Function to add credits
     def add_credits(self, account_number, amount):
         user = self.user_model.find_one({"account_number": account_number})
         if user:
-            new_credits = user["credits"] + amount
-            self.user_model.update(
-                {"account_number": account_number}, {"credits": new_credits}
-            )
-            return new_credits
+            return self._set_credits(user, user["credits"] + amount)
         return None
 
+    def _set_credits(self, user, credits):
+        self.user_model.update({"account_number": user["account_number"]}, {"credits": credits})
+        return credits
+
     # Function to generate password
     def generate_password(self):
         characters = string.ascii_uppercase + string.ascii_lowercase + string.digits
@@ -43,16 +98,69 @@ class AccountManager:
     def subtract_credits(self, account_number, amount):
         user = self.user_model.find_one({"account_number": account_number})
         if user and user["credits"] >= amount:
-            new_credits = user["credits"] - amount
-            self.user_model.update(
-                {"account_number": account_number}, {"credits": new_credits}
-            )
-            return new_credits
+            return self._set_credits(user, user["credits"] - amount)
         return None
 
     def create_account(self, name, age, birth_date, phone_number, credits=0):
-        account_number = str(random.randint(10**12, 10**13 - 1))
-        account_data = {
+        # The number is drawn before the transaction starts, so that on a
+        # ShardedDatabase it only locks the number's shard, and checked
+        # inside it. A number that is taken is drawn again.
+        while True:
+            account_number = self._draw_account_number()
+            with self.db.transaction(keys=[account_number]):
+                if self.user_model.find_one({"account_number": account_number}):
+                    continue
+                account_data = self.new_account_data(
+                    name, age, birth_date, phone_number, credits, account_number
+                )
+                new_account = self.user_model.create(account_data)
+                self.stats_model.create(_rebuild_stats(account_number, credits, ()))
+                return new_account
+
+    def create_accounts(self, rows):
+        # Batch onboarding: rows is any iterable of (name, age, birth_date,
+        # phone_number, credits) with credits optional. Every account is
+        # stored with a single commit, or none if one is invalid. Returns the
+        # new accounts.
+        rows = list(rows)
+        with self.db.transaction():
+            numbers = self.allocate_account_numbers(len(rows))
+            accounts = self.user_model.bulk_create(
+                self.new_account_data(*row, account_number=number)
+                for row, number in zip(rows, numbers)
+            )
+            self.stats_model.bulk_create(
+                _rebuild_stats(account["account_number"], account["credits"], ())
+                for account in accounts
+            )
+        return accounts
+
+    def allocate_account_numbers(self, count=1):
+        # count random account numbers, distinct from each other and from
+        # every stored account, each checked with one lookup in the unique
+        # index. Allocate inside the transaction that stores the accounts:
+        # its write lock keeps other threads and processes from creating
+        # accounts in between, so the numbers are still free when stored.
+        numbers = {}
+        while len(numbers) < count:
+            number = self._draw_account_number()
+            if number in numbers:
+                continue
+            if not self.user_model.find_one({"account_number": number}):
+                numbers[number] = None
+        return list(numbers)
+
+    def _draw_account_number(self):
+        return str(random.randint(10**12, 10**13 - 1))
+
+    def new_account_data(
+        self, name, age, birth_date, phone_number, credits=0, account_number=None
+    ):
+        # The user document create_account stores, without storing it. A
+        # random account_number is drawn if none is given, unchecked.
+        if account_number is None:
+            account_number = self._draw_account_number()
+        return {
             "account_created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "credits": credits,
             "name": name,
@@ -61,67 +169,186 @@ class AccountManager:
             "password": self.generate_password(),
             "birth_date": birth_date,
             "phone_number": phone_number,
-            "transaction_history": [],
         }
-        new_account = self.user_model.create(account_data)
-        return new_account
 
+    def open_session(self, account_number, password, ttl=SESSION_TTL):
+        # Authenticates once and returns an AccountSession to run further
+        # operations on, or None if the account or password is wrong
+        user = self.user_model.find_one({"account_number": account_number})
+        if user is None or user["password"] != password:
+            return None
+        return AccountSession(self, user, ttl)
+
+    # Each operation below is one transaction: every update it makes is
+    # committed together or not at all. The _deposit, _withdraw and _transfer
+    # they share take the account as already looked up in that transaction.
     def deposit(self, account_number, amount):
-        new_credits = self.add_credits(account_number, amount)
-        if new_credits is not None:
+        with self.db.transaction(keys=[account_number]):
             user = self.user_model.find_one({"account_number": account_number})
-            self._add_transaction(user, "deposit", amount)
-            return f"Deposited {amount} to account {account_number}. New balance: {new_credits}."
+            if user:
+                return self._deposit(user, amount)
         return "Account not found."
 
+    def _deposit(self, user, amount):
+        new_credits = self._set_credits(user, user["credits"] + amount)
+        self._add_transaction(user, "deposit", amount)
+        return f"Deposited {amount} to account {user['account_number']}. New balance: {new_credits}."
+
     def withdraw(self, account_number, amount):
-        new_credits = self.subtract_credits(account_number, amount)
-        if new_credits is not None:
+        with self.db.transaction(keys=[account_number]):
             user = self.user_model.find_one({"account_number": account_number})
-            self._add_transaction(user, "withdraw", amount)
-            return f"Withdrew {amount} from account {account_number}. New balance: {new_credits}."
+            if user:
+                return self._withdraw(user, amount)
         return "Insufficient credits or account not found."
 
+    def _withdraw(self, user, amount):
+        if user["credits"] < amount:
+            return "Insufficient credits or account not found."
+        new_credits = self._set_credits(user, user["credits"] - amount)
+        self._add_transaction(user, "withdraw", amount)
+        return f"Withdrew {amount} from account {user['account_number']}. New balance: {new_credits}."
+
     def transfer_credits(self, sender_account_number, recipient_account_number, amount):
-        sender_credits = self.subtract_credits(sender_account_number, amount)
-        if sender_credits is not None:
+        accounts = [sender_account_number, recipient_account_number]
+        with self.db.transaction(keys=accounts) as transaction:
+            sender = self.user_model.find_one({"account_number": sender_account_number})
+            if sender:
+                return self._transfer(transaction, sender, recipient_account_number, amount)
+        return "Transfer failed: insufficient funds or account not found."
+
+    def _transfer(self, transaction, sender, recipient_account_number, amount):
+        sender_account_number = sender["account_number"]
+        if sender["credits"] >= amount:
+            sender_credits = self._set_credits(sender, sender["credits"] - amount)
+            # Looked up after the sender is debited, they may be the same account
             recipient_credits = self.add_credits(recipient_account_number, amount)
             if recipient_credits is not None:
-                sender = self.user_model.find_one(
-                    {"account_number": sender_account_number}
-                )
-                recipient = self.user_model.find_one(
-                    {"account_number": recipient_account_number}
-                )
-
+                self._add_transaction(sender, "transfer", amount, recipient_account_number)
                 self._add_transaction(
-                    sender, "transfer", amount, recipient_account_number
-                )
-                self._add_transaction(
-                    recipient, "received", amount, sender_account_number
+                    {"account_number": recipient_account_number},
+                    "received",
+                    amount,
+                    sender_account_number,
                 )
 
                 return f"Transferred {amount} from {sender_account_number} to {recipient_account_number}. New sender balance: {sender_credits}."
+            # Recipient not found, give the sender their credits back
+            transaction.rollback()
         return "Transfer failed: insufficient funds or account not found."
 
+    def bulk_deposit(self, rows):
+        # rows is any iterable of (account_number, amount)
+        return self.bulk_apply(
+            {"op": "deposit", "account_number": account_number, "amount": amount}
+            for account_number, amount in rows
+        )
+
+    def bulk_transfer(self, rows):
+        # rows is any iterable of (sender_account_number, recipient_account_number, amount)
+        return self.bulk_apply(
+            {
+                "op": "transfer",
+                "account_number": sender,
+                "recipient": recipient,
+                "amount": amount,
+            }
+            for sender, recipient, amount in rows
+        )
+
+    def bulk_apply(self, operations):
+        # Applies deposit/withdraw/transfer operations as one transaction, so
+        # the whole batch costs a single commit. Each row runs in its own
+        # savepoint: a failed row is rolled back and reported, the rest still
+        # apply. Returns one result per row.
+        handlers = {
+            "deposit": (self.deposit, "Deposited"),
+            "withdraw": (self.withdraw, "Withdrew"),
+            "transfer": (self.transfer_credits, "Transferred"),
+        }
+        results = []
+        with self.db.transaction():
+            for row, operation in enumerate(operations, start=1):
+                try:
+                    if "error" in operation:
+                        raise ValueError(operation["error"])
+                    handler, success = handlers[operation["op"]]
+                    args = [operation["account_number"]]
+                    if operation["op"] == "transfer":
+                        args.append(operation["recipient"])
+                    amount = operation["amount"]
+                    # Credits are whole numbers, and a negative amount would
+                    # run the operation backwards
+                    if type(amount) is not int or amount <= 0:
+                        raise ValueError(
+                            f"amount must be a positive whole number, got {amount!r}"
+                        )
+                    message = handler(*args, amount)
+                    ok = message.startswith(success)
+                except (KeyError, TypeError, ValueError) as e:
+                    ok, message = False, f"Invalid operation: {e}"
+                results.append({"row": row, "ok": ok, "message": message})
+        return results
+
     def account_details(self, account_number):
-        user = self.user_model.find_one({"account_number": account_number})
+        user = self.user_model.find_one(
+            {"account_number": account_number}, projection=list(DETAIL_FIELDS)
+        )
         if user:
-            return {
-                "name": user["name"],
-                "age": user["age"],
-                "birth_date": user["birth_date"],
-                "phone_number": user["phone_number"],
-                "credits": user["credits"],
-                "account_number": user["account_number"],
-            }
+            return user
         return "Account not found."
 
-    def get_transaction_history(self, account_number):
+    def get_transaction_history(self, account_number, limit=None, offset=0):
+        transactions = self.iter_transaction_history(account_number)
+        if transactions is None:
+            return "Account not found."
+        stop = None if limit is None else offset + limit
+        return list(islice(transactions, offset, stop))
+
+    def iter_transaction_history(
+        self, account_number, since=None, until=None, trans_type=None, limit=None
+    ):
+        # Lazily yields the account's transactions, oldest first, or returns
+        # None if the account doesn't exist. since/until take "YYYY-MM-DD" or
+        # a full timestamp and, like trans_type, are applied by the ledger
+        # index rather than after loading everything.
         user = self.user_model.find_one({"account_number": account_number})
-        if user:
-            return user["transaction_history"]
-        return "Account not found."
+        if not user:
+            return None
+        return self._iter_history(user, since, until, trans_type, limit)
+
+    def _iter_history(self, user, since=None, until=None, trans_type=None, limit=None):
+        query = {}
+        if since or until:
+            query["date"] = {}
+            if since:
+                query["date"]["$gte"] = since
+            if until:
+                # A bare date covers the whole day
+                query["date"]["$lte"] = until if len(until) > 10 else f"{until} 23:59:59"
+        if trans_type:
+            query["type"] = trans_type
+
+        # Accounts created before the ledger keep their older entries on the
+        # user document, they come first
+        legacy = [t for t in user.get("transaction_history", []) if matches(t, query)]
+        if limit is not None:
+            legacy = legacy[:limit]
+            limit -= len(legacy)
+        if limit == 0:
+            return iter(legacy)
+        query["account_number"] = user["account_number"]
+        entries = self.transaction_model.iter_find(query, limit=limit)
+        return chain(legacy, (self._format_transaction(entry) for entry in entries))
+
+    def _format_transaction(self, entry):
+        transaction = {
+            "type": entry["type"],
+            "amount": entry["amount"],
+            "date": entry["date"],
+        }
+        if entry["recipient"]:
+            transaction["recipient"] = entry["recipient"]
+        return transaction
 
     def check_password(self, account_number, entered_password):
         account = self.user_model.find_one({"account_number": account_number})
@@ -142,6 +369,109 @@ class AccountManager:
             return "Account details updated."
         return "Account not found."
 
+    def on_ledger_entry(self, callback):
+        # Calls callback(entry) for every ledger entry this process commits,
+        # see ledger_entries. Needs a Database opened with changes=True.
+        def forward(event):
+            for entry in ledger_entries([event]):
+                callback(entry)
+
+        return self.db.subscribe(forward)
+
+    def account_stats(self, account_number):
+        # One lookup, the stats are maintained as transactions are added.
+        # Accounts that haven't had a transaction since the stats were
+        # introduced get them computed from their history instead.
+        stats = self.stats_model.find_one(
+            {"account_number": account_number},
+            projection=["account_number", "opening", *STATS_FIELDS],
+        )
+        if stats:
+            return stats
+        user = self.user_model.find_one({"account_number": account_number})
+        if user:
+            history = self.iter_transaction_history(account_number)
+            return _rebuild_stats(account_number, user["credits"], history)
+        return "Account not found."
+
+    def verify_stats(self, processes=None, repair=False):
+        # Rebuilds every account's stats from its history, split across a
+        # pool of processes that each open the store, and returns the accounts
+        # whose stored stats are missing or differ from the rebuild, or whose
+        # balance differs from the opening balance plus the totals. repair
+        # rewrites the stats of those accounts from their history; balance
+        # drift is only reported. A ShardedDatabase verifies each shard on its
+        # own worker instead.
+        parts = processes or os.cpu_count() or 1
+        engine = next(
+            (
+                name
+                for name, cls in STORAGE_ENGINES.items()
+                if type(getattr(self.db, "storage", None)) is cls
+            ),
+            None,
+        )
+        if isinstance(self.db, ShardedDatabase):
+            drift = [record for part in self.db.map(_verify_shard_stats) for record in part]
+        elif parts == 1 or engine is None:
+            drift = self._verify_stats(0, 1)
+        else:
+            from concurrent.futures import ProcessPoolExecutor  # Slow to import, rarely needed
+
+            with ProcessPoolExecutor(parts) as pool:
+                jobs = [
+                    pool.submit(_verify_stats_partition, self.db.db_path, engine, part, parts)
+                    for part in range(parts)
+                ]
+                drift = [record for job in jobs for record in job.result()]
+        drift.sort(key=lambda record: record["account_number"])
+        if repair and drift:
+            with self.db.transaction():
+                for record in drift:
+                    self._repair_stats(record["account_number"])
+        return drift
+
+    def _verify_stats(self, part, parts):
+        # Every parts-th account starting at part
+        drift = []
+        for user in islice(self.user_model.iter_find(), part, None, parts):
+            account_number = user["account_number"]
+            stored = self.stats_model.find_one({"account_number": account_number})
+            history = self.iter_transaction_history(account_number)
+            rebuilt = _rebuild_stats(account_number, user["credits"], history)
+            if stored is not None:
+                rebuilt["opening"] = stored["opening"]
+            balance_drift = user["credits"] - rebuilt["opening"] - _net(rebuilt["totals"])
+            if (
+                stored is None
+                or balance_drift
+                or any(stored[field] != rebuilt[field] for field in STATS_FIELDS)
+            ):
+                drift.append(
+                    {
+                        "account_number": account_number,
+                        "stored": None if stored is None else dict(stored),
+                        "rebuilt": rebuilt,
+                        "balance_drift": balance_drift,
+                    }
+                )
+        return drift
+
+    def _repair_stats(self, account_number):
+        user = self.user_model.find_one({"account_number": account_number})
+        if not user:
+            return
+        history = self.iter_transaction_history(account_number)
+        rebuilt = _rebuild_stats(account_number, user["credits"], history)
+        stored = self.stats_model.find_one({"account_number": account_number})
+        if stored is None:
+            self.stats_model.create(rebuilt)
+        else:
+            self.stats_model.update(
+                {"account_number": account_number},
+                {field: rebuilt[field] for field in STATS_FIELDS},
+            )
+
     # New function to get balance
     def get_balance(self, account_number):
         user = self.user_model.find_one({"account_number": account_number})
@@ -152,15 +482,152 @@ class AccountManager:
     # Private method to add transactions
     def _add_transaction(self, user, trans_type, amount, recipient_account_number=None):
         transaction = {
+            "account_number": user["account_number"],
             "type": trans_type,
             "amount": amount,
             "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "recipient": recipient_account_number,
         }
-        if recipient_account_number:
-            transaction["recipient"] = recipient_account_number
+        self._count_transaction(transaction)
+        self.transaction_model.create(transaction)
 
-        updated_history = user["transaction_history"] + [transaction]
-        self.user_model.update(
-            {"account_number": user["account_number"]},
-            {"transaction_history": updated_history},
+    def _count_transaction(self, transaction):
+        # Adds a transaction that is about to be stored to its account's stats
+        account_number = transaction["account_number"]
+        stats = self.stats_model.find_one({"account_number": account_number})
+        if stats is None:
+            # No stats yet, e.g. an account from before they were kept. Its
+            # credits already include this transaction.
+            user = self.user_model.find_one({"account_number": account_number})
+            history = chain(self.iter_transaction_history(account_number), [transaction])
+            self.stats_model.create(_rebuild_stats(account_number, user["credits"], history))
+            return
+        totals = dict(stats["totals"])
+        totals[transaction["type"]] = totals.get(transaction["type"], 0) + transaction["amount"]
+        self.stats_model.update(
+            {"account_number": account_number},
+            {
+                "count": stats["count"] + 1,
+                "totals": totals,
+                "last_transaction": transaction["date"],
+            },
         )
+
+
+class AccountSession:
+    # An account authenticated once by AccountManager.open_session. Its
+    # operations skip the separate existence and password lookups: each looks
+    # the account up once, inside its own transaction, and checks there that
+    # the password is still the one the session was opened with. A session
+    # ends when closed, after ttl seconds without use, or once that check
+    # fails, and then raises SessionError.
+    def __init__(self, manager, user, ttl=SESSION_TTL):
+        self.manager = manager
+        self.db = manager.db
+        self.account_number = user["account_number"]
+        # Read-only view of the account as of the last operation
+        self.user = user
+        self.ttl = ttl
+        self.closed = False
+        self._password = user["password"]
+        self._expires = time.monotonic() + ttl
+
+    def close(self):
+        self.closed = True
+
+    def _resolve(self):
+        # The account as stored now, once the session is checked
+        if self.closed:
+            raise SessionError("Session closed")
+        if time.monotonic() > self._expires:
+            self.close()
+            raise SessionError("Session expired")
+        user = self.manager.user_model.find_one({"account_number": self.account_number})
+        if user is None or user["password"] != self._password:
+            self.close()
+            raise SessionError("Account changed since the session was opened")
+        self.user = user
+        self._expires = time.monotonic() + self.ttl
+        return user
+
+    def balance(self):
+        return self._resolve()["credits"]
+
+    def details(self):
+        user = self._resolve()
+        return {field: user[field] for field in DETAIL_FIELDS}
+
+    def history(self, since=None, until=None, trans_type=None, limit=None):
+        # Lazy, like AccountManager.iter_transaction_history
+        return self.manager._iter_history(self._resolve(), since, until, trans_type, limit)
+
+    def stats(self):
+        self._resolve()
+        return self.manager.account_stats(self.account_number)
+
+    def deposit(self, amount):
+        with self.db.transaction(keys=[self.account_number]):
+            return self.manager._deposit(self._resolve(), amount)
+
+    def withdraw(self, amount):
+        with self.db.transaction(keys=[self.account_number]):
+            return self.manager._withdraw(self._resolve(), amount)
+
+    def transfer(self, recipient_account_number, amount):
+        accounts = [self.account_number, recipient_account_number]
+        with self.db.transaction(keys=accounts) as transaction:
+            sender = self._resolve()
+            return self.manager._transfer(transaction, sender, recipient_account_number, amount)
+
+    def edit_details(self, new_details):
+        with self.db.transaction(keys=[self.account_number]):
+            self._resolve()
+            self.manager.user_model.update({"account_number": self.account_number}, new_details)
+            # The session's own change doesn't end it
+            self._password = new_details.get("password", self._password)
+        return "Account details updated."
+
+
+def ledger_entries(events):
+    # The deposits, withdrawals and transfers among change feed events, e.g.
+    # from a database.changes.ChangeReader, as the ledger documents with the
+    # event's seq instead of the _id. Ledger entries are only ever inserted.
+    for event in events:
+        if event["c"] == "transactions" and event["op"] == "insert":
+            entry = {k: v for k, v in event["doc"].items() if k != "_id"}
+            entry["seq"] = event["seq"]
+            yield entry
+
+
+def _net(totals):
+    return sum(BALANCE_EFFECT.get(kind, 0) * amount for kind, amount in totals.items())
+
+
+def _rebuild_stats(account_number, credits, history):
+    # Stats from an account's whole history, oldest first. The opening
+    # balance is whatever credits the history doesn't account for.
+    totals, count, last_transaction = {}, 0, None
+    for entry in history:
+        totals[entry["type"]] = totals.get(entry["type"], 0) + entry["amount"]
+        count += 1
+        last_transaction = entry["date"]
+    return {
+        "account_number": account_number,
+        "opening": credits - _net(totals),
+        "count": count,
+        "totals": totals,
+        "last_transaction": last_transaction,
+    }
+
+
+def _verify_shard_stats(db):
+    return AccountManager(db_instance=db)._verify_stats(0, 1)
+
+
+def _verify_stats_partition(db_path, engine, part, parts):
+    # Runs in a verify_stats worker process
+    db = Database(db_path, storage=engine)
+    try:
+        return AccountManager(db_instance=db)._verify_stats(part, parts)
+    finally:
+        db.close()
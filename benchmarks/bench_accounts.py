@@ -0,0 +1,60 @@
+# Account creation throughput as the store grows: the store is filled with
+# AccountManager.create_accounts batches, and at each size single
+# create_account calls, one more batch, and allocating a batch worth of
+# account numbers without storing them are timed. Single creations pay one
+# fsync each, so they measure the disk as much as the allocator.
+#
+#   python -m benchmarks.bench_accounts --sizes 10000,100000,1000000
+import argparse
+import os
+import tempfile
+import time
+
+from account_manager import AccountManager
+from database import Database
+
+
+def rows(count):
+    return (("bench", 30, "1990-01-01", "1234567890", 100) for _ in range(count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Account creation benchmark")
+    parser.add_argument("--sizes", default="10000,100000,300000", help="store sizes to time at")
+    parser.add_argument("--single", type=int, default=500, help="create_account calls per size")
+    parser.add_argument("--batch", type=int, default=10000, help="accounts per create_accounts")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "database.json"))
+        manager = AccountManager(db_instance=db)
+        print(f"{'accounts':>10} {'create_account/s':>18} {'create_accounts/s':>18} {'allocate/s':>12}")
+        for size in sizes:
+            while db.find_one("users", {"_id": {"$gte": size}}) is None:
+                manager.create_accounts(rows(args.batch))
+            # Time against a compacted store, not one still writing out the
+            # log of the batches above
+            with db._writing() as cache:
+                db.storage.replace(cache)
+            os.sync()
+
+            start = time.perf_counter()
+            for row in rows(args.single):
+                manager.create_account(*row)
+            single = args.single / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            manager.create_accounts(rows(args.batch))
+            batch = args.batch / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            with db.transaction():
+                manager.allocate_account_numbers(args.batch)
+            allocate = args.batch / (time.perf_counter() - start)
+            print(f"{size:>10} {single:>18.0f} {batch:>18.0f} {allocate:>12.0f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
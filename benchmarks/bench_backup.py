@@ -0,0 +1,92 @@
+# Backup cost against store size: a full backup, then incremental ones after
+# a batch of deposits, and the deposit rate of a writer process while a full
+# backup runs next to it compared to without one.
+#
+#   python -m benchmarks.bench_backup --sizes 10000,100000 --deposits 1000
+import argparse
+import os
+import random
+import tempfile
+import time
+from multiprocessing import Process, Queue
+
+from account_manager import AccountManager
+from database import Database
+from database.backup import backup
+
+from benchmarks.datagen import create_store
+
+
+def writer(path, account_numbers, seconds, results):
+    rng = random.Random(0)
+    db = Database(path)
+    manager = AccountManager(db_instance=db)
+    manager.get_balance(account_numbers[0])  # Loaded before timing
+    deposits = 0
+    stop = time.perf_counter() + seconds
+    while time.perf_counter() < stop:
+        manager.deposit(rng.choice(account_numbers), 1)
+        deposits += 1
+    results.put(deposits / seconds)
+    db.close()
+
+
+def deposit_rate(path, account_numbers, seconds, during=None):
+    results = Queue()
+    process = Process(target=writer, args=(path, account_numbers, seconds, results))
+    process.start()
+    if during is not None:
+        time.sleep(seconds / 4)  # Let the writer load first
+        during()
+    rate = results.get()
+    process.join()
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup benchmark")
+    parser.add_argument("--sizes", default="10000,100000", help="users per store")
+    parser.add_argument("--history", type=int, default=5, help="ledger entries per user")
+    parser.add_argument("--deposits", type=int, default=1000, help="between incremental backups")
+    parser.add_argument("--seconds", type=float, default=4, help="writer run per deposit rate")
+    args = parser.parse_args()
+
+    print(
+        f"{'users':>8} {'store MB':>9} {'full ms':>8} {'incremental ms':>15} "
+        f"{'deposits/s':>11} {'during backup':>14}"
+    )
+    for size in (int(size) for size in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "database.json")
+            accounts = create_store(path, size, args.history)
+            account_numbers = [number for number, _ in accounts]
+            megabytes = os.path.getsize(path) / 1e6
+            db = Database(path)
+
+            start = time.perf_counter()
+            backup(db, os.path.join(tmp, "backups"), full=True)
+            full = time.perf_counter() - start
+
+            manager = AccountManager(db_instance=db)
+            for account_number in random.Random(1).choices(account_numbers, k=args.deposits):
+                manager.deposit(account_number, 1)
+            start = time.perf_counter()
+            backup(db, os.path.join(tmp, "backups"))
+            incremental = time.perf_counter() - start
+
+            idle = deposit_rate(path, account_numbers, args.seconds)
+            busy = deposit_rate(
+                path,
+                account_numbers,
+                args.seconds,
+                lambda: backup(db, os.path.join(tmp, "backups2"), full=True),
+            )
+            db.close()
+            print(
+                f"{size:>8} {megabytes:>9.1f} {full * 1000:>8.1f} {incremental * 1000:>15.1f} "
+                f"{idle:>11.0f} {busy:>14.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
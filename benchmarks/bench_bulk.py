@@ -0,0 +1,61 @@
+# Payroll-style crediting: AccountManager.deposit in a loop against one
+# AccountManager.bulk_deposit call over the same rows.
+#
+#   python -m benchmarks.bench_bulk --accounts 10000 --rows 10000
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from account_manager import AccountManager
+from database import Database
+
+
+def create_accounts(manager, count):
+    accounts = manager.user_model.bulk_create(
+        {
+            "account_created_at": "2024-01-01 00:00:00",
+            "credits": 1000,
+            "name": f"user{i}",
+            "account_number": str(10**12 + i),
+            "password": "abcde",
+            "age": 30,
+            "birth_date": "1990-01-01",
+            "phone_number": "1234567890",
+        }
+        for i in range(count)
+    )
+    return [account["account_number"] for account in accounts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk deposit benchmark")
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "database.json"))
+        manager = AccountManager(db_instance=db)
+        account_numbers = create_accounts(manager, args.accounts)
+        rows = [(random.choice(account_numbers), 100) for _ in range(args.rows)]
+
+        start = time.perf_counter()
+        for account_number, amount in rows:
+            manager.deposit(account_number, amount)
+        loop_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = manager.bulk_deposit(iter(rows))
+        bulk_seconds = time.perf_counter() - start
+        assert all(result["ok"] for result in results)
+        db.close()
+
+    print(f"deposit loop: {args.rows / loop_seconds:>10.0f} rows/s")
+    print(f"bulk_deposit: {args.rows / bulk_seconds:>10.0f} rows/s")
+    print(f"speedup:      {loop_seconds / bulk_seconds:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# Parse counts and per-operation latency for AccountManager read paths.
+#
+#   python -m benchmarks.bench_cache --sizes 10000,100000,1000000
+#
+# Each size is run twice: once against the caching Database and once against
+# a variant that re-parses database.json on every call (the old behaviour).
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from account_manager import AccountManager
+from database import Database
+
+
+class CountingDatabase(Database):
+    def __init__(self, db_path):
+        self.parse_count = 0
+        super().__init__(db_path)
+        load = self.storage.load
+
+        def counting_load():
+            self.parse_count += 1
+            return load()
+
+        self.storage.load = counting_load
+
+
+class UncachedDatabase(CountingDatabase):
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        # Reads only go through _load_db when the store looks changed
+        self.storage.changed = lambda: True
+
+    def _load_db(self):
+        if self._transaction is None:
+            self._cache = None
+        return super()._load_db()
+
+
+def generate_users(path, size):
+    users = []
+    for i in range(size):
+        users.append(
+            {
+                "account_created_at": "2024-01-01 00:00:00",
+                "credits": random.randint(0, 100000),
+                "name": f"user{i}",
+                "account_number": str(10**12 + i),
+                "password": "abcde",
+                "age": random.randint(18, 90),
+                "birth_date": "1990-01-01",
+                "phone_number": "1234567890",
+            }
+        )
+    with open(path, "w") as f:
+        json.dump({"users": users}, f)
+    return [user["account_number"] for user in users]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_operations(manager, db, account_numbers, iterations):
+    operations = {
+        "get_balance": lambda acc: manager.get_balance(acc),
+        "check_account_number": lambda acc: manager.check_account_number(acc),
+        "check_password": lambda acc: manager.check_password(acc, "abcde"),
+        "account_details": lambda acc: manager.account_details(acc),
+        "get_transaction_history": lambda acc: manager.get_transaction_history(acc),
+        "deposit": lambda acc: manager.deposit(acc, 10),
+        "withdraw": lambda acc: manager.withdraw(acc, 10),
+        "transfer_credits": lambda acc: manager.transfer_credits(
+            acc, random.choice(account_numbers), 10
+        ),
+        "create_account": lambda acc: manager.create_account(
+            "bench", 30, "1990-01-01", "1234567890", 100
+        ),
+    }
+    results = {}
+    for name, operation in operations.items():
+        samples = []
+        parses_before = db.parse_count
+        for _ in range(iterations):
+            account_number = random.choice(account_numbers)
+            start = time.perf_counter()
+            operation(account_number)
+            samples.append(time.perf_counter() - start)
+        results[name] = {
+            "parses_per_op": (db.parse_count - parses_before) / iterations,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database cache benchmark")
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "database.json")
+            account_numbers = generate_users(path, size)
+            for label, db_class in (("cached", CountingDatabase), ("uncached", UncachedDatabase)):
+                db = db_class(path)
+                manager = AccountManager(db_instance=db)
+                manager.get_balance(account_numbers[0])  # warm up the cache
+                results = run_operations(manager, db, account_numbers, args.iterations)
+                if label == "uncached":
+                    # Every call, and every read within one, parses the file again
+                    assert all(row["parses_per_op"] >= 1 for row in results.values()), results
+                print(f"\n{size} users ({label})")
+                print(f"{'operation':<26}{'parses/op':>10}{'p50 ms':>10}{'p99 ms':>10}")
+                for name, row in results.items():
+                    print(
+                        f"{name:<26}{row['parses_per_op']:>10.2f}"
+                        f"{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# What a downstream job pays to pick up new ledger entries: re-reading the
+# store and querying past the last entry seen, as polling jobs did, against
+# reading the change feed from a checkpoint. Each poll follows a batch of
+# deposits.
+#
+#   python -m benchmarks.bench_changes --sizes 10000,100000 --deposits 100
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from account_manager import AccountManager, ledger_entries
+from database import Database
+from database.changes import ChangeReader
+
+from benchmarks.datagen import create_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Change feed benchmark")
+    parser.add_argument("--sizes", default="10000,100000", help="users per store")
+    parser.add_argument("--history", type=int, default=5, help="ledger entries per user")
+    parser.add_argument("--deposits", type=int, default=100, help="between polls")
+    parser.add_argument("--polls", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'store MB':>9} {'re-read ms':>11} {'feed ms':>8} {'entries':>8}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "database.json")
+            accounts = create_store(path, size, args.history)
+            account_numbers = [number for number, _ in accounts]
+            megabytes = os.path.getsize(path) / 1e6
+            db = Database(path, changes=True)
+            manager = AccountManager(db_instance=db)
+            rng = random.Random(0)
+            last_id = db.find("transactions", sort=[("_id", -1)], limit=1)[0]["_id"]
+            reader = ChangeReader(f"{path}.changes", os.path.join(tmp, "checkpoint"))
+
+            reread = feed = 0
+            for _ in range(args.polls):
+                for account_number in rng.choices(account_numbers, k=args.deposits):
+                    manager.deposit(account_number, 1)
+
+                start = time.perf_counter()
+                poller = Database(path)
+                new = poller.find("transactions", {"_id": {"$gt": last_id}})
+                poller.close()
+                reread += time.perf_counter() - start
+                last_id = max(entry["_id"] for entry in new)
+
+                start = time.perf_counter()
+                entries = list(ledger_entries(reader.poll()))
+                reader.commit()
+                feed += time.perf_counter() - start
+                assert len(entries) == len(new)
+            db.close()
+            print(
+                f"{size:>8} {megabytes:>9.1f} {reread / args.polls * 1000:>11.1f} "
+                f"{feed / args.polls * 1000:>8.2f} {len(entries):>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
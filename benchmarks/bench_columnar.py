@@ -0,0 +1,66 @@
+# Resident memory of the users collection kept as dicts against the columnar
+# store (AccountManager(columnar=True)), and what the columns cost on the
+# read and write paths.
+#
+#   python -m benchmarks.bench_columnar --users 200000
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from account_manager import AccountManager
+from database import Database
+
+from benchmarks.datagen import create_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar users benchmark")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(
+        f"{'users as':<10}{'documents B':>13}{'with indexes B':>16}{'load s':>8}"
+        f"{'get_balance':>14}{'deposit':>12}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "database.json")
+        accounts = create_store(path, args.users, 0)
+        account_numbers = [account_number for account_number, _ in accounts]
+        for columnar in (False, True):
+            db = Database(path)
+            manager = AccountManager(db_instance=db, columnar=columnar)
+            tracemalloc.start()
+            start = time.perf_counter()
+            with db._writing():
+                pass  # Load the store
+            load_seconds = time.perf_counter() - start
+            documents = tracemalloc.get_traced_memory()[0]
+            manager.get_balance(account_numbers[0])  # Build the indexes
+            with_indexes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            rng = random.Random(0)
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                manager.get_balance(rng.choice(account_numbers))
+            reads = args.iterations / (time.perf_counter() - start)
+            deposits = max(1, args.iterations // 20)
+            start = time.perf_counter()
+            for _ in range(deposits):
+                manager.deposit(rng.choice(account_numbers), 1)
+            writes = deposits / (time.perf_counter() - start)
+            db.close()
+
+            print(
+                f"{'columns' if columnar else 'dicts':<10}{documents / args.users:>13.0f}"
+                f"{with_indexes / args.users:>16.0f}{load_seconds:>8.2f}"
+                f"{reads:>12.0f}/s{writes:>10.0f}/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Deposits per second from a growing number of threads sharing one Database,
+# committing every write on its own and with group commit. Run it on the disk
+# you care about, fsync cost is what group commit amortises; --fsync-ms adds
+# a delay to every fsync to mimic a slower disk than the one at hand.
+#
+#   python -m benchmarks.bench_group_commit --dir /var/tmp --threads 1 4 16 64
+#   python -m benchmarks.bench_group_commit --fsync-ms 5
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from account_manager import AccountManager
+from database import Database
+
+from benchmarks.bench_bulk import create_accounts
+
+CONFIGS = [
+    ("per-commit fsync", {}),
+    ("group, no window", {"commit_window": 0}),
+    ("group, 2ms window", {"commit_window": 0.002}),
+]
+
+
+def run(directory, threads, deposits, options):
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        db = Database(os.path.join(tmp, "database.json"), **options)
+        manager = AccountManager(db_instance=db)
+        account_numbers = create_accounts(manager, threads)
+
+        def worker(account_number):
+            for _ in range(deposits):
+                manager.deposit(account_number, 1)
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in account_numbers]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        assert all(manager.get_balance(n) == 1000 + deposits for n in account_numbers)
+        db.close()
+    return threads * deposits / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Group commit benchmark")
+    parser.add_argument("--dir", default=None, help="where to create the stores")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--deposits", type=int, default=100, help="per thread")
+    parser.add_argument("--fsync-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    if args.fsync_ms:
+        fsync = os.fsync
+
+        def slow_fsync(fd):
+            time.sleep(args.fsync_ms / 1000)
+            fsync(fd)
+
+        os.fsync = slow_fsync
+
+    print(f"{'threads':>8}" + "".join(f"{name:>20}" for name, _ in CONFIGS))
+    for threads in args.threads:
+        rates = [run(args.dir, threads, args.deposits, options) for _, options in CONFIGS]
+        print(f"{threads:>8}" + "".join(f"{rate:>14.0f} ops/s" for rate in rates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# Cost of instrumentation on the hottest read and write paths: get_balance
+# and deposit with metrics off, on, and on with cProfile/tracemalloc sampling.
+#
+#   python -m benchmarks.bench_metrics --accounts 10000 --iterations 20000
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from account_manager import AccountManager
+from database import Database
+from database.metrics import Metrics
+
+from benchmarks.bench_bulk import create_accounts
+
+CONFIGS = [
+    ("off", lambda: None),
+    ("on", Metrics),
+    ("sampling 1/100", lambda: Metrics(sample_every=100, profile=True, trace_memory=True)),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Instrumentation overhead benchmark")
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'metrics':<16}{'get_balance':>16}{'deposit':>16}")
+    for label, make_metrics in CONFIGS:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, "database.json"), metrics=make_metrics())
+            manager = AccountManager(db_instance=db)
+            account_numbers = create_accounts(manager, args.accounts)
+            rng = random.Random(0)
+
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                manager.get_balance(rng.choice(account_numbers))
+            reads = args.iterations / (time.perf_counter() - start)
+
+            deposits = max(1, args.iterations // 20)
+            start = time.perf_counter()
+            for _ in range(deposits):
+                manager.deposit(rng.choice(account_numbers), 1)
+            writes = deposits / (time.perf_counter() - start)
+            db.close()
+        print(f"{label:<16}{reads:>12.0f}/s  {writes:>12.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Garbage collector work and memory per request on the read-heavy
+# AccountManager paths: how many collections a run of calls triggers, and
+# the peak memory one call allocates (measured apart from the timings, as
+# tracemalloc slows everything down).
+#
+#   python -m benchmarks.bench_reads --accounts 10000 --iterations 20000
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from account_manager import AccountManager
+from database import Database
+
+from benchmarks.bench_bulk import create_accounts
+
+OPERATIONS = {
+    "get_balance": lambda manager, acc: manager.get_balance(acc),
+    "check_password": lambda manager, acc: manager.check_password(acc, "abcde"),
+    "account_details": lambda manager, acc: manager.account_details(acc),
+    "find_one": lambda manager, acc: manager.db.find_one("users", {"account_number": acc}),
+    "deposit": lambda manager, acc: manager.deposit(acc, 1),
+}
+
+
+def collections(operation, manager, account_numbers, rng, iterations):
+    counts = [stats["collections"] for stats in gc.get_stats()]
+    start = time.perf_counter()
+    for _ in range(iterations):
+        operation(manager, rng.choice(account_numbers))
+    elapsed = time.perf_counter() - start
+    counts = [stats["collections"] - n for stats, n in zip(gc.get_stats(), counts)]
+    return iterations / elapsed, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read path allocation benchmark")
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'operation':<18}{'ops/s':>10}{'gen0/1/2 collections':>24}{'peak KB/call':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "database.json"))
+        manager = AccountManager(db_instance=db)
+        account_numbers = create_accounts(manager, args.accounts)
+        rng = random.Random(0)
+        for name, operation in OPERATIONS.items():
+            iterations = args.iterations if name != "deposit" else args.iterations // 20
+            ops, counts = collections(operation, manager, account_numbers, rng, iterations)
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            operation(manager, rng.choice(account_numbers))
+            peak = tracemalloc.get_traced_memory()[1] - base
+            tracemalloc.stop()
+            print(
+                f"{name:<18}{ops:>10.0f}{'/'.join(map(str, counts)):>24}{peak / 1024:>14.1f}"
+            )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
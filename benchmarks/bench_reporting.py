@@ -0,0 +1,78 @@
+# End-of-day report timings: building the ledger extract from scratch,
+# bringing a cached one up to date after a day's deposits, and aggregating a
+# synthetic extract of --transactions entries, with and without NumPy.
+#
+#   python -m benchmarks.bench_reporting --users 20000 --history 50 --transactions 10000000
+import argparse
+import os
+import random
+import tempfile
+import time
+from array import array
+
+import reporting
+from account_manager import AccountManager
+from database import Database
+
+from benchmarks.datagen import create_store
+
+
+def synthetic_extract(count, days, seed):
+    rng = random.Random(seed)
+    extract = reporting.LedgerExtract()
+    extract.days = [f"2024-{1 + day // 28:02}-{1 + day % 28:02}" for day in range(days)]
+    extract.types = ["deposit", "withdraw", "transfer", "received"]
+    extract.day = array("i", (rng.randrange(days) for _ in range(count)))
+    extract.type = array("b", (rng.randrange(4) for _ in range(count)))
+    extract.amount = array("d", (rng.randint(1, 1000) for _ in range(count)))
+    return extract
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reporting benchmark")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=20, help="ledger entries per user")
+    parser.add_argument("--deposits", type=int, default=1000, help="made before the update")
+    parser.add_argument("--transactions", type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "database.json")
+        accounts = create_store(path, args.users, args.history)
+        db = Database(path)
+        manager = AccountManager(db_instance=db)
+        db.find_one("users")  # Load the store outside the timings
+
+        (_, extract), seconds = timed(reporting.build_report, db)
+        ledger = args.users * args.history
+        print(f"full report over {ledger} transactions:     {seconds:8.3f}s")
+
+        cache_path = os.path.join(tmp, "extract")
+        extract.save(cache_path)
+        for _ in range(args.deposits):
+            manager.deposit(random.choice(accounts)[0], 10)
+        extract = reporting.LedgerExtract.load(cache_path)
+        _, seconds = timed(reporting.build_report, db, extract)
+        print(f"report from cache after {args.deposits} deposits: {seconds:8.3f}s")
+        db.close()
+
+    extract = synthetic_extract(args.transactions, 365, 0)
+    numpy = reporting.numpy
+    for label, module in (("numpy", numpy), ("python", None)):
+        if label == "numpy" and numpy is None:
+            print("numpy not installed, skipping the vectorized aggregation")
+            continue
+        reporting.numpy = module
+        _, seconds = timed(reporting.daily_volume, extract)
+        print(f"daily volume over {len(extract)} ({label}):  {seconds:8.3f}s")
+    reporting.numpy = numpy
+
+
+if __name__ == "__main__":
+    main()
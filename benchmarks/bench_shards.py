@@ -0,0 +1,82 @@
+# One store against the same data split into shards: deposits from several
+# writer processes at once, and a find no index can answer, which a
+# ShardedDatabase runs on every shard's worker process in parallel.
+#
+#   python -m benchmarks.bench_shards --users 100000 --shards 4 --writers 4
+import argparse
+import os
+import random
+import tempfile
+import time
+from multiprocessing import Process, Queue
+
+from account_manager import AccountManager
+from database import Database, ShardedDatabase
+
+from benchmarks.datagen import populate
+
+SCAN_QUERY = {"age": {"$gte": 85}, "credits": {"$gt": 90000}}
+
+
+def open_database(path, shards):
+    if shards == 1:
+        return Database(path)
+    return ShardedDatabase(path, shards=shards)
+
+
+def writer(path, shards, account_numbers, operations, seed, results):
+    rng = random.Random(seed)
+    db = open_database(path, shards)
+    manager = AccountManager(db_instance=db)
+    start = time.perf_counter()
+    for _ in range(operations):
+        manager.deposit(rng.choice(account_numbers), 1)
+    results.put(time.perf_counter() - start)
+    db.close()
+
+
+def run(path, shards, args):
+    db = open_database(path, shards)
+    manager = AccountManager(db_instance=db)
+    accounts = populate(manager, args.users, 0)
+    account_numbers = [number for number, _ in accounts]
+
+    db.find("users", SCAN_QUERY)  # Loads the store, or starts the shard workers
+    start = time.perf_counter()
+    for _ in range(args.scans):
+        found = len(db.find("users", SCAN_QUERY))
+    scan = (time.perf_counter() - start) / args.scans
+    db.close()
+
+    results = Queue()
+    writers = [
+        Process(target=writer, args=(path, shards, account_numbers, args.operations, seed, results))
+        for seed in range(args.writers)
+    ]
+    start = time.perf_counter()
+    for w in writers:
+        w.start()
+    for w in writers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    deposits = args.writers * args.operations / elapsed
+    print(f"{shards:>6} {scan * 1000:>12.1f} {found:>8} {deposits:>14.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharding benchmark")
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=4, help="processes depositing at once")
+    parser.add_argument("--operations", type=int, default=500, help="deposits per writer")
+    parser.add_argument("--scans", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'shards':>6} {'scan ms':>12} {'matches':>8} {'deposits/s':>14}")
+    for shards in (1, args.shards):
+        with tempfile.TemporaryDirectory() as tmp:
+            run(os.path.join(tmp, "database.json"), shards, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Time to first operation from a cold process, at several store sizes: each
+# run starts a fresh interpreter that imports main.py's modules, builds an
+# AccountManager, reads one balance and then one transaction history.
+#
+#   python -m benchmarks.bench_startup --sizes 1000,10000,100000 --history 20
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def child(path, account_number):
+    # Runs in the fresh interpreter, every time is from its start
+    start = time.perf_counter()
+    import account_manager
+    import bulk  # noqa: F401, imported by main.py
+    from database import Database
+
+    imported = time.perf_counter()
+    manager = account_manager.AccountManager(db_instance=Database(path))
+    opened = time.perf_counter()
+    manager.get_balance(account_number)
+    first_read = time.perf_counter()
+    manager.get_transaction_history(account_number)
+    history = time.perf_counter()
+    manager.db.close()
+    print(
+        json.dumps(
+            {
+                "import": imported - start,
+                "open": opened - start,
+                "first_read": first_read - start,
+                "history": history - start,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="users per store")
+    parser.add_argument("--history", type=int, default=20, help="ledger entries per user")
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per size, median shown")
+    parser.add_argument("--child", nargs=2, metavar=("PATH", "ACCOUNT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+    # Only here, so the child's imports are all timed
+    from benchmarks.datagen import create_store
+
+    print(
+        f"{'users':>8} {'store MB':>9} {'import ms':>10} {'open ms':>8} "
+        f"{'first read ms':>14} {'history ms':>11} {'process ms':>11}"
+    )
+    for size in (int(size) for size in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "database.json")
+            accounts = create_store(path, size, args.history)
+            megabytes = os.path.getsize(path) / 1e6
+            runs = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                command = [sys.executable, "-m", "benchmarks.bench_startup"]
+                output = subprocess.run(
+                    command + ["--child", path, accounts[-1][0]],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+                times = json.loads(output)
+                times["process"] = time.perf_counter() - start
+                runs.append(times)
+            median = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+            print(
+                f"{size:>8} {megabytes:>9.1f} {median['import']:>10.1f} {median['open']:>8.1f} "
+                f"{median['first_read']:>14.1f} {median['history']:>11.1f} {median['process']:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# File size, full load time and single-deposit commit time of each storage
+# engine over the same generated accounts.
+#
+#   python -m benchmarks.bench_storage --accounts 20000
+import argparse
+import os
+import tempfile
+import time
+
+from account_manager import AccountManager
+from database import Database
+from database.storage import STORAGE_ENGINES, msgpack
+
+from benchmarks.bench_bulk import create_accounts
+
+
+def store_size(tmp, name):
+    return sum(
+        os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp) if f.startswith(name)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage engine benchmark")
+    parser.add_argument("--accounts", type=int, default=20000)
+    parser.add_argument("--deposits", type=int, default=200)
+    args = parser.parse_args()
+
+    engines = [engine for engine in STORAGE_ENGINES if engine != "msgpack" or msgpack]
+    print(f"{'engine':<8} {'size':>12} {'load':>10} {'deposit':>10}")
+    for engine in engines:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, "store"), storage=engine)
+            manager = AccountManager(db_instance=db)
+            account_numbers = create_accounts(manager, args.accounts)
+            db.storage.replace(db._cache)  # Measure a compacted store
+            db.close()
+            size = store_size(tmp, "store")
+
+            start = time.perf_counter()
+            db.storage.load()
+            load_seconds = time.perf_counter() - start
+            db.close()
+
+            db = Database(os.path.join(tmp, "store"), storage=engine)
+            manager = AccountManager(db_instance=db)
+            manager.get_balance(account_numbers[0])
+            start = time.perf_counter()
+            for i in range(args.deposits):
+                manager.deposit(account_numbers[i % len(account_numbers)], 1)
+            deposit_seconds = (time.perf_counter() - start) / args.deposits
+            db.close()
+
+        print(
+            f"{engine:<8} {size:>10} B {load_seconds * 1000:>8.1f}ms "
+            f"{deposit_seconds * 1000:>8.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
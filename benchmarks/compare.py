@@ -0,0 +1,61 @@
+# Diffs two benchmarks.run result files and flags regressions: an operation
+# whose throughput dropped, or whose p99 latency grew, by more than the
+# threshold. Exits with status 1 if there are any, so it can gate CI.
+#
+#   python -m benchmarks.compare before.json after.json --threshold 10
+import argparse
+import json
+
+
+def change(old, new):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def compare(before, after, threshold):
+    rows = []
+    for name, old in before["results"].items():
+        new = after["results"].get(name)
+        if new is None:
+            continue
+        throughput = change(old["ops_per_sec"], new["ops_per_sec"])
+        p99 = change(old["p99_ms"], new["p99_ms"])
+        regressed = throughput < -threshold or p99 > threshold
+        rows.append((name, old, new, throughput, p99, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument(
+        "--threshold", type=float, default=10, help="percent change that counts as a regression"
+    )
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    for key in ("users", "history", "storage"):
+        if before["meta"].get(key) != after["meta"].get(key):
+            print(f"warning: runs differ in {key}: {before['meta'].get(key)} vs {after['meta'].get(key)}")
+
+    rows = compare(before, after, args.threshold)
+    print(
+        f"{'operation':<42}{'ops/s before':>14}{'after':>10}{'change':>9}"
+        f"{'p99 before':>12}{'after':>9}{'change':>9}"
+    )
+    for name, old, new, throughput, p99, regressed in rows:
+        print(
+            f"{name:<42}{old['ops_per_sec']:>14.0f}{new['ops_per_sec']:>10.0f}{throughput:>+8.1f}%"
+            f"{old['p99_ms']:>12.3f}{new['p99_ms']:>9.3f}{p99:>+8.1f}%"
+            + ("  REGRESSION" if regressed else "")
+        )
+    regressions = [row for row in rows if row[-1]]
+    if regressions:
+        raise SystemExit(f"{len(regressions)} regression(s) over {args.threshold:g}%")
+
+
+if __name__ == "__main__":
+    main()
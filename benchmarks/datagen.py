@@ -0,0 +1,102 @@
+# Synthetic stores for benchmarks: users laid out exactly as
+# AccountManager.create_account writes them, each with a ledger history of
+# the given depth and the account_stats matching it. The same seed always produces the same store.
+#
+#   python -m benchmarks.datagen --users 100000 --history 20 --out bench.json
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+from account_manager import AccountManager, _rebuild_stats
+from database import Database
+from database.storage import STORAGE_ENGINES
+
+PASSWORD_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+START_DATE = datetime(2024, 1, 1)
+
+
+def generate_users(manager, count, rng):
+    numbers = set()
+    for i in range(count):
+        account = manager.new_account_data(
+            name=f"user{i}",
+            age=rng.randint(18, 90),
+            birth_date=f"{rng.randint(1935, 2006)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}",
+            phone_number=str(rng.randint(10**9, 10**10 - 1)),
+            credits=rng.randint(0, 100000),
+        )
+        while account["account_number"] in numbers:
+            account["account_number"] = str(rng.randint(10**12, 10**13 - 1))
+        numbers.add(account["account_number"])
+        account["password"] = "".join(rng.choice(PASSWORD_CHARS) for _ in range(5))
+        account["account_created_at"] = START_DATE.strftime("%Y-%m-%d %H:%M:%S")
+        yield account
+
+
+def generate_history(account_numbers, depth, rng):
+    # depth entries per account, in date order across the whole ledger
+    for step in range(depth):
+        date = (START_DATE + timedelta(minutes=step)).strftime("%Y-%m-%d %H:%M:%S")
+        for account_number in account_numbers:
+            trans_type = rng.choice(("deposit", "withdraw", "transfer", "received"))
+            recipient = None
+            if trans_type in ("transfer", "received"):
+                recipient = rng.choice(account_numbers)
+            yield {
+                "account_number": account_number,
+                "type": trans_type,
+                "amount": rng.randint(1, 1000),
+                "date": date,
+                "recipient": recipient,
+            }
+
+
+def populate(manager, users, history, seed=0):
+    # Returns [(account_number, password), ...] for the generated users
+    rng = random.Random(seed)
+    random.seed(seed)  # new_account_data draws account numbers from random
+    accounts = manager.user_model.bulk_create(generate_users(manager, users, rng))
+    account_numbers = [account["account_number"] for account in accounts]
+    if history:
+        manager.transaction_model.bulk_create(generate_history(account_numbers, history, rng))
+    # Stats as verify_stats rebuilds them, the opening balance absorbs
+    # whatever the random history doesn't add up to
+    manager.stats_model.bulk_create(
+        _rebuild_stats(
+            account["account_number"],
+            account["credits"],
+            manager.iter_transaction_history(account["account_number"]),
+        )
+        for account in accounts
+    )
+    return [(account["account_number"], account["password"]) for account in accounts]
+
+
+def create_store(path, users, history, storage="log", seed=0):
+    db = Database(path, storage=storage)
+    manager = AccountManager(db_instance=db)
+    accounts = populate(manager, users, history, seed)
+    with db._writing() as cache:
+        db.storage.replace(cache)  # Start from a compacted store, not a log
+    db.close()
+    return accounts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic store")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=10, help="ledger entries per user")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--storage", default="log", choices=STORAGE_ENGINES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if os.path.exists(args.out):
+        raise SystemExit(f"{args.out} already exists")
+
+    accounts = create_store(args.out, args.users, args.history, args.storage, args.seed)
+    print(f"Wrote {len(accounts)} users and {len(accounts) * args.history} transactions to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
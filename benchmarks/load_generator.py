@@ -0,0 +1,153 @@
+# Drives the HTTP/JSON server with many concurrent keep-alive clients and
+# reports requests per second and latency percentiles. Without --port it
+# starts a server on a temporary store with --accounts seeded accounts.
+#
+#   python -m benchmarks.load_generator --clients 1000 --requests 20000
+#   python -m benchmarks.load_generator --port 8080 --account 1234567890123:abcde
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import tempfile
+import time
+from multiprocessing import Process
+
+from account_manager import AccountManager
+from database import Database
+
+from benchmarks.bench_bulk import create_accounts
+
+
+def run_server(db_path, port, workers):
+    import server
+
+    manager = AccountManager(db_instance=Database(db_path))
+    server.serve(manager, port=port, max_workers=workers)
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples, pct):
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+async def request(reader, writer, path, body):
+    payload = json.dumps(body).encode()
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode()
+        + payload
+    )
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    status = int(head.split(b" ", 2)[1])
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(port, accounts, remaining, write_ratio, latencies, errors, rng):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            account_number, password = rng.choice(accounts)
+            body = {"account_number": account_number, "password": password}
+            if rng.random() < write_ratio:
+                path = "/deposit"
+                body["amount"] = rng.randint(1, 100)
+            else:
+                path = "/balance"
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, path, body)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors[0] += 1
+    finally:
+        writer.close()
+
+
+async def generate_load(port, accounts, args):
+    latencies, errors, remaining = [], [0], [args.requests]
+    rng = random.Random(0)
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            client(port, accounts, remaining, args.write_ratio, latencies, errors, rng)
+            for _ in range(args.clients)
+        )
+    )
+    return time.perf_counter() - start, sorted(latencies), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/JSON server load generator")
+    parser.add_argument("--port", type=int, help="an already running server")
+    parser.add_argument(
+        "--account",
+        action="append",
+        default=[],
+        metavar="NUMBER:PASSWORD",
+        help="account to use against --port, may be repeated",
+    )
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--write-ratio", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        process = None
+        if args.port:
+            port = args.port
+            accounts = [tuple(account.split(":", 1)) for account in args.account]
+            if not accounts:
+                raise SystemExit("--port needs at least one --account NUMBER:PASSWORD")
+        else:
+            db_path = os.path.join(tmp, "database.json")
+            db = Database(db_path)
+            manager = AccountManager(db_instance=db)
+            accounts = [(number, "abcde") for number in create_accounts(manager, args.accounts)]
+            db.close()
+            port = free_port()
+            process = Process(target=run_server, args=(db_path, port, args.workers))
+            process.start()
+            wait_for_port(port)
+
+        try:
+            elapsed, latencies, errors = asyncio.run(generate_load(port, accounts, args))
+        finally:
+            if process is not None:
+                os.kill(process.pid, signal.SIGINT)  # Lets the server close its store
+                process.join()
+
+    print(f"{len(latencies)} requests from {args.clients} clients in {elapsed:.2f}s")
+    print(f"throughput: {len(latencies) / elapsed:>10.0f} req/s")
+    for pct in (50, 95, 99, 99.9):
+        print(f"p{pct:<5}     {percentile(latencies, pct) * 1000:>10.2f} ms")
+    print(f"errors:     {errors:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# Times the Database and AccountManager hot paths against a synthetic store
+# and saves the results as JSON for benchmarks.compare.
+#
+#   python -m benchmarks.run --users 100000 --history 20 --output before.json
+#   python -m benchmarks.run --users 100000 --history 20 --output after.json
+#   python -m benchmarks.compare before.json after.json
+#
+# Each operation runs in a fresh process on its own copy of the store, so one
+# operation's writes and memory don't skew the next one's numbers. Reported
+# per operation: ops/s, p50/p95/p99 latency, the process's peak RSS (which
+# includes loading the store) and the bytes it wrote.
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from account_manager import AccountManager
+from database import Database
+from database.storage import STORAGE_ENGINES
+
+from benchmarks.datagen import create_store
+
+
+# Each operation is called as operation(run, account_number, password)
+OPERATIONS = {
+    "Database.find": lambda run, acc, pw: run.db.find("users", {"account_number": acc}),
+    "Database.find (scan)": lambda run, acc, pw: run.db.find("users", {"phone_number": acc}),
+    "Database.find_one": lambda run, acc, pw: run.db.find_one(
+        "users", {"account_number": acc}
+    ),
+    "Database.insert": lambda run, acc, pw: run.db.insert("bench", {"account_number": acc}),
+    "Database.update_one": lambda run, acc, pw: run.db.update_one(
+        "users", {"account_number": acc}, {"age": run.rng.randint(18, 90)}
+    ),
+    "AccountManager.create_account": lambda run, acc, pw: run.manager.create_account(
+        "bench", 30, "1990-01-01", "1234567890", 100
+    ),
+    "AccountManager.check_password": lambda run, acc, pw: run.manager.check_password(
+        acc, pw
+    ),
+    "AccountManager.get_balance": lambda run, acc, pw: run.manager.get_balance(acc),
+    "AccountManager.account_details": lambda run, acc, pw: run.manager.account_details(acc),
+    "AccountManager.get_transaction_history": lambda run, acc, pw: (
+        run.manager.get_transaction_history(acc, limit=20)
+    ),
+    "AccountManager.deposit": lambda run, acc, pw: run.manager.deposit(acc, 10),
+    "AccountManager.withdraw": lambda run, acc, pw: run.manager.withdraw(acc, 10),
+    "AccountManager.transfer_credits": lambda run, acc, pw: run.manager.transfer_credits(
+        acc, run.rng.choice(run.accounts)[0], 10
+    ),
+    "AccountManager._add_transaction": lambda run, acc, pw: run.manager._add_transaction(
+        {"account_number": acc}, "deposit", 10
+    ),
+}
+
+
+class Run:
+    def __init__(self, path, storage, accounts, seed):
+        self.db = Database(path, storage=storage)
+        self.manager = AccountManager(db_instance=self.db)
+        self.accounts = accounts
+        self.rng = random.Random(seed)
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def bytes_written():
+    # Bytes passed to write() by this process, None where /proc isn't there
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(path, storage, accounts, name, iterations, seed, results):
+    run = Run(path, storage, accounts, seed)
+    operation = OPERATIONS[name]
+    run.manager.get_balance(accounts[0][0])  # Load the store outside the timings
+
+    samples = []
+    written = bytes_written()
+    for _ in range(iterations):
+        account_number, password = run.rng.choice(accounts)
+        start = time.perf_counter()
+        operation(run, account_number, password)
+        samples.append(time.perf_counter() - start)
+    run.db.close()
+    if written is not None:
+        written = bytes_written() - written
+
+    samples.sort()
+    results.put(
+        {
+            "iterations": iterations,
+            "ops_per_sec": iterations / sum(samples),
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "bytes_written": written,
+        }
+    )
+
+
+def copy_store(source_dir, target_dir):
+    os.makedirs(target_dir)
+    for name in os.listdir(source_dir):
+        if not name.endswith(".lock"):
+            shutil.copy(os.path.join(source_dir, name), target_dir)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database and AccountManager benchmarks")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=10, help="ledger entries per user")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--storage", default="log", choices=STORAGE_ENGINES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--only", action="append", help="run only operations containing this text"
+    )
+    parser.add_argument("--output", metavar="FILE", help="save the results as JSON")
+    args = parser.parse_args()
+
+    names = list(OPERATIONS)
+    if args.only:
+        names = [name for name in names if any(text in name for text in args.only)]
+
+    # A clean interpreter per operation, so peak RSS isn't inherited
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir = os.path.join(tmp, "base")
+        os.makedirs(base_dir)
+        start = time.perf_counter()
+        accounts = create_store(
+            os.path.join(base_dir, "database.json"),
+            args.users,
+            args.history,
+            args.storage,
+            args.seed,
+        )
+        print(
+            f"Generated {args.users} users x {args.history} transactions "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+        print(
+            f"{'operation':<42}{'ops/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'RSS MB':>9}{'written':>12}"
+        )
+        for i, name in enumerate(names):
+            run_dir = os.path.join(tmp, f"run{i}")
+            copy_store(base_dir, run_dir)
+            queue = context.Queue()
+            process = context.Process(
+                target=measure,
+                args=(
+                    os.path.join(run_dir, "database.json"),
+                    args.storage,
+                    accounts,
+                    name,
+                    args.iterations,
+                    args.seed,
+                    queue,
+                ),
+            )
+            process.start()
+            row = results[name] = queue.get()
+            process.join()
+            shutil.rmtree(run_dir)
+            written = "-" if row["bytes_written"] is None else row["bytes_written"]
+            print(
+                f"{name:<42}{row['ops_per_sec']:>10.0f}{row['p50_ms']:>9.3f}"
+                f"{row['p95_ms']:>9.3f}{row['p99_ms']:>9.3f}"
+                f"{row['peak_rss_bytes'] / 2**20:>9.1f}{written:>12}"
+            )
+
+    if args.output:
+        report = {
+            "meta": {
+                "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "users": args.users,
+                "history": args.history,
+                "iterations": args.iterations,
+                "storage": args.storage,
+                "seed": args.seed,
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# Concurrent deposits, withdrawals and transfers against one store from
+# several threads and several processes, then checks that no update was lost:
+# the final money supply must equal the starting supply plus the net amount
+# every worker reports it deposited, and every account's stats must agree with
+# its transaction history.
+#
+#   python -m benchmarks.stress_concurrency --threads 4 --processes 4
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from multiprocessing import Process, Queue
+
+from account_manager import AccountManager
+from database import Database, ShardedDatabase
+from database.storage import STORAGE_ENGINES, LogStorage
+
+
+def open_database(db_path, engine, compact_bytes, shards=1):
+    if shards > 1:
+        return ShardedDatabase(db_path, shards=shards, storage=engine, parallel=False)
+    storage_class = STORAGE_ENGINES[engine]
+    if issubclass(storage_class, LogStorage) and compact_bytes is not None:
+        return Database(storage=storage_class(db_path, compact_bytes=compact_bytes))
+    return Database(db_path, storage=engine)
+
+
+def worker(
+    db_path,
+    engine,
+    compact_bytes,
+    shards,
+    columnar,
+    account_numbers,
+    operations,
+    seed,
+    results,
+    manager=None,
+):
+    rng = random.Random(seed)
+    owns_manager = manager is None
+    if owns_manager:
+        manager = AccountManager(
+            db_instance=open_database(db_path, engine, compact_bytes, shards), columnar=columnar
+        )
+    net_deposits = 0
+    for _ in range(operations):
+        account_number = rng.choice(account_numbers)
+        amount = rng.randint(1, 50)
+        choice = rng.random()
+        if choice < 0.4:
+            if manager.deposit(account_number, amount).startswith("Deposited"):
+                net_deposits += amount
+        elif choice < 0.6:
+            if manager.withdraw(account_number, amount).startswith("Withdrew"):
+                net_deposits -= amount
+        else:
+            manager.transfer_credits(account_number, rng.choice(account_numbers), amount)
+        manager.get_balance(account_number)
+    if owns_manager:
+        manager.db.close()
+    results.put(net_deposits)
+
+
+def total_supply(db_path, engine, shards, account_numbers):
+    db = open_database(db_path, engine, None, shards)
+    manager = AccountManager(db_instance=db)
+    supply = sum(manager.get_balance(account_number) for account_number in account_numbers)
+    db.close()
+    return supply
+
+
+def stats_drift(db_path, engine, shards):
+    db = open_database(db_path, engine, None, shards)
+    drift = AccountManager(db_instance=db).verify_stats()
+    db.close()
+    return drift
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database concurrency stress test")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--operations", type=int, default=200)
+    # Small values force log compactions while the workers are running
+    parser.add_argument("--storage", default="log", choices=STORAGE_ENGINES)
+    parser.add_argument("--compact-bytes", type=int, default=16 * 1024 * 1024)
+    parser.add_argument("--columnar", action="store_true", help="keep users as columns")
+    parser.add_argument("--shards", type=int, default=1, help="split the store into shards")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "database.json")
+        manager = AccountManager(
+            db_instance=open_database(db_path, args.storage, args.compact_bytes, args.shards),
+            columnar=args.columnar,
+        )
+        account_numbers = [
+            manager.create_account(f"user{i}", 30, "1990-01-01", "1234567890", 1000)[
+                "account_number"
+            ]
+            for i in range(args.accounts)
+        ]
+        initial = total_supply(db_path, args.storage, args.shards, account_numbers)
+
+        results = Queue()
+        workers = [
+            Process(
+                target=worker,
+                args=(
+                    db_path,
+                    args.storage,
+                    args.compact_bytes,
+                    args.shards,
+                    args.columnar,
+                    account_numbers,
+                    args.operations,
+                    seed,
+                    results,
+                ),
+            )
+            for seed in range(args.processes)
+        ]
+        # The threads share one AccountManager, and so one Database instance
+        workers += [
+            threading.Thread(
+                target=worker,
+                args=(
+                    db_path,
+                    args.storage,
+                    args.compact_bytes,
+                    args.shards,
+                    args.columnar,
+                    account_numbers,
+                    args.operations,
+                    seed,
+                    results,
+                    manager,
+                ),
+            )
+            for seed in range(args.processes, args.processes + args.threads)
+        ]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+
+        net_deposits = sum(results.get() for _ in workers)
+        manager.db.close()
+        final = total_supply(db_path, args.storage, args.shards, account_numbers)
+        expected = initial + net_deposits
+        total_ops = len(workers) * args.operations
+        print(f"{total_ops} operations in {elapsed:.2f}s ({total_ops / elapsed:.0f} ops/s)")
+        print(f"initial supply {initial}, net deposits {net_deposits}")
+        print(f"final supply {final}, expected {expected}")
+        if final != expected:
+            raise SystemExit("FAILED: money supply not conserved")
+        print("OK: money supply conserved")
+        drift = stats_drift(db_path, args.storage, args.shards)
+        if drift:
+            raise SystemExit(f"FAILED: stats of {len(drift)} accounts drifted")
+        print("OK: account stats match the ledger")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import csv
+import json
+
+
+# Operations files are either CSV with a header row of
+#   op,account_number,amount,recipient
+# or JSONL with one {"op": ..., "account_number": ..., "amount": ...} object
+# per line. op is deposit, withdraw or transfer, recipient is only used by
+# transfers. A line that isn't JSON is yielded as {"error": message}.
+def read_operations(path):
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".json")):
+            for number, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        # Reported as an invalid row by bulk_apply
+                        yield {"error": f"line {number} is not valid JSON ({e})"}
+        else:
+            for row in csv.DictReader(f):
+                row["amount"] = parse_amount(row.get("amount"))
+                yield row
+
+
+def parse_amount(value):
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        return value  # Reported as an invalid row by bulk_apply
+    return int(amount) if amount.is_integer() else amount
+
+
+def apply_file(account_manager, path, report_path=None):
+    # Streams the file into AccountManager.bulk_apply and optionally writes
+    # the per-row results as JSONL
+    results = account_manager.bulk_apply(read_operations(path))
+    if report_path:
+        with open(report_path, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    return results
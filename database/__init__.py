@@ -1,5 +1,6 @@
 from database.database import Database
 from database.model import Model
 from database.schema import Schema
+from database.shard import ShardedDatabase
 
-__all__ = [Database, Model, Schema]
+__all__ = [Database, Model, Schema, ShardedDatabase]
@@ -0,0 +1,233 @@
+# Online backups of a log or msgpack store. The first backup copies the
+# snapshot and logs, later ones only the log records committed since the
+# previous backup. Both read a Database.checkpoint, so deposits and transfers
+# carry on while they run.
+#
+#   python -m database.backup create database.json backups/
+#   python -m database.backup list backups/
+#   python -m database.backup restore backups/ restored.json [--seq N]
+#
+# backups/manifest.json lists the backups in order:
+#   {"store": path, "engine": name, "backups": [
+#       {"kind": "full", "seq": n, "snapshot": file, "log": file, "logs": {...}},
+#       {"kind": "incremental", "since": m, "seq": n, "log": file, "logs": {...}}]}
+# "logs" maps each log file read to the length read from it, so the next
+# backup starts reading where this one stopped.
+import argparse
+import json
+import os
+import shutil
+
+from database.database import Database
+from database.shard import ShardedDatabase
+from database.storage import STORAGE_ENGINES, _write_atomic
+
+MANIFEST = "manifest.json"
+
+
+def _read_manifest(backup_dir):
+    try:
+        with open(os.path.join(backup_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _engine_name(storage):
+    for name, cls in STORAGE_ENGINES.items():
+        if type(storage) is cls and hasattr(cls, "checkpoint"):
+            return name
+    raise ValueError(f"Backups need the log or msgpack storage engine, not {type(storage).__name__}")
+
+
+def _log_key(f):
+    # Names a log file across backups: its inode, which a rename to .log.old
+    # keeps, and its first record's seq, which tells a new file that reused
+    # the inode apart
+    f.seek(0)
+    first = f.readline()
+    try:
+        seq = json.loads(first)["seq"]
+    except ValueError:
+        seq = None
+    return f"{os.fstat(f.fileno()).st_ino}:{seq}"
+
+
+def _read_records(logs, offsets, since):
+    # Returns (raw log lines with a seq above since, their highest seq, the
+    # length read per log). offsets are where the previous backup stopped.
+    lines, last_seq, read = [], since, {}
+    for f, length in logs:
+        key = _log_key(f)
+        start = min(offsets.get(key, 0), length)
+        f.seek(start)
+        position = start
+        for line in f.read(length - start).splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # A torn write, the next load truncates it
+            try:
+                seq = json.loads(line)["seq"]
+            except ValueError:
+                break
+            position += len(line)
+            if seq > since:
+                lines.append(line)
+                last_seq = max(last_seq, seq)
+        read[key] = position
+    return lines, last_seq, read
+
+
+def _copy_atomic(f, path):
+    tmp_path = f"{path}.tmp"
+    f.seek(0)
+    with open(tmp_path, "wb") as out:
+        shutil.copyfileobj(f, out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+
+
+def backup(db, backup_dir, full=False):
+    # Adds a backup of db to backup_dir and returns its manifest entry, or
+    # the latest entry if nothing was committed since. Incremental unless
+    # full, there is no backup yet, or a compaction has folded records the
+    # last backup doesn't have into the snapshot.
+    if isinstance(db, ShardedDatabase):
+        raise ValueError(
+            "A ShardedDatabase is backed up one shard at a time: back up each "
+            "of db.shards to a backup directory of its own"
+        )
+    engine = _engine_name(db.storage)
+    store = os.path.abspath(db.db_path)
+    os.makedirs(backup_dir, exist_ok=True)
+    manifest = _read_manifest(backup_dir) or {"store": store, "engine": engine, "backups": []}
+    if manifest["store"] != store or manifest["engine"] != engine:
+        raise ValueError(f"{backup_dir} holds backups of {manifest['store']}")
+    previous = manifest["backups"][-1] if manifest["backups"] else None
+
+    with db.checkpoint() as (snapshot, logs):
+        snapshot_seq = db.storage._snapshot_seq(snapshot)
+        if previous is None or previous["seq"] < snapshot_seq:
+            full = True
+        if full:
+            lines, seq, read = _read_records(logs, {}, snapshot_seq)
+            seq = max(seq, snapshot_seq)
+            entry = {
+                "kind": "full",
+                "seq": seq,
+                "snapshot": f"full-{seq:012d}.snapshot",
+                "log": f"full-{seq:012d}.log",
+                "logs": read,
+            }
+            _copy_atomic(snapshot, os.path.join(backup_dir, entry["snapshot"]))
+        else:
+            lines, seq, read = _read_records(logs, previous["logs"], previous["seq"])
+            if not lines:
+                return previous
+            entry = {
+                "kind": "incremental",
+                "since": previous["seq"],
+                "seq": seq,
+                "log": f"incremental-{seq:012d}.log",
+                "logs": read,
+            }
+    _write_atomic(os.path.join(backup_dir, entry["log"]), b"".join(lines))
+    manifest["backups"].append(entry)
+    _write_atomic(os.path.join(backup_dir, MANIFEST), json.dumps(manifest, indent=4))
+    return entry
+
+
+def restore(backup_dir, target_path, seq=None, overwrite=False):
+    # Rebuilds the store as of seq, the latest backup by default, at
+    # target_path from the last full backup up to it and the incremental
+    # ones after that. Returns the documents per collection.
+    manifest = _read_manifest(backup_dir)
+    if not manifest or not manifest["backups"]:
+        raise ValueError(f"No backups in {backup_dir}")
+    if os.path.exists(target_path) and not overwrite:
+        raise ValueError(f"{target_path} already exists")
+    backups = manifest["backups"]
+    if seq is None:
+        seq = backups[-1]["seq"]
+    if seq > backups[-1]["seq"]:
+        raise ValueError(f"The backups only reach seq {backups[-1]['seq']}")
+    fulls = [i for i, entry in enumerate(backups) if entry["kind"] == "full" and entry["seq"] <= seq]
+    if not fulls:
+        raise ValueError(f"No full backup is as old as seq {seq}")
+
+    lines = []
+    for i, entry in enumerate(backups[fulls[-1] :]):
+        if i and entry["kind"] == "full":
+            # Taken after a compaction, the commits in between are only in
+            # its snapshot
+            raise ValueError(
+                f"Commits after seq {backups[fulls[-1] + i - 1]['seq']} up to "
+                f"{entry['seq']} can only be restored together"
+            )
+        with open(os.path.join(backup_dir, entry["log"]), "rb") as f:
+            lines.extend(line for line in f if json.loads(line)["seq"] <= seq)
+        if entry["seq"] >= seq:
+            break
+    with open(os.path.join(backup_dir, backups[fulls[-1]]["snapshot"]), "rb") as f:
+        _copy_atomic(f, target_path)
+    storage = STORAGE_ENGINES[manifest["engine"]](target_path)
+    for path in (storage.old_log_path, storage.log_path):
+        if os.path.exists(path):
+            os.remove(path)
+    _write_atomic(storage.log_path, b"".join(lines))
+    try:
+        db = storage.load()
+        return {name: len(collection) for name, collection in db.items()}
+    finally:
+        storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up and restore a store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="add a backup, incremental when possible")
+    create.add_argument("store")
+    create.add_argument("backup_dir")
+    create.add_argument("--storage", default="log", choices=STORAGE_ENGINES)
+    create.add_argument("--full", action="store_true")
+    listing = commands.add_parser("list", help="show the backups")
+    listing.add_argument("backup_dir")
+    restoring = commands.add_parser("restore", help="rebuild a store from the backups")
+    restoring.add_argument("backup_dir")
+    restoring.add_argument("target")
+    restoring.add_argument("--seq", type=int, help="restore as of this commit, default the latest")
+    restoring.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "create":
+            manifest = _read_manifest(args.backup_dir)
+            taken = len(manifest["backups"]) if manifest else 0
+            db = Database(args.store, storage=args.storage)
+            try:
+                entry = backup(db, args.backup_dir, full=args.full)
+            finally:
+                db.close()
+            if len(_read_manifest(args.backup_dir)["backups"]) == taken:
+                print(f"Nothing committed since the backup up to seq {entry['seq']}")
+            else:
+                print(f"{entry['kind']} backup up to seq {entry['seq']}")
+        elif args.command == "list":
+            manifest = _read_manifest(args.backup_dir)
+            if not manifest:
+                raise ValueError(f"No backups in {args.backup_dir}")
+            print(f"{manifest['store']} ({manifest['engine']})")
+            for entry in manifest["backups"]:
+                files = [entry["log"]] + ([entry["snapshot"]] if "snapshot" in entry else [])
+                size = sum(os.path.getsize(os.path.join(args.backup_dir, name)) for name in files)
+                print(f"{entry['kind']:>12} seq {entry['seq']:>10} {size / 1e6:>10.2f} MB")
+        else:
+            counts = restore(args.backup_dir, args.target, args.seq, args.overwrite)
+            for name, count in counts.items():
+                print(f"{name}: {count} documents")
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+
+if __name__ == "__main__":
+    main()
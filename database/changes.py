@@ -0,0 +1,191 @@
+# Change data capture: every Database opened with changes=True appends the
+# operations it commits to DB_PATH.changes, one event per JSON line, numbered
+# by seq across every process writing the store:
+#   {"seq": n, "op": "insert", "c": collection, "doc": {...}}
+#   {"seq": n, "op": "update", "c": collection, "id": _id, "set": {...}}
+#   {"seq": n, "op": "delete", "c": collection, "id": _id}
+# Database.subscribe delivers a process's own events as they commit, a
+# ChangeReader tails the file for everyone's and resumes from a checkpoint:
+#
+#   python -m database.changes database.json --checkpoint fraud.checkpoint --follow
+#
+# Compaction never touches the feed, it grows by every commit until removed.
+# To start over, stop the writers and readers and delete the feed together
+# with every reader's checkpoint: the next event is seq 1 again, which a
+# reader still holding a later seq would skip.
+import argparse
+import json
+import logging
+import os
+import time
+
+from database.storage import _plain
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    # Events are appended after their commit, under the store's exclusive
+    # file lock, and flushed but not fsynced: a crash can lose the last
+    # events, but never publish a change that wasn't committed
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._seq = 0
+        # Size of the file after our last append, anything else means another
+        # process appended since and the last seq has to be read again
+        self._size = None
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def notify(self, events):
+        # Runs after the commit, so a failing subscriber is logged and
+        # skipped rather than failing the write that triggered it
+        for callback in list(self._subscribers):
+            try:
+                for event in events:
+                    callback(event)
+            except Exception:
+                logger.exception("Change subscriber %r failed", callback)
+
+    def append(self, ops):
+        # Returns the events for ops, the caller holds the file lock
+        if self._file is not None and _inode(self.path) != os.fstat(self._file.fileno()).st_ino:
+            self.close()  # The feed was moved away, start the new one
+        if self._file is None:
+            self._file = open(self.path, "a+b")
+            self._size = None
+        size = os.fstat(self._file.fileno()).st_size
+        if size != self._size:
+            size = self._read_last_seq(size)
+        events = []
+        for op in ops:
+            self._seq += 1
+            events.append({"seq": self._seq, **op})
+        data = "".join(
+            json.dumps(event, separators=(",", ":"), default=_plain) + "\n" for event in events
+        ).encode()
+        self._file.write(data)
+        self._file.flush()
+        self._size = size + len(data)
+        return events
+
+    def _read_last_seq(self, size):
+        # Sets _seq from the last line and returns the file's size, after
+        # cutting off a line a crashed writer left unfinished
+        chunk = 4096
+        while True:
+            start = max(0, size - chunk)
+            self._file.seek(start)
+            data = self._file.read(size - start)
+            head, _, last = data.rstrip(b"\n").rpartition(b"\n")
+            if head or start == 0:
+                break
+            chunk *= 4
+        if not data or data.endswith(b"\n"):
+            self._seq = json.loads(last)["seq"] if last else 0
+            return size
+        self._file.truncate(size - len(last))
+        return self._read_last_seq(size - len(last))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+class ChangeReader:
+    # Reads a change feed from where it left off, so a poll costs only the
+    # events written since. commit() saves the position to the checkpoint
+    # file, if given, for the next reader to resume from: committing after
+    # handling a batch means no event is missed if the consumer stops.
+    def __init__(self, path, checkpoint=None):
+        self.path = path
+        self.checkpoint = checkpoint
+        self.seq = 0
+        self._offset = 0
+        self._inode = None
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                saved = json.load(f)
+            self.seq, self._offset, self._inode = saved["seq"], saved["offset"], saved["inode"]
+
+    def poll(self, limit=None):
+        # The events after the last one read, oldest first
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # Another file than last time, read it through and go by seq
+            self._inode, self._offset = stat.st_ino, 0
+        events = []
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Still being written
+                self._offset += len(line)
+                event = json.loads(line)
+                if event["seq"] > self.seq:
+                    self.seq = event["seq"]
+                    events.append(event)
+                    if limit is not None and len(events) >= limit:
+                        break
+        return events
+
+    def follow(self, interval=0.5):
+        # Yields events as they are written, forever
+        while True:
+            events = self.poll()
+            yield from events
+            if not events:
+                time.sleep(interval)
+
+    def commit(self):
+        if self.checkpoint is None:
+            return
+        tmp_path = f"{self.checkpoint}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"seq": self.seq, "offset": self._offset, "inode": self._inode}, f)
+        os.replace(tmp_path, self.checkpoint)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a store's change events")
+    parser.add_argument("store", help="the store, its feed is STORE.changes")
+    parser.add_argument("--checkpoint", help="resume from and save the position here")
+    parser.add_argument("--collection", help="only events for this collection")
+    parser.add_argument("--follow", action="store_true", help="keep waiting for new events")
+    parser.add_argument("--interval", type=float, default=0.5)
+    args = parser.parse_args()
+
+    reader = ChangeReader(f"{args.store}.changes", args.checkpoint)
+    try:
+        while True:
+            for event in reader.poll():
+                if args.collection is None or event["c"] == args.collection:
+                    print(json.dumps(event), flush=True)
+            reader.commit()
+            if not args.follow:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass  # The batch being printed is read again next time
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+from array import array
+from collections.abc import Mapping, Sequence
+
+# A collection kept column by column instead of as one dict per document, for
+# large collections with a fixed schema such as users. Integer and float
+# fields live in typed arrays and strings in one packed UTF-8 buffer per
+# field, so a document costs less than a quarter of its dict.
+#
+# Documents are handed out as Row objects, mappings that read their values
+# from the columns on access. Storing a new document in a row's slot detaches
+# the old Row first: it copies out its values and keeps them, so views of it
+# still show the document as it was, as with plain dict collections. Deleting
+# documents leaves Database with a plain list of rows until the next load.
+
+_MISSING = object()
+
+
+class _IntColumn:
+    # Starts as an array of bytes and widens as larger values arrive
+    TYPECODES = ("b", "h", "i", "q")
+
+    def __init__(self):
+        self.values = array("b")
+
+    def get(self, i):
+        return self.values[i]
+
+    def has(self, i):
+        return True
+
+    def _check(self, value):
+        # bool is an int, but must come back as a bool
+        if type(value) is not int:
+            raise TypeError(value)
+
+    def _widen(self):
+        position = self.TYPECODES.index(self.values.typecode) + 1
+        if position == len(self.TYPECODES):
+            raise OverflowError("int too large for a 64-bit column")
+        self.values = array(self.TYPECODES[position], self.values)
+
+    def append(self, value):
+        self._check(value)
+        while True:
+            try:
+                self.values.append(value)
+                return
+            except OverflowError:
+                self._widen()
+
+    def set(self, i, value):
+        self._check(value)
+        while True:
+            try:
+                self.values[i] = value
+                return
+            except OverflowError:
+                self._widen()
+
+    def pop(self):
+        self.values.pop()
+
+    def trim(self):
+        self.values = array(self.values.typecode, self.values)
+
+
+class _FloatColumn(_IntColumn):
+    def __init__(self):
+        self.values = array("d")
+
+    def append(self, value):
+        if type(value) is not float:
+            raise TypeError(value)
+        self.values.append(value)
+
+    def set(self, i, value):
+        if type(value) is not float:
+            raise TypeError(value)
+        self.values[i] = value
+
+
+class _StrColumn:
+    # Strings encoded into one bytearray. While every value has the same
+    # length in bytes, as account numbers and dates do, row i is simply the
+    # i-th width bytes. After that each is a (start, length) slice: an
+    # overwrite that doesn't fit in place is appended, and the buffer is
+    # repacked once more than half of it is stale.
+    def __init__(self):
+        self.data = bytearray()
+        self.width = None
+        self.count = 0
+        self.starts = None
+        self.lengths = None
+        self.stale = 0
+
+    def _encode(self, value):
+        if type(value) is not str:
+            raise TypeError(value)
+        encoded = value.encode()
+        if len(encoded) > 0xFFFF or len(self.data) + len(encoded) > 0xFFFFFFFF:
+            raise OverflowError(value)
+        if self.starts is None and len(encoded) != self.width:
+            if self.count:
+                self._unfix()
+            else:
+                self.width = len(encoded)
+        return encoded
+
+    def _unfix(self):
+        width = self.width
+        self.starts = array("I", range(0, self.count * width, width))
+        self.lengths = array("H", [width]) * self.count
+
+    def get(self, i):
+        if self.starts is None:
+            width = self.width
+            i = range(self.count)[i] * width
+            return self.data[i : i + width].decode()
+        start = self.starts[i]
+        return self.data[start : start + self.lengths[i]].decode()
+
+    def has(self, i):
+        return True
+
+    def append(self, value):
+        encoded = self._encode(value)
+        if self.starts is not None:
+            self.starts.append(len(self.data))
+            self.lengths.append(len(encoded))
+        self.data += encoded
+        self.count += 1
+
+    def set(self, i, value):
+        encoded = self._encode(value)
+        if self.starts is None:
+            start = i * self.width
+            self.data[start : start + self.width] = encoded
+            return
+        length = self.lengths[i]
+        if len(encoded) <= length:
+            start = self.starts[i]
+            self.data[start : start + len(encoded)] = encoded
+            self.stale += length - len(encoded)
+        else:
+            self.starts[i] = len(self.data)
+            self.data += encoded
+            self.stale += length
+        self.lengths[i] = len(encoded)
+        if self.stale > 4096 and self.stale * 2 > len(self.data):
+            self._repack()
+
+    def pop(self):
+        self.count -= 1
+        if self.starts is None:
+            del self.data[self.count * self.width :]
+            return
+        start, length = self.starts.pop(), self.lengths.pop()
+        if start + length == len(self.data):
+            del self.data[start:]
+        else:
+            self.stale += length
+
+    def trim(self):
+        self.data = bytearray(self.data)
+        if self.starts is not None:
+            self.starts = array("I", self.starts)
+            self.lengths = array("H", self.lengths)
+
+    def _repack(self):
+        data = bytearray()
+        for i, start in enumerate(self.starts):
+            self.starts[i] = len(data)
+            data += self.data[start : start + self.lengths[i]]
+        self.data = data
+        self.stale = 0
+
+
+class _ObjectColumn:
+    # Any values at all, including missing ones. A typed column turns into
+    # one the first time it is given a value it can't hold.
+    def __init__(self, values=()):
+        self.values = list(values)
+
+    def get(self, i):
+        return self.values[i]
+
+    def has(self, i):
+        return self.values[i] is not _MISSING
+
+    def append(self, value):
+        self.values.append(value)
+
+    def set(self, i, value):
+        self.values[i] = value
+
+    def pop(self):
+        self.values.pop()
+
+    def trim(self):
+        self.values = list(self.values)
+
+
+def _column(field_type):
+    if field_type is int:
+        return _IntColumn()
+    if field_type is float:
+        return _FloatColumn()
+    if field_type is str:
+        return _StrColumn()
+    return _ObjectColumn()
+
+
+class Row(Mapping):
+    # Each ColumnStore has its own subclass with _store set, so a row only
+    # holds its slot number. A detached row is a plain Row holding a dict.
+    __slots__ = ("_i",)
+    _store = None
+
+    def __getitem__(self, key):
+        if self._store is None:
+            return self._i[key]
+        return self._store._get(self._i, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        if self._store is None:
+            return iter(self._i)
+        return self._store._keys(self._i)
+
+    def __len__(self):
+        if self._store is None:
+            return len(self._i)
+        return sum(1 for _ in self._store._keys(self._i))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def _detach(self):
+        values = dict(self)
+        self.__class__ = Row
+        self._i = values
+
+
+class ColumnStore(Sequence):
+    def __init__(self, fields, documents=()):
+        # fields maps field names to types, as in a Schema. Fields a document
+        # has beyond those are kept for it separately.
+        self._columns = {"_id": _column(int)}
+        for field, field_type in fields.items():
+            self._columns[field] = _column(field_type)
+        self._extra = {}
+        self._rows = []
+        self._row = type("Row", (Row,), {"__slots__": (), "_store": self})
+        for document in documents:
+            self.append(document)
+        self._trim()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, i):
+        return self._rows[i]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def index(self, row):
+        # Rows know their slot, no need to search for them
+        i = getattr(row, "_i", None)
+        if type(i) is int and i < len(self._rows) and self._rows[i] is row:
+            return i
+        raise ValueError("row is not in this ColumnStore")
+
+    def __setitem__(self, i, document):
+        i = range(len(self._rows))[i]
+        current = self._rows[i]
+        if document is current:
+            return
+        current._detach()
+        self._write(i, document)
+        if type(document) is Row:
+            row = document  # A detached row going back, e.g. on a rollback
+            row.__class__ = self._row
+        else:
+            row = self._row()
+        row._i = i
+        self._rows[i] = row
+
+    def append(self, document):
+        self._write(len(self._rows), document)
+        row = self._row()
+        row._i = len(self._rows)
+        self._rows.append(row)
+
+    def pop(self):
+        row = self._rows[-1]
+        row._detach()
+        self._rows.pop()
+        for column in self._columns.values():
+            column.pop()
+        self._extra.pop(len(self._rows), None)
+        return row
+
+    def _trim(self):
+        # Growing by appends leaves spare capacity everywhere, copies don't
+        self._rows = list(self._rows)
+        for column in self._columns.values():
+            column.trim()
+
+    def _write(self, i, document):
+        appending = i == len(self._rows)
+        for field, column in self._columns.items():
+            value = document.get(field, _MISSING)
+            try:
+                column.append(value) if appending else column.set(i, value)
+            except (TypeError, ValueError, OverflowError):
+                column = self._columns[field] = _ObjectColumn(
+                    column.get(j) for j in range(len(self._rows))
+                )
+                column.append(value) if appending else column.set(i, value)
+        extra = {k: v for k, v in document.items() if k not in self._columns}
+        if extra:
+            self._extra[i] = extra
+        else:
+            self._extra.pop(i, None)
+
+    def _get(self, i, field):
+        column = self._columns.get(field)
+        if column is None:
+            return self._extra.get(i, {})[field]
+        value = column.get(i)
+        if value is _MISSING:
+            raise KeyError(field)
+        return value
+
+    def _keys(self, i):
+        for field, column in self._columns.items():
+            if column.has(i):
+                yield field
+        yield from self._extra.get(i, ())
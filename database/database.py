@@ -1,71 +1,724 @@
-import json
+import bisect
 import os
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from itertools import islice
+from types import MappingProxyType
+
+from database.changes import ChangeFeed
+from database.columnar import ColumnStore
+from database.index import HashIndex
+from database.lock import FileLock, ReadWriteLock
+from database.metrics import NULL_METRICS
+from database.query import compile_query, normalize_sort, project, sort_documents
+from database.storage import STORAGE_ENGINES
+from database.transaction import Transaction
+
+
+def _timed(name):
+    # Times a public operation under name in the database's metrics
+    def decorate(method):
+        @wraps(method)
+        def timed(self, *args, **kwargs):
+            with self.metrics.timer(name, sample=True):
+                return method(self, *args, **kwargs)
+
+        return timed
+
+    return decorate
+
+
+def _document_id(doc):
+    return doc["_id"]
 
 
 class Database:
-    def __init__(self, db_path="database.json"):
-        self.db_path = db_path
-        if not os.path.exists(self.db_path):
-            with open(self.db_path, "w") as f:
-                json.dump({}, f)  # Initialize with an empty dictionary
+    def __init__(
+        self,
+        db_path="database.json",
+        storage="log",
+        commit_window=None,
+        commit_max_ops=256,
+        metrics=None,
+        changes=False,
+    ):
+        # storage is an engine name from STORAGE_ENGINES or a ready instance
+        if isinstance(storage, str):
+            storage = STORAGE_ENGINES[storage](db_path)
+        if commit_window is not None and not hasattr(storage, "sync"):
+            raise ValueError(
+                f"{type(storage).__name__} does not support group commit"
+            )
+        self.storage = storage
+        self.db_path = storage.path
+        # A database.metrics.Metrics to instrument this database, its storage
+        # and its models with. The default records nothing.
+        self.metrics = metrics or NULL_METRICS
+        self.storage.metrics = self.metrics
+        # Parsed collections are kept resident between calls and only
+        # reloaded when the storage reports a change made by another writer.
+        self._cache = None
+        # {collection_name: {field: HashIndex}}, rebuilt whenever the cache is
+        # reloaded
+        self._indexes = {}
+        self._built_indexes = set()
+        # {collection_name: {_id: position in the collection list}}, see
+        # _position
+        self._positions = {}
+        # {collection_name: fields} of the collections kept as ColumnStores
+        self._columnar = {}
+        self._next_ids = {}
+        self._transaction = None
+        # Readers share the cache, writers (and open transactions) hold it
+        # exclusively, both in this process and across processes
+        self._lock = ReadWriteLock()
+        self._file_lock = FileLock(f"{self.db_path}.lock")
+        self._index_mutex = threading.Lock()
+        # Group commit: with a commit_window, a write returns once the log
+        # record is written, then waits for an fsync shared with every other
+        # write that landed in the meantime. One waiting thread performs it,
+        # after up to commit_window seconds or commit_max_ops operations.
+        self.commit_window = commit_window
+        self.commit_max_ops = commit_max_ops
+        self._commit_mutex = threading.Lock()
+        self._batch_full = threading.Event()
+        self._unsynced_ops = 0
+        self._pending_seq = threading.local()
+        # The store file is created on first use, under the file lock, so
+        # opening a Database does no I/O
+        self._created = False
+        # changes publishes every commit to a database.changes.ChangeFeed.
+        # Every process writing the store needs it for the feed to be whole.
+        self.changes = ChangeFeed(f"{self.db_path}.changes") if changes else None
+        # Events committed by this thread, delivered to subscribers once the
+        # write lock is released
+        self._unsent_events = threading.local()
+
+    @contextmanager
+    def _writing(self):
+        if self._lock.is_writer():
+            yield self._load_db()  # Already held, e.g. inside a transaction
+            return
+        with self._lock.write(), self._file_lock.exclusive():
+            yield self._load_db()
+        self._wait_durable()
+        self._send_events()
+
+    def subscribe(self, callback):
+        # Calls callback(event) for each change this process commits, after
+        # the commit, see database.changes
+        if self.changes is None:
+            raise ValueError("Open the Database with changes=True to subscribe")
+        return self.changes.subscribe(callback)
+
+    def unsubscribe(self, callback):
+        self.changes.unsubscribe(callback)
+
+    def _publish(self, ops):
+        # Called under the write lock once ops are committed
+        if self.changes is None:
+            return
+        events = self.changes.append(ops)
+        if self.changes._subscribers:
+            unsent = getattr(self._unsent_events, "events", None) or []
+            self._unsent_events.events = unsent + events
+
+    def _send_events(self):
+        events = getattr(self._unsent_events, "events", None)
+        if events:
+            self._unsent_events.events = None
+            self.changes.notify(events)
+
+    def _wait_durable(self):
+        seq = getattr(self._pending_seq, "seq", None)
+        if seq is None:
+            return
+        self._pending_seq.seq = None
+        with self.metrics.timer("durable_wait"), self._commit_mutex:
+            if self.storage.synced_seq >= seq:
+                return  # Made durable by the thread that held the mutex before us
+            if self.commit_window:
+                self._batch_full.wait(self.commit_window)
+            self._batch_full.clear()
+            self._unsynced_ops = 0
+            self.storage.sync()
+
+    @contextmanager
+    def _reading(self):
+        if self._lock.is_writer():
+            yield self._load_db()
+            return
+        while True:
+            # Reloading replaces the cache, so it happens under the write lock
+            if self._cache is None or self.storage.changed():
+                with self._writing():
+                    pass
+            with self._lock.read(), self._file_lock.shared():
+                db = self._cache
+                if db is not None:
+                    yield db
+                    return
 
     def _load_db(self):
-        with open(self.db_path, "r") as f:
-            return json.load(f)
+        # Never reload underneath an open transaction, it would drop its work
+        if self._cache is None:
+            self._reload()
+        elif self._transaction is None and self.storage.changed():
+            with self.metrics.timer("load_tail"):
+                ops = self.storage.read_tail()
+                if ops is not None:
+                    self._replay(self._cache, ops)
+            if ops is None:
+                self._reload()
+        return self._cache
+
+    def _reload(self):
+        if not self._created:
+            self.storage.create()
+            self._created = True
+        self.metrics.count("cache_reloads")
+        with self.metrics.timer("load"):
+            self._cache = self.storage.load()
+            for collection_name in self._columnar:
+                self._store_columns(self._cache, collection_name)
+        self._built_indexes.clear()
+        self._positions.clear()
+        self._next_ids.clear()
+
+    def _replay(self, db, ops):
+        # Apply operations committed by another process to the cache, keeping
+        # indexes current instead of rebuilding everything
+        for op in ops:
+            name = op["c"]
+            if op["op"] == "insert":
+                indexes = self._get_indexes(db, name)
+                # Freshly parsed, nothing else refers to it
+                doc = self._append_document(db, name, op["doc"])
+                self._index_document(indexes, doc)
+                if name in self._next_ids:
+                    self._next_ids[name] = max(self._next_ids[name], doc["_id"] + 1)
+                continue
+            indexes = self._get_indexes(db, name)
+            bounds = {"$gte": op["id"], "$lte": op["id"]}
+            collection, start, stop = self._collection_range(db, name, {"_id": bounds})
+            for i in range(start, stop):
+                doc = collection[i]
+                if op["op"] == "update":
+                    self._replace_document(db, name, indexes, doc, {**doc, **op["set"]})
+                else:
+                    self._unindex_document(indexes, doc)
+                    db[name] = [d for d in db[name] if d is not doc]
+                break
+
+    def _save_db(self, db_content, ops):
+        if self._transaction is not None:
+            self._transaction.ops.extend(ops)
+            return
+        self.metrics.count("committed_ops", len(ops))
+        try:
+            if self.commit_window is None:
+                with self.metrics.timer("commit"):
+                    self.storage.commit(db_content, ops)
+            else:
+                # Still under the write lock, the fsync happens in
+                # _wait_durable once it is released
+                with self.metrics.timer("commit"):
+                    self._pending_seq.seq = self.storage.commit(db_content, ops, sync=False)
+                self._unsynced_ops += len(ops)
+                if self._unsynced_ops >= self.commit_max_ops:
+                    self._batch_full.set()
+        except Exception:
+            # The cache is ahead of what was persisted, reload on the next call
+            self._cache = None
+            self._built_indexes.clear()
+            raise
+        self._publish(ops)
+
+    @contextmanager
+    def checkpoint(self):
+        # The store's files as of one point in time, for database.backup:
+        # (snapshot file, [(log file, length)]). Writers only wait while the
+        # files are opened, not while they are read.
+        if not hasattr(self.storage, "checkpoint"):
+            raise ValueError(f"{type(self.storage).__name__} does not support checkpoints")
+        if not os.path.exists(self.db_path):
+            raise ValueError(f"No store at {self.db_path}")
+        if self._lock.is_writer():
+            snapshot, logs = self.storage.checkpoint()  # Already exclusive
+        else:
+            with self._lock.read(), self._file_lock.shared():
+                snapshot, logs = self.storage.checkpoint()
+        try:
+            yield snapshot, logs
+        finally:
+            snapshot.close()
+            for f, _ in logs:
+                f.close()
+
+    def close(self):
+        self.storage.close()
+        if self.changes is not None:
+            self.changes.close()
+        self._file_lock.close()
+
+    @contextmanager
+    def transaction(self, keys=None):
+        # Changes made inside the block are visible immediately and persisted
+        # as one commit when it exits. An exception or Transaction.rollback()
+        # undoes all of them instead. A nested block acts as a savepoint: its
+        # changes fold into the enclosing transaction, or roll back alone.
+        # keys is for ShardedDatabase, a single store locks everything anyway.
+        with self._writing() as db:
+            parent = self._transaction
+            transaction = self._transaction = Transaction()
+            try:
+                yield transaction
+            except BaseException:
+                self._transaction = parent
+                self._rollback(db, transaction)
+                raise
+            self._transaction = parent
+            if transaction.rollback_only:
+                self._rollback(db, transaction)
+            elif parent is not None:
+                parent.ops.extend(transaction.ops)
+                parent.undo.extend(transaction.undo)
+            elif transaction.ops:
+                self._save_db(db, transaction.ops)
+
+    def _rollback(self, db, transaction):
+        for entry in reversed(transaction.undo):
+            kind, collection_name = entry[0], entry[1]
+            indexes = self._get_indexes(db, collection_name)
+            if kind == "insert":
+                doc = entry[2]
+                self._unindex_document(indexes, doc)
+                collection = db[collection_name]
+                if collection and collection[-1] is doc:
+                    collection.pop()
+                else:
+                    db[collection_name] = [d for d in collection if d is not doc]
+            elif kind == "update":
+                # Put the original document back in place of its copy
+                self._replace_document(db, collection_name, indexes, entry[2], entry[3])
+            elif kind == "delete":
+                db[collection_name] = entry[2]
+                for doc in entry[3]:
+                    self._index_document(indexes, doc)
+
+    def _record_undo(self, *entry):
+        if self._transaction is not None:
+            self._transaction.undo.append(entry)
+
+    def _next_id(self, db, collection_name):
+        if collection_name not in self._next_ids:
+            self._next_ids[collection_name] = (
+                max((doc["_id"] for doc in db.get(collection_name, [])), default=0) + 1
+            )
+        next_id = self._next_ids[collection_name]
+        self._next_ids[collection_name] = next_id + 1
+        return next_id
+
+    def store_columns(self, collection_name, fields):
+        # Keeps collection_name in memory as a database.columnar.ColumnStore
+        # of the given {field: type} rather than as a list of dicts
+        self._columnar[collection_name] = fields
+        if self._cache is not None:
+            with self._writing() as db:
+                self._store_columns(db, collection_name)
+
+    def _store_columns(self, db, collection_name):
+        collection = db.get(collection_name)
+        if collection is not None and not isinstance(collection, ColumnStore):
+            db[collection_name] = ColumnStore(self._columnar[collection_name], collection)
+            self._built_indexes.discard(collection_name)
+            self._positions.pop(collection_name, None)
 
-    def _save_db(self, db_content):
-        with open(self.db_path, "w") as f:
-            json.dump(db_content, f, indent=4)
+    def create_index(self, collection_name, field, unique=False, order_by=None):
+        indexes = self._indexes.setdefault(collection_name, {})
+        if field not in indexes:
+            indexes[field] = HashIndex(field, unique=unique, order_by=order_by)
+            self._built_indexes.discard(collection_name)
+        return indexes[field]
 
-    def find(self, collection_name, query={}):
-        db = self._load_db()
+    def _get_indexes(self, db, collection_name):
+        indexes = self._indexes.get(collection_name)
+        if not indexes:
+            return {}
+        if collection_name not in self._built_indexes:
+            # Concurrent readers may all find the index unbuilt
+            with self._index_mutex:
+                if collection_name not in self._built_indexes:
+                    collection = db.get(collection_name, [])
+                    with self.metrics.timer("index_build"):
+                        for index in indexes.values():
+                            index.build(collection)
+                    self._built_indexes.add(collection_name)
+        return indexes
+
+    def _candidate_range(self, db, collection_name, query):
+        # Narrow the scan to one index bucket when the query has an equality
+        # on an indexed field, and to a slice of it when the bucket is ordered
+        # on a field the query bounds. Returns (documents, start, stop), the
+        # full match is still checked by the caller.
+        indexes = self._get_indexes(db, collection_name)
+        for field, value in query.items():
+            index = indexes.get(field)
+            if index is None or isinstance(value, dict):
+                continue
+            return self._index_range(index, value, query)
+        return self._collection_range(db, collection_name, query)
+
+    def _collection_range(self, db, collection_name, query):
+        # The whole collection, or the slice an _id range selects: documents
+        # are appended in _id order
         collection = db.get(collection_name, [])
-        if not collection:
-            return []
-        # Case-insensitive search and matching logic
-        return [
-            doc
-            for doc in collection
-            if all(str(doc.get(k)).lower() == str(v).lower() for k, v in query.items())
-        ]
-
-    def find_one(self, collection_name, query=None):
-        # Reuse the find method to get the first matching document
-        result = self.find(collection_name, query)
+        start, stop = 0, len(collection)
+        bounds = query.get("_id")
+        if isinstance(bounds, dict):
+            low = bounds.get("$gte", bounds.get("$gt"))
+            high = bounds.get("$lte", bounds.get("$lt"))
+            if isinstance(low, (int, float)):
+                start = bisect.bisect_left(collection, low, key=_document_id)
+            if isinstance(high, (int, float)):
+                stop = bisect.bisect_right(collection, high, lo=start, key=_document_id)
+        return collection, start, stop
+
+    def _index_range(self, index, value, query):
+        bounds = query.get(index.order_by) if index.order_by else None
+        if isinstance(bounds, dict):
+            # Inclusive bounds, the query itself drops the ends of $gt/$lt
+            low = bounds.get("$gte", bounds.get("$gt"))
+            high = bounds.get("$lte", bounds.get("$lt"))
+            return index.lookup_range(value, low, high)
+        bucket = index.lookup(value)
+        return bucket, 0, len(bucket)
+
+    def _plan(self, db, collection_name, query, sort):
+        # Chooses what find scans: a slice of one index bucket for an
+        # equality on an indexed field, the buckets of each value for an $in
+        # on one, otherwise the whole collection or its _id range. Returns
+        # (ranges, index, presorted): ranges are (documents, start, stop)
+        # tuples, and presorted is the direction (1 or -1) in which they
+        # already satisfy sort, or None if they still have to be sorted.
+        indexes = self._get_indexes(db, collection_name)
+        for field, condition in query.items():
+            index = indexes.get(field)
+            if index is None:
+                continue
+            if not isinstance(condition, dict):
+                ranges = [self._index_range(index, condition, query)]
+                return ranges, field, self._presorted(sort, index.order_by)
+            if list(condition) == ["$in"]:
+                keys = {}
+                for value in condition["$in"]:
+                    keys.setdefault(index.key(value), value)
+                ranges = [self._index_range(index, value, query) for value in keys.values()]
+                presorted = self._presorted(sort, index.order_by) if len(ranges) <= 1 else None
+                return ranges, field, presorted
+        ranges = [self._collection_range(db, collection_name, query)]
+        return ranges, None, self._presorted(sort, "_id")
+
+    def _presorted(self, sort, order_field):
+        if not sort:
+            return 1
+        if order_field is not None and len(sort) == 1 and sort[0][0] == order_field:
+            return sort[0][1]
+        return None
+
+    def _scan(self, ranges, direction):
+        if direction == -1:
+            for docs, start, stop in reversed(ranges):
+                for i in range(stop - 1, start - 1, -1):
+                    yield docs[i]
+        else:
+            for docs, start, stop in ranges:
+                for i in range(start, stop):
+                    yield docs[i]
+
+    def explain(self, collection_name, query=None, sort=None):
+        # How find would run query: which index it uses, how many documents
+        # it would examine at most, and whether it has to sort them
+        query = query or {}
+        sort = normalize_sort(sort)
+        with self._reading() as db:
+            ranges, index, presorted = self._plan(db, collection_name, query, sort)
+            if not sort:
+                sorting = None
+            else:
+                sorting = "index" if presorted is not None else "in memory"
+            return {
+                "index": index,
+                "candidates": sum(stop - start for _, start, stop in ranges),
+                "sort": sorting,
+            }
+
+    def _candidates(self, db, collection_name, query):
+        docs, start, stop = self._candidate_range(db, collection_name, query)
+        self.metrics.count("scanned_documents", stop - start)
+        return (docs[i] for i in range(start, stop))
+
+    def _index_document(self, indexes, doc):
+        added = []
+        try:
+            for index in indexes.values():
+                index.add(doc)
+                added.append(index)
+        except ValueError:
+            for index in added:
+                index.remove(doc)
+            raise
+
+    def _unindex_document(self, indexes, doc):
+        for index in indexes.values():
+            index.remove(doc)
+
+    def _append_document(self, db, collection_name, doc):
+        # Returns the stored document, a row rather than doc in a ColumnStore
+        collection = db.get(collection_name)
+        if collection is None:
+            fields = self._columnar.get(collection_name)
+            collection = db[collection_name] = [] if fields is None else ColumnStore(fields)
+        positions = self._positions.get(collection_name)
+        if positions is not None:
+            positions[doc["_id"]] = len(collection)
+        collection.append(doc)
+        return collection[-1]
+
+    def _position(self, db, collection_name, doc):
+        # Where doc sits in its collection. The _id map behind this is only
+        # extended by appends, so it is checked against the list and rebuilt
+        # when a delete or rollback has shifted documents.
+        collection = db[collection_name]
+        if isinstance(collection, ColumnStore):
+            return collection.index(doc)
+        positions = self._positions.get(collection_name)
+        if positions is not None:
+            i = positions.get(doc["_id"])
+            if i is not None and i < len(collection) and collection[i] is doc:
+                return i
+        positions = self._positions[collection_name] = {
+            d["_id"]: i for i, d in enumerate(collection)
+        }
+        return positions[doc["_id"]]
+
+    def _replace_document(self, db, collection_name, indexes, old, new):
+        # Swaps new in for old in the collection and its indexes, leaving old
+        # untouched for anyone still holding a view of it. Returns the stored
+        # document, a row rather than new itself in a ColumnStore.
+        collection = db[collection_name]
+        position = self._position(db, collection_name, old)
+        collection[position] = new
+        stored = collection[position]
+        replaced = []
+        try:
+            for index in indexes.values():
+                index.replace(old, stored)
+                replaced.append(index)
+        except ValueError:
+            for index in replaced:
+                index.replace(stored, old)
+            collection[position] = old
+            raise
+        return stored
+
+    @_timed("find")
+    def find(
+        self, collection_name, query={}, limit=None, skip=0, sort=None, projection=None
+    ):
+        # sort takes "field", "-field" or a list of (field, 1 | -1) pairs,
+        # projection a list of the fields to return instead of the whole
+        # document. Without a sort, or with one an index already provides,
+        # the scan stops as soon as skip + limit documents have matched.
+        if query is None:
+            query = {}
+        predicate = compile_query(query)
+        sort = normalize_sort(sort)
+        with self._reading() as db:
+            if not db.get(collection_name):
+                return []
+            ranges, _, presorted = self._plan(db, collection_name, query, sort)
+            self.metrics.count("scanned_documents", sum(b - a for _, a, b in ranges))
+            stop = None if limit is None else skip + limit
+            with self.metrics.timer("scan"):
+                found = (doc for doc in self._scan(ranges, presorted) if predicate(doc))
+                if presorted is None:
+                    found = sort_documents(found, sort, stop)
+                docs = list(islice(found, skip, stop))
+            # Read-only views of the cached documents rather than copies.
+            # Updates replace documents instead of changing them, so a view
+            # keeps showing the document as it was found.
+            if projection is not None:
+                return [project(doc, projection) for doc in docs]
+            return [MappingProxyType(doc) for doc in docs]
+
+    def iter_find(self, collection_name, query=None, limit=None, batch_size=500):
+        # Like find, but yields matches lazily and only holds the read lock
+        # while collecting each batch. Every batch resumes after the last
+        # document the previous one examined, which suits append-mostly
+        # collections such as the ledger.
+        query = query or {}
+        predicate = compile_query(query)
+        position, last = 0, None
+        while limit is None or limit > 0:
+            batch = []
+            with self._reading() as db:
+                if not db.get(collection_name):
+                    return
+                docs, start, stop = self._candidate_range(db, collection_name, query)
+                if last is not None:
+                    start = self._resume_position(docs, start, stop, position, last)
+                position = start
+                while position < stop and len(batch) < batch_size:
+                    last = docs[position]
+                    position += 1
+                    if predicate(last):
+                        batch.append(last)
+                exhausted = position >= stop
+            if limit is not None:
+                batch = batch[:limit]
+                limit -= len(batch)
+            for doc in batch:
+                yield MappingProxyType(doc)
+            if exhausted:
+                return
+
+    def _resume_position(self, docs, start, stop, position, last):
+        if start < position <= stop and docs[position - 1] is last:
+            return position
+        # Earlier documents moved, look for the last one we saw
+        for i in range(start, stop):
+            if docs[i] is last:
+                return i + 1
+        return min(max(position, start), stop)
+
+    @_timed("find_one")
+    def find_one(self, collection_name, query=None, projection=None):
+        if query and len(query) == 1:
+            # An equality on a unique field is a single index lookup, without
+            # compiling the query or planning a scan
+            field, value = next(iter(query.items()))
+            if not isinstance(value, dict):
+                with self._reading() as db:
+                    index = self._get_indexes(db, collection_name).get(field)
+                    if index is not None and index.unique:
+                        bucket = index.lookup(value)
+                        self.metrics.count("scanned_documents", len(bucket))
+                        if not bucket:
+                            return None
+                        if projection is not None:
+                            return project(bucket[0], projection)
+                        return MappingProxyType(bucket[0])
+        # Otherwise reuse the find method to get the first matching document
+        result = self.find(collection_name, query, limit=1, projection=projection)
         return result[0] if result else None
 
+    @_timed("insert")
     def insert(self, collection_name, document):
-        db = self._load_db()
-        if collection_name not in db:
-            db[collection_name] = []
-        db[collection_name].append(document)
-        self._save_db(db)
-        return document
+        # Stores a copy of document with its _id and returns a view of it
+        with self._writing() as db:
+            op, stored = self._insert_document(db, collection_name, document)
+            self._save_db(db, [op])
+            return MappingProxyType(stored)
+
+    @_timed("insert_many")
+    def insert_many(self, collection_name, documents):
+        # All documents are stored with a single commit, or none of them if
+        # one is rejected
+        inserted = []
+        with self.transaction() as transaction:
+            db = self._cache
+            for document in documents:
+                op, stored = self._insert_document(db, collection_name, document)
+                transaction.ops.append(op)
+                inserted.append(MappingProxyType(stored))
+        return inserted
 
+    def _insert_document(self, db, collection_name, document):
+        # Returns (op, stored document). The op shares the stored copy: it is
+        # never modified afterwards, as updates replace it.
+        document = dict(document, _id=self._next_id(db, collection_name))
+        indexes = self._get_indexes(db, collection_name)
+        stored = self._append_document(db, collection_name, document)
+        try:
+            self._index_document(indexes, stored)
+        except ValueError:
+            db[collection_name].pop()
+            raise
+        self._record_undo("insert", collection_name, stored)
+        return {"op": "insert", "c": collection_name, "doc": document}, stored
+
+    @_timed("update_one")
     def update_one(self, collection_name, query, update_fields):
-        db = self._load_db()
-        collection = db.get(collection_name, None)
-        if collection is None:
+        with self._writing() as db:
+            if collection_name not in db:
+                return None
+            for doc in self._candidates(db, collection_name, query):
+                if all(doc.get(k) == v for k, v in query.items()):
+                    op, doc = self._update_document(db, collection_name, doc, update_fields)
+                    self._save_db(db, [op])
+                    return MappingProxyType(doc)
+
             return None
-        for doc in collection:
-            if all(doc.get(k) == v for k, v in query.items()):
-                doc.update(update_fields)
-                db[collection_name] = collection
-                self._save_db(db)
-                return doc
 
-        return None
+    @_timed("update_many")
+    def update_many(self, collection_name, query, update_fields):
+        # Applies update_fields to every match with a single commit and
+        # returns how many documents changed
+        with self.transaction() as transaction:
+            db = self._cache
+            if collection_name not in db:
+                return 0
+            matched = [
+                doc
+                for doc in self._candidates(db, collection_name, query)
+                if all(doc.get(k) == v for k, v in query.items())
+            ]
+            for doc in matched:
+                op, _ = self._update_document(db, collection_name, doc, update_fields)
+                transaction.ops.append(op)
+        return len(matched)
+
+    def _update_document(self, db, collection_name, doc, update_fields):
+        # Copy-on-write: the updated document is a new dict, so the old one
+        # doubles as the undo record. Returns (op, updated document).
+        updated = {**doc, **update_fields}
+        indexes = self._get_indexes(db, collection_name)
+        updated = self._replace_document(db, collection_name, indexes, doc, updated)
+        self._record_undo("update", collection_name, updated, doc)
+        op = {
+            "op": "update",
+            "c": collection_name,
+            "id": doc["_id"],
+            "set": update_fields,
+        }
+        return op, updated
 
+    @_timed("delete_one")
     def delete_one(self, collection_name, query):
-        db = self._load_db()
-        collection = db.get(collection_name, [])
-        new_collection = [
-            doc
-            for doc in collection
-            if not all(doc.get(k) == v for k, v in query.items())
-        ]
-        if len(collection) != len(new_collection):
-            db[collection_name] = new_collection
-            self._save_db(db)
-            return True
-        return False
+        with self._writing() as db:
+            collection = db.get(collection_name, [])
+            matched = [
+                doc
+                for doc in self._candidates(db, collection_name, query)
+                if all(doc.get(k) == v for k, v in query.items())
+            ]
+            if matched:
+                indexes = self._get_indexes(db, collection_name)
+                for doc in matched:
+                    self._unindex_document(indexes, doc)
+                self._record_undo("delete", collection_name, collection, matched)
+                matched_ids = {id(doc) for doc in matched}
+                db[collection_name] = [
+                    doc for doc in collection if id(doc) not in matched_ids
+                ]
+                self._save_db(
+                    db,
+                    [
+                        {"op": "delete", "c": collection_name, "id": doc["_id"]}
+                        for doc in matched
+                    ],
+                )
+                return True
+            return False
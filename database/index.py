@@ -0,0 +1,104 @@
+import bisect
+
+
+class HashIndex:
+    def __init__(self, field, unique=False, order_by=None):
+        self.field = field
+        self.unique = unique
+        # Keep each bucket sorted on another field, e.g. a ledger indexed by
+        # account and ordered by date
+        self.order_by = order_by
+        self._buckets = {}
+
+    @staticmethod
+    def key(value):
+        # Same normalisation as Database.find so indexed lookups stay
+        # case-insensitive
+        return str(value).lower()
+
+    def build(self, collection):
+        # add() in bulk: a stable sort per bucket at the end leaves documents
+        # where insort_right would have put them
+        self._buckets = buckets = {}
+        key, field = self.key, self.field
+        for doc in collection:
+            value = key(doc.get(field))
+            bucket = buckets.get(value)
+            if bucket is None:
+                buckets[value] = [doc]
+            elif self.unique:
+                raise ValueError(
+                    f"Duplicate value for unique field '{field}': {doc.get(field)}"
+                )
+            else:
+                bucket.append(doc)
+        if self.order_by is not None:
+            for bucket in buckets.values():
+                bucket.sort(key=self._order_key)
+
+    def add(self, doc):
+        key = self.key(doc.get(self.field))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [doc]
+        elif self.unique:
+            raise ValueError(
+                f"Duplicate value for unique field '{self.field}': {doc.get(self.field)}"
+            )
+        elif self.order_by is None or not self._before(doc, bucket[-1]):
+            bucket.append(doc)  # Documents normally arrive in order
+        else:
+            bisect.insort_right(bucket, doc, key=self._order_key)
+
+    def _order_key(self, doc):
+        return doc.get(self.order_by)
+
+    def _before(self, doc, other):
+        return self._order_key(doc) < self._order_key(other)
+
+    def remove(self, doc):
+        key = self.key(doc.get(self.field))
+        bucket = self._buckets.get(key, [])
+        for i, indexed_doc in enumerate(bucket):
+            if indexed_doc is doc:
+                del bucket[i]
+                break
+        if not bucket:
+            self._buckets.pop(key, None)
+
+    def replace(self, old, new):
+        # Swaps new in for old, in the same slot when neither the key nor the
+        # order changed
+        key = self.key(old.get(self.field))
+        if key == self.key(new.get(self.field)) and (
+            self.order_by is None or self._order_key(old) == self._order_key(new)
+        ):
+            bucket = self._buckets.get(key, [])
+            start = 0
+            if self.order_by is not None:
+                start = bisect.bisect_left(bucket, self._order_key(old), key=self._order_key)
+            for i in range(start, len(bucket)):
+                if bucket[i] is old:
+                    bucket[i] = new
+                    return
+        self.remove(old)
+        try:
+            self.add(new)
+        except ValueError:
+            self.add(old)
+            raise
+
+    def lookup(self, value):
+        return self._buckets.get(self.key(value), [])
+
+    def lookup_range(self, value, low=None, high=None):
+        # Bounds of the bucket slice whose order_by values fall in
+        # [low, high], as (bucket, start, stop) so callers needn't copy it
+        bucket = self.lookup(value)
+        start = 0 if low is None else bisect.bisect_left(bucket, low, key=self._order_key)
+        stop = (
+            len(bucket)
+            if high is None
+            else bisect.bisect_right(bucket, high, key=self._order_key)
+        )
+        return bucket, start, stop
@@ -0,0 +1,110 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, locking stays in-process
+    fcntl = None
+
+
+class ReadWriteLock:
+    # Any number of readers or a single writer. The writing thread may take
+    # the lock again, for reading or writing, without blocking itself.
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+
+    def is_writer(self):
+        return self._writer == threading.get_ident()
+
+    @contextmanager
+    def read(self):
+        if self.is_writer():
+            yield
+            return
+        with self._cond:
+            # Waiting writers go first so a stream of readers can't starve them
+            while self._writer is not None or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+            self._writer_depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer_depth -= 1
+                if not self._writer_depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+class FileLock:
+    # flock() on a side file, shared between this process's readers and
+    # exclusive for a writer. Callers serialise readers and writers with a
+    # ReadWriteLock first, this only arbitrates between processes.
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._mutex = threading.Lock()
+        self._shared = 0
+        self._exclusive = 0
+
+    def _flock(self, operation):
+        if fcntl is None:
+            return
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, getattr(fcntl, operation))
+
+    @contextmanager
+    def shared(self):
+        with self._mutex:
+            if not self._shared and not self._exclusive:
+                self._flock("LOCK_SH")
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._mutex:
+                self._shared -= 1
+                if not self._shared and not self._exclusive:
+                    self._flock("LOCK_UN")
+
+    @contextmanager
+    def exclusive(self):
+        if not self._exclusive:
+            self._flock("LOCK_EX")
+        self._exclusive += 1
+        try:
+            yield
+        finally:
+            self._exclusive -= 1
+            if not self._exclusive:
+                self._flock("LOCK_UN")
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
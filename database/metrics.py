@@ -0,0 +1,235 @@
+import bisect
+import cProfile
+import os
+import threading
+import time
+import tracemalloc
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "sample", "start", "sampling")
+
+    def __init__(self, metrics, name, sample):
+        self.metrics = metrics
+        self.name = name
+        self.sample = sample
+
+    def __enter__(self):
+        self.sampling = self.sample and self.metrics._start_sample()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        if self.sampling:
+            self.metrics._stop_sample(self.name)
+        self.metrics.observe(self.name, elapsed)
+
+
+class Metrics:
+    # Counters and latency histograms for Database, its storage engine and
+    # Model. Operations (find, insert, ...) and the phases inside them (load,
+    # scan, validate, serialize, write, fsync) are timed under their own name.
+    #
+    # Hooks are called as hook(name, seconds) after every timing, e.g. to log
+    # slow operations. With sample_every=N, every Nth operation also runs
+    # under cProfile (profile=True, see dump_profile) and/or tracemalloc
+    # (trace_memory=True, peak allocation per operation).
+    enabled = True
+
+    def __init__(
+        self, buckets=DEFAULT_BUCKETS, sample_every=0, profile=False, trace_memory=False
+    ):
+        self.buckets = tuple(buckets)
+        self.sample_every = sample_every
+        self.profiler = cProfile.Profile() if profile else None
+        self.trace_memory = trace_memory
+        self.histograms = {}
+        self.counters = {}
+        self.peak_allocations = {}
+        self._hooks = []
+        self._mutex = threading.Lock()
+        self._operations = 0
+        self._started_tracing = False
+        # Only one operation is sampled at a time, cProfile and tracemalloc
+        # are process-wide
+        self._sampling = threading.Lock()
+
+    def timer(self, name, sample=False):
+        # sample marks a whole operation, as opposed to a phase within one
+        return _Timer(self, name, sample)
+
+    def observe(self, name, seconds):
+        with self._mutex:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        for hook in self._hooks:
+            hook(name, seconds)
+
+    def count(self, name, amount=1):
+        with self._mutex:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def _start_sample(self):
+        if not self.sample_every or not (self.profiler or self.trace_memory):
+            return False
+        with self._mutex:
+            self._operations += 1
+            if self._operations % self.sample_every:
+                return False
+        if not self._sampling.acquire(blocking=False):
+            return False
+        if self.trace_memory:
+            # Tracing slows every allocation, so it only runs while sampling
+            # unless something else already turned it on
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return True
+
+    def _stop_sample(self, name):
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+            with self._mutex:
+                self.peak_allocations[name] = max(self.peak_allocations.get(name, 0), peak)
+        self._sampling.release()
+
+    def dump_profile(self, path):
+        # Writes the accumulated cProfile samples for pstats or snakeviz
+        if self.profiler is None:
+            raise ValueError("Profiling is not enabled, pass profile=True")
+        with self._sampling:
+            self.profiler.dump_stats(path)
+
+    def snapshot(self):
+        with self._mutex:
+            return {
+                "timings": {
+                    name: {
+                        "count": h.count,
+                        "sum": h.sum,
+                        "mean": h.sum / h.count if h.count else 0.0,
+                        "max": h.max,
+                    }
+                    for name, h in self.histograms.items()
+                },
+                "counters": dict(self.counters),
+                "peak_allocations": dict(self.peak_allocations),
+            }
+
+    def reset(self):
+        with self._mutex:
+            self.histograms.clear()
+            self.counters.clear()
+            self.peak_allocations.clear()
+
+    def to_prometheus(self, prefix="bank_db"):
+        lines = []
+        with self._mutex:
+            lines.append(f"# HELP {prefix}_seconds Time spent per operation and phase.")
+            lines.append(f"# TYPE {prefix}_seconds histogram")
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), h.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(
+                        f'{prefix}_seconds_bucket{{op="{name}",le="{le}"}} {cumulative}'
+                    )
+                lines.append(f'{prefix}_seconds_sum{{op="{name}"}} {h.sum!r}')
+                lines.append(f'{prefix}_seconds_count{{op="{name}"}} {h.count}')
+            lines.append(f"# HELP {prefix}_events_total Event counters.")
+            lines.append(f"# TYPE {prefix}_events_total counter")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{prefix}_events_total{{event="{name}"}} {value}')
+            if self.peak_allocations:
+                lines.append(
+                    f"# HELP {prefix}_peak_allocation_bytes Largest sampled allocation peak."
+                )
+                lines.append(f"# TYPE {prefix}_peak_allocation_bytes gauge")
+                for name, value in sorted(self.peak_allocations.items()):
+                    lines.append(f'{prefix}_peak_allocation_bytes{{op="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # Atomic, so a node_exporter textfile collector never reads half a file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def export_every(self, path, interval=15.0):
+        # Rewrites path every interval seconds from a daemon thread
+        def run():
+            while True:
+                time.sleep(interval)
+                self.write_prometheus(path)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class NullMetrics:
+    # Stands in when instrumentation is off: every call is a no-op and timer()
+    # hands back one shared context manager, so nothing is allocated or timed
+    enabled = False
+    _timer = _NullTimer()
+
+    def timer(self, name, sample=False):
+        return self._timer
+
+    def observe(self, name, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,65 @@
+# Copy a store from one storage engine to another, e.g. the legacy indented
+# database.json into SQLite:
+#
+#   python -m database.migrate database.json database.db --to sqlite
+import argparse
+import os
+
+from database.storage import STORAGE_ENGINES
+
+
+def open_storage(path, engine):
+    if isinstance(engine, str):
+        engine = STORAGE_ENGINES[engine](path)
+    return engine
+
+
+def migrate(source_path, target_path, source="json", target="log", overwrite=False):
+    if os.path.abspath(source_path) == os.path.abspath(target_path):
+        raise ValueError("Source and target must be different files")
+    if not os.path.exists(source_path):
+        raise ValueError(f"No store at {source_path}")
+    if os.path.exists(target_path) and not overwrite:
+        raise ValueError(f"{target_path} already exists")
+
+    source_storage = open_storage(source_path, source)
+    target_storage = open_storage(target_path, target)
+    try:
+        db = source_storage.load()
+        target_storage.create()
+        target_storage.replace(db)
+        # Read the result back so a lossy conversion fails loudly instead of
+        # surfacing later as missing accounts
+        if target_storage.load() != db:
+            raise ValueError(f"{target_path} does not match {source_path} after migrating")
+    finally:
+        source_storage.close()
+        target_storage.close()
+    return {name: len(collection) for name, collection in db.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a store between storage engines")
+    parser.add_argument("source")
+    parser.add_argument("target")
+    parser.add_argument("--from", dest="source_engine", default="json", choices=STORAGE_ENGINES)
+    parser.add_argument("--to", dest="target_engine", default="log", choices=STORAGE_ENGINES)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        counts = migrate(
+            args.source,
+            args.target,
+            args.source_engine,
+            args.target_engine,
+            args.overwrite,
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+    for name, count in counts.items():
+        print(f"{name}: {count} documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,55 @@
 class Model:
-    def __init__(self, collection_name, schema, db_instance):
+    def __init__(self, collection_name, schema, db_instance, indexes=None, columnar=False):
         self.collection_name = collection_name
         self.schema = schema
         self.db = db_instance
+        # columnar keeps the collection in memory column by column, typed by
+        # the schema, see database.columnar
+        if columnar:
+            self.db.store_columns(collection_name, schema.fields)
+        # indexes maps a field name to create_index options, e.g.
+        # {"account_number": {"unique": True}}
+        self.indexes = indexes or {}
+        for field, options in self.indexes.items():
+            self.db.create_index(collection_name, field, **options)
 
-    def validate_data(self, data):
-        return self.schema.validate(data)
+    def validate_data(self, data, partial=False):
+        with self.db.metrics.timer("validate"):
+            return self.schema.validate(data, partial=partial)
 
     def create(self, data):
         validated_data = self.validate_data(data)
         return self.db.insert(self.collection_name, validated_data)
 
+    def bulk_create(self, documents):
+        # Validates lazily, so documents may be any iterable
+        return self.db.insert_many(
+            self.collection_name, (self.validate_data(data) for data in documents)
+        )
+
     def update(self, query, update_fields):
-        validated_update_fields = self.validate_data(update_fields)
+        validated_update_fields = self.validate_data(update_fields, partial=True)
         return self.db.update_one(self.collection_name, query, validated_update_fields)
 
-    def find(self, query={}):
-        return self.db.find(self.collection_name, query)
+    def update_many(self, query, update_fields):
+        validated_update_fields = self.validate_data(update_fields, partial=True)
+        return self.db.update_many(self.collection_name, query, validated_update_fields)
+
+    def find(self, query={}, limit=None, skip=0, sort=None, projection=None):
+        return self.db.find(
+            self.collection_name,
+            query,
+            limit=limit,
+            skip=skip,
+            sort=sort,
+            projection=projection,
+        )
+
+    def iter_find(self, query={}, limit=None):
+        return self.db.iter_find(self.collection_name, query, limit=limit)
 
-    def find_one(self, query={}):
-        return self.db.find_one(self.collection_name, query)
+    def find_one(self, query={}, projection=None):
+        return self.db.find_one(self.collection_name, query, projection=projection)
 
     def delete(self, query):
         return self.db.delete_one(self.collection_name, query)
@@ -0,0 +1,122 @@
+import heapq
+
+# Query matching shared by Database.find and iter_find. A query maps fields
+# to either a value, compared case-insensitively as before, or a dict of
+# operators such as {"date": {"$gte": "2024-01-01"}}:
+#   $gt, $gte, $lt, $lte  ordered comparisons, never true for a missing field
+#   $in                   equal (case-insensitively) to any value in a list
+#   $prefix               starts with, case-insensitively
+
+
+def _key(value):
+    return str(value).lower()
+
+
+def _compare(test):
+    def compare(value, operand):
+        if value is None:
+            return False
+        try:
+            return test(value, operand)
+        except TypeError:  # e.g. a number compared with a string
+            return False
+
+    return compare
+
+
+OPERATORS = {
+    "$gt": _compare(lambda value, operand: value > operand),
+    "$gte": _compare(lambda value, operand: value >= operand),
+    "$lt": _compare(lambda value, operand: value < operand),
+    "$lte": _compare(lambda value, operand: value <= operand),
+    "$in": lambda value, operand: _key(value) in operand,
+    "$prefix": lambda value, operand: _key(value).startswith(operand),
+}
+
+# Operands converted once per query rather than once per document
+PREPARE = {
+    "$in": lambda operand: frozenset(_key(value) for value in operand),
+    "$prefix": _key,
+}
+
+
+def _equals(value, operand):
+    return _key(value) == operand
+
+
+def compile_query(query):
+    # Returns predicate(doc) for query, raising ValueError for an unknown
+    # operator before any document is scanned
+    checks = []
+    for field, condition in query.items():
+        if isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator not in OPERATORS:
+                    raise ValueError(f"Unknown query operator '{operator}'")
+                prepare = PREPARE.get(operator)
+                operand = prepare(operand) if prepare else operand
+                checks.append((field, OPERATORS[operator], operand))
+        else:
+            checks.append((field, _equals, _key(condition)))
+
+    def predicate(doc):
+        for field, test, operand in checks:
+            if not test(doc.get(field), operand):
+                return False
+        return True
+
+    return predicate
+
+
+def matches(doc, query):
+    return compile_query(query)(doc)
+
+
+def normalize_sort(sort):
+    # Accepts "field", "-field" (descending), or a list of those or of
+    # (field, 1 | -1) pairs. Returns [(field, direction), ...].
+    if not sort:
+        return []
+    if isinstance(sort, (str, tuple)):
+        sort = [sort]
+    keys = []
+    for key in sort:
+        if isinstance(key, str):
+            keys.append((key[1:], -1) if key.startswith("-") else (key, 1))
+        else:
+            field, direction = key
+            if direction not in (1, -1):
+                raise ValueError(f"Sort direction for '{field}' must be 1 or -1")
+            keys.append((field, direction))
+    return keys
+
+
+def _sort_value(value):
+    # Missing values sort first, as None can't be compared with anything
+    return (0, 0) if value is None else (1, value)
+
+
+def sort_documents(docs, sort, limit=None):
+    # With a limit only the first limit documents are kept while scanning
+    directions = {direction for _, direction in sort}
+    if len(directions) == 1:
+        fields = [field for field, _ in sort]
+
+        def key(doc):
+            return [_sort_value(doc.get(field)) for field in fields]
+
+        reverse = directions == {-1}
+        if limit is not None:
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            return select(limit, docs, key=key)
+        return sorted(docs, key=key, reverse=reverse)
+    # Mixed directions: stable sorts from the least significant key up
+    docs = list(docs)
+    for field, direction in reversed(sort):
+        docs.sort(key=lambda doc: _sort_value(doc.get(field)), reverse=direction < 0)
+    return docs if limit is None else docs[:limit]
+
+
+def project(doc, fields):
+    # A copy of doc holding only the given fields, those it has
+    return {field: doc[field] for field in fields if field in doc}
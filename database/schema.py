@@ -1,15 +1,35 @@
 class Schema:
     def __init__(self, **fields):
         self.fields = fields
+        # Compiled once per schema: accepted types and error message per field
+        self._checks = {}
+        for field, field_type in fields.items():
+            # field_type may be a tuple of accepted types
+            types = field_type if isinstance(field_type, tuple) else (field_type,)
+            type_names = " or ".join(t.__name__ for t in types)
+            self._checks[field] = (
+                field_type,
+                f"Field '{field}' must be of type {type_names}.",
+            )
 
-    def validate(self, data):
-        validated_data = {}
-        for field, field_type in self.fields.items():
-            if field not in data:
-                raise ValueError(f"Missing field: {field}")
-            if not isinstance(data[field], field_type):
-                raise TypeError(
-                    f"Field '{field}' must be of type {field_type.__name__}."
-                )
-            validated_data[field] = data[field]
-        return validated_data
+    def validate(self, data, partial=False):
+        # partial only checks the fields present in data, for updates. Data
+        # that holds nothing but declared fields is returned without a copy.
+        checks = self._checks
+        if partial:
+            for field, value in data.items():
+                check = checks.get(field)
+                if check is not None and not isinstance(value, check[0]):
+                    raise TypeError(check[1])
+            if checks.keys() >= data.keys():
+                return data
+        else:
+            for field, (field_type, message) in checks.items():
+                if field not in data:
+                    raise ValueError(f"Missing field: {field}")
+                if not isinstance(data[field], field_type):
+                    raise TypeError(message)
+            if len(data) == len(checks):
+                return data
+        # Undeclared fields are dropped
+        return {field: value for field, value in data.items() if field in checks}
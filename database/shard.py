@@ -0,0 +1,450 @@
+import json
+import os
+import threading
+import uuid
+import zlib
+from contextlib import ExitStack, contextmanager
+from itertools import chain, islice
+from types import MappingProxyType
+
+from database.database import Database
+from database.lock import FileLock
+from database.metrics import NULL_METRICS
+from database.query import normalize_sort, sort_documents
+from database.storage import _plain
+
+# Each shard records the last cross-shard commit it applied in this
+# collection, see ShardedDatabase._recover
+COMMITS = "_shard_commits"
+# The journal is started over once this large and with nothing in flight
+JOURNAL_RESET_BYTES = 1024 * 1024
+
+# In pool worker processes: {shard path: Database}, kept open between tasks
+_worker_shards = {}
+
+
+def shard_path(db_path, i):
+    # database.json -> database.0.json
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.{i}{ext}"
+
+
+def _run_on_shard(path, storage, indexes, columns, function, args):
+    db = _worker_shards.get(path)
+    if db is None:
+        db = _worker_shards[path] = Database(path, storage=storage)
+    for collection_name, fields in columns.items():
+        if collection_name not in db._columnar:
+            db.store_columns(collection_name, fields)
+    for collection_name, field, options in indexes:
+        db.create_index(collection_name, field, **options)
+    return function(db, *args)
+
+
+def _find(db, collection_name, query, stop, sort, projection):
+    # One shard's share of a fanned out find: its first stop matches
+    return db.find(collection_name, query, limit=stop, sort=sort, projection=projection)
+
+
+def _find_detached(db, collection_name, query, stop, sort, projection):
+    # _find on a worker process, views can't be sent back
+    return [dict(doc) for doc in _find(db, collection_name, query, stop, sort, projection)]
+
+
+class ShardedTransaction:
+    def __init__(self, transactions):
+        self.transactions = transactions
+
+    def rollback(self):
+        for transaction in self.transactions:
+            transaction.rollback()
+
+
+class ShardedDatabase:
+    # The Database interface over shards separate stores, database.0.json,
+    # database.1.json, ..., with documents placed by a hash of shard_key.
+    # Queries with an equality on shard_key go to one shard, other queries
+    # run on every shard and their results are merged. Each shard has its
+    # own locks, so writers to different shards don't wait for each other.
+    def __init__(
+        self,
+        db_path="database.json",
+        shards=4,
+        shard_key="account_number",
+        storage="log",
+        parallel=True,
+        metrics=None,
+        **options,
+    ):
+        # storage must be an engine name, every shard opens its own. With
+        # parallel, finds that span shards run on one worker process per
+        # shard, each keeping its shard loaded. options go to every Database.
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        if not isinstance(storage, str):
+            raise TypeError("ShardedDatabase takes a storage engine name")
+        self.db_path = db_path
+        self.shard_key = shard_key
+        self.storage_name = storage
+        self.metrics = metrics or NULL_METRICS
+        self.shards = [
+            Database(shard_path(db_path, i), storage=storage, metrics=self.metrics, **options)
+            for i in range(shards)
+        ]
+        self.parallel = parallel and shards > 1
+        self._pools = None
+        self._pool_mutex = threading.Lock()
+        self._index_specs = []
+        self._columns = {}
+        self._local = threading.local()
+        # Transactions that write to several shards are first recorded in
+        # this journal, so a crash part way through their commits is
+        # finished by the next writer instead of leaving half a transfer
+        self._journal_path = f"{db_path}.journal"
+        self._journal_lock = FileLock(f"{self._journal_path}.lock")
+        self._journal_mutex = threading.Lock()
+        self._journal_inode = None
+        self._journal_offset = 0
+        self._pending = {}
+
+    def shard_for(self, value):
+        return zlib.crc32(str(value).encode()) % len(self.shards)
+
+    def _route(self, query):
+        # The shard an equality on shard_key pins query to, or None
+        if query:
+            value = query.get(self.shard_key)
+            if value is not None and not isinstance(value, dict):
+                return self.shard_for(value)
+        return None
+
+    def subscribe(self, callback):
+        # Every shard has a change feed of its own, FILE.i.changes, with its
+        # own seq, so callback sees events in order per shard only
+        for shard in self.shards:
+            shard.subscribe(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        for shard in self.shards:
+            shard.unsubscribe(callback)
+
+    def close(self):
+        if self._pools is not None:
+            for pool in self._pools:
+                pool.shutdown()
+            self._pools = None
+        for shard in self.shards:
+            shard.close()
+        self._journal_lock.close()
+
+    def create_index(self, collection_name, field, unique=False, order_by=None):
+        # Unique indexes are only enforced within each shard, so across the
+        # store only for shard_key itself
+        options = {"unique": unique, "order_by": order_by}
+        self._index_specs.append((collection_name, field, options))
+        for shard in self.shards:
+            shard.create_index(collection_name, field, **options)
+
+    def store_columns(self, collection_name, fields):
+        self._columns[collection_name] = fields
+        for shard in self.shards:
+            shard.store_columns(collection_name, fields)
+
+    # Transactions
+
+    @contextmanager
+    def transaction(self, keys=None):
+        # keys lists the shard_key values the transaction will touch, so
+        # that only their shards are locked. Without keys every shard is.
+        # Shards are always locked in the same order, so transactions can't
+        # deadlock. A nested block is a savepoint in every shard the
+        # enclosing transaction holds and can't reach further.
+        shards = None if keys is None else {self.shard_for(key) for key in keys}
+        with self._transaction(shards) as transaction:
+            yield transaction
+
+    @contextmanager
+    def _transaction(self, shards):
+        # shards is a set of shard numbers, None for all of them
+        wanted = range(len(self.shards)) if shards is None else sorted(shards)
+        held = getattr(self._local, "held", None)
+        if held is not None:
+            self._check_held(held, wanted)
+            with ExitStack() as stack:
+                yield ShardedTransaction(
+                    [stack.enter_context(self.shards[i].transaction()) for i in held]
+                )
+            return
+        held = self._local.held = {}
+        entry_id = None
+        try:
+            with ExitStack() as stack:
+                for i in wanted:
+                    held[i] = stack.enter_context(self.shards[i].transaction())
+                    self._recover(i)
+                yield ShardedTransaction(list(held.values()))
+                entry_id = self._journal_commit(held)
+            # Every shard has committed
+            if entry_id is not None:
+                self._journal_done(entry_id)
+        finally:
+            self._local.held = None
+
+    def _check_held(self, held, wanted):
+        for i in wanted:
+            if i not in held:
+                raise ValueError(
+                    f"Shard {i} is outside the keys of the enclosing transaction"
+                )
+
+    @contextmanager
+    def _writing(self, shard):
+        # Writes join the caller's transaction, or make one of their own
+        held = getattr(self._local, "held", None)
+        if held is not None:
+            wanted = range(len(self.shards)) if shard is None else [shard]
+            self._check_held(held, wanted)
+            yield
+            return
+        with self._transaction(None if shard is None else {shard}):
+            yield
+
+    def _journal_commit(self, held):
+        # Records the ops of a transaction that writes to more than one shard
+        # before any shard commits them. Every shard's share includes
+        # setting its applied mark to the entry's sequence number, higher
+        # than any mark a shard it touches has had so far.
+        writes = {
+            i: transaction
+            for i, transaction in held.items()
+            if transaction.ops and not transaction.rollback_only
+        }
+        if len(writes) < 2:
+            return None
+        seq = max(self._applied(i) for i in writes) + 1
+        for i in writes:
+            shard = self.shards[i]
+            mark = shard.find_one(COMMITS)
+            if mark is None:
+                shard.insert(COMMITS, {"seq": seq})
+            else:
+                shard.update_one(COMMITS, {"_id": mark["_id"]}, {"seq": seq})
+        entry = {
+            "id": uuid.uuid4().hex,
+            "seq": seq,
+            "ops": {str(i): transaction.ops for i, transaction in writes.items()},
+        }
+        self._journal_append(entry, sync=True)
+        return entry["id"]
+
+    def _journal_done(self, entry_id):
+        self._journal_append({"done": entry_id}, sync=False)
+
+    def _journal_append(self, record, sync):
+        line = json.dumps(record, default=_plain) + "\n"
+        with self._journal_lock.exclusive():
+            with open(self._journal_path, "a") as f:
+                f.write(line)
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+            if (
+                not sync
+                and os.path.getsize(self._journal_path) > JOURNAL_RESET_BYTES
+                and not self._read_journal()
+            ):
+                # Nothing in flight, start the journal over
+                with open(f"{self._journal_path}.tmp", "w"):
+                    pass
+                os.replace(f"{self._journal_path}.tmp", self._journal_path)
+
+    def _read_journal(self):
+        # {entry id: entry} of the journal entries not yet marked done, read
+        # incrementally. A journal that was started over has a new inode.
+        with self._journal_mutex:
+            try:
+                stat = os.stat(self._journal_path)
+            except FileNotFoundError:
+                return self._pending
+            if stat.st_ino != self._journal_inode:
+                self._journal_inode, self._journal_offset = stat.st_ino, 0
+                self._pending = {}
+            if stat.st_size > self._journal_offset:
+                with open(self._journal_path, "rb") as f:
+                    f.seek(self._journal_offset)
+                    data = f.read(stat.st_size - self._journal_offset)
+                complete = data.rfind(b"\n") + 1  # A line may still be written
+                for line in data[:complete].splitlines():
+                    record = json.loads(line)
+                    if "done" in record:
+                        self._pending.pop(record["done"], None)
+                    else:
+                        self._pending[record["id"]] = record
+                self._journal_offset += complete
+            return self._pending
+
+    def _applied(self, i):
+        mark = self.shards[i].find_one(COMMITS)
+        return 0 if mark is None else mark["seq"]
+
+    def _recover(self, i):
+        # Called with shard i locked, before the transaction touches it.
+        # Journal entries for shard i that aren't marked done belong to
+        # writers that stopped between the journal and their last commit;
+        # the shard's share is applied unless its mark shows it committed.
+        pending = [
+            entry for entry in self._read_journal().values() if str(i) in entry["ops"]
+        ]
+        if not pending:
+            return
+        shard = self.shards[i]
+        db = shard._cache
+        for entry in sorted(pending, key=lambda entry: entry["seq"]):
+            if entry["seq"] > self._applied(i):
+                ops = entry["ops"][str(i)]
+                shard._replay(db, ops)
+                shard.storage.commit(db, ops)
+                shard._publish(ops)
+
+    # Writes
+
+    def insert(self, collection_name, document):
+        shard = self._route(document)
+        shard = 0 if shard is None else shard
+        with self._writing(shard):
+            return self.shards[shard].insert(collection_name, document)
+
+    def insert_many(self, collection_name, documents):
+        # One commit per shard, all of them or none
+        inserted = []
+        with self._writing(None):
+            for document in documents:
+                inserted.append(self.insert(collection_name, document))
+        return inserted
+
+    def update_one(self, collection_name, query, update_fields):
+        self._check_update(update_fields)
+        shard = self._route(query)
+        with self._writing(shard):
+            for i in self._shards_for(shard):
+                updated = self.shards[i].update_one(collection_name, query, update_fields)
+                if updated is not None:
+                    return updated
+        return None
+
+    def update_many(self, collection_name, query, update_fields):
+        self._check_update(update_fields)
+        shard = self._route(query)
+        with self._writing(shard):
+            return sum(
+                self.shards[i].update_many(collection_name, query, update_fields)
+                for i in self._shards_for(shard)
+            )
+
+    def delete_one(self, collection_name, query):
+        shard = self._route(query)
+        with self._writing(shard):
+            return any(
+                self.shards[i].delete_one(collection_name, query)
+                for i in self._shards_for(shard)
+            )
+
+    def _check_update(self, update_fields):
+        if self.shard_key in update_fields:
+            raise ValueError(f"'{self.shard_key}' places documents and can't be updated")
+
+    def _shards_for(self, shard):
+        return range(len(self.shards)) if shard is None else [shard]
+
+    # Reads
+
+    def find(
+        self, collection_name, query={}, limit=None, skip=0, sort=None, projection=None
+    ):
+        shard = self._route(query)
+        if shard is not None:
+            return self.shards[shard].find(collection_name, query, limit, skip, sort, projection)
+        # Every shard returns its first skip + limit matches, in sort order
+        # when there is one, and the merge keeps the overall first ones
+        sort = normalize_sort(sort)
+        stop = None if limit is None else skip + limit
+        detached = self._fans_out()
+        function = _find_detached if detached else _find
+        parts = self.map(function, collection_name, query, stop, sort, projection)
+        docs = chain.from_iterable(parts)
+        if sort:
+            docs = sort_documents(docs, sort, stop)
+        docs = list(islice(docs, skip, stop))
+        if detached and projection is None:
+            return [MappingProxyType(doc) for doc in docs]
+        return docs
+
+    def iter_find(self, collection_name, query=None, limit=None, batch_size=500):
+        # Lazily, one shard after the other
+        shard = self._route(query)
+        if shard is not None:
+            return self.shards[shard].iter_find(collection_name, query, limit, batch_size)
+        docs = chain.from_iterable(
+            shard.iter_find(collection_name, query, None, batch_size) for shard in self.shards
+        )
+        return islice(docs, limit)
+
+    def find_one(self, collection_name, query=None, projection=None):
+        shard = self._route(query)
+        for i in self._shards_for(shard):
+            doc = self.shards[i].find_one(collection_name, query, projection)
+            if doc is not None:
+                return doc
+        return None
+
+    def explain(self, collection_name, query=None, sort=None):
+        shard = self._route(query)
+        plans = []
+        for i in self._shards_for(shard):
+            plan = self.shards[i].explain(collection_name, query, sort)
+            plan["shard"] = i
+            plans.append(plan)
+        return plans[0] if shard is not None else plans
+
+    # Fan-out
+
+    def map(self, function, *args, shard_args=None):
+        # [function(shard database, *shard_args[i], *args) for every shard].
+        # When _fans_out, each call runs on the shard's worker process, so
+        # function must be a module-level function and its arguments and
+        # result picklable.
+        if shard_args is None:
+            shard_args = [()] * len(self.shards)
+        if not self._fans_out():
+            return [
+                function(shard, *own, *args) for shard, own in zip(self.shards, shard_args)
+            ]
+        jobs = [
+            pool.submit(
+                _run_on_shard,
+                shard.db_path,
+                self.storage_name,
+                self._index_specs,
+                self._columns,
+                function,
+                (*own, *args),
+            )
+            for pool, shard, own in zip(self._worker_pools(), self.shards, shard_args)
+        ]
+        return [job.result() for job in jobs]
+
+    def _fans_out(self):
+        # Workers only see committed data, so an open transaction reads here
+        return self.parallel and getattr(self._local, "held", None) is None
+
+    def _worker_pools(self):
+        # One single-process pool per shard, so every shard is loaded by one
+        # worker only and stays loaded there
+        with self._pool_mutex:
+            if self._pools is None:
+                # Imported here, it pulls in multiprocessing at startup otherwise
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._pools = [ProcessPoolExecutor(max_workers=1) for _ in self.shards]
+            return self._pools
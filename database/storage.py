@@ -0,0 +1,676 @@
+import json
+import mmap
+import os
+import re
+import threading
+from collections.abc import Mapping, Sequence
+from functools import partial
+
+from database.lock import FileLock
+from database.metrics import NULL_METRICS
+
+try:
+    import msgpack
+except ImportError:  # Optional, only needed by MsgpackStorage
+    msgpack = None
+
+# Log records are applied to the in-memory collections by document id:
+#   {"op": "insert", "c": collection, "doc": {...}}
+#   {"op": "update", "c": collection, "id": _id, "set": {...}}
+#   {"op": "delete", "c": collection, "id": _id}
+
+# LogStorage snapshots at least this large are memory-mapped and each
+# collection is only parsed when first used, see LogStorage._map_snapshot
+LAZY_SNAPSHOT_BYTES = 1024 * 1024
+
+
+def _plain(value):
+    # json/msgpack fallback for the cache's columnar collections and rows
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, Sequence):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def assign_ids(db):
+    # Documents written before ids existed are numbered by position, so every
+    # process that loads the same file agrees on them
+    for collection in db.values():
+        next_id = max((doc.get("_id", 0) for doc in collection), default=0) + 1
+        for doc in collection:
+            if "_id" not in doc:
+                doc["_id"] = next_id
+                next_id += 1
+    return db
+
+
+def apply_ops(db, ops, by_id=None):
+    # by_id caches {collection: {_id: doc}} across calls while replaying
+    if by_id is None:
+        by_id = {}
+
+    def documents(name):
+        if name not in by_id:
+            by_id[name] = {doc["_id"]: doc for doc in db.get(name, [])}
+        return by_id[name]
+
+    for op in ops:
+        name = op["c"]
+        if op["op"] == "insert":
+            doc = dict(op["doc"])
+            db.setdefault(name, []).append(doc)
+            documents(name)[doc["_id"]] = doc
+        elif op["op"] == "update":
+            doc = documents(name).get(op["id"])
+            if doc is not None:
+                doc.update(op["set"])
+        elif op["op"] == "delete":
+            doc = documents(name).pop(op["id"], None)
+            if doc is not None:
+                db[name] = [d for d in db[name] if d is not doc]
+    return db
+
+
+class LazyCollection(Sequence):
+    # Stands in for a collection of a memory-mapped snapshot. The first use
+    # parses it with load(), puts the list in its place in db and forwards
+    # to the list from then on.
+    def __init__(self, db, name, load):
+        self._db = db
+        self._name = name
+        self._load = load
+        self._list = None
+        self._mutex = threading.Lock()  # Readers share the cache
+
+    def _collection(self):
+        if self._list is None:
+            with self._mutex:
+                if self._list is None:
+                    self._list = self._load()
+                    self._load = None
+                    if self._db.get(self._name) is self:
+                        self._db[self._name] = self._list
+        return self._list
+
+    def __len__(self):
+        return len(self._collection())
+
+    def __getitem__(self, i):
+        return self._collection()[i]
+
+    def __setitem__(self, i, value):
+        self._collection()[i] = value
+
+    def __iter__(self):
+        return iter(self._collection())
+
+    def __reversed__(self):
+        return reversed(self._collection())
+
+    def __eq__(self, other):
+        return self._collection() == other
+
+    def __getattr__(self, name):
+        # append, pop, ...
+        return getattr(self._collection(), name)
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class JsonStorage:
+    # The whole store in one indented JSON file, rewritten on every commit
+    metrics = NULL_METRICS  # Replaced by the Database using this storage
+
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+
+    def create(self):
+        if not os.path.exists(self.path):
+            with open(self.path, "w") as f:
+                json.dump({}, f)  # Initialize with an empty dictionary
+
+    def changed(self):
+        return _file_stamp(self.path) != self._stamp
+
+    def load(self):
+        self._stamp = _file_stamp(self.path)
+        with open(self.path, "r") as f, self.metrics.timer("parse"):
+            return assign_ids(json.load(f))
+
+    def read_tail(self):
+        return None  # Any change means re-reading the whole file
+
+    def commit(self, db, ops):
+        with self.metrics.timer("serialize"):
+            data = json.dumps(db, indent=4, default=_plain)
+        with self.metrics.timer("write"):
+            _write_atomic(self.path, data)
+        self._stamp = _file_stamp(self.path)
+
+    def replace(self, db):
+        self.commit(db, None)
+
+    def close(self):
+        pass
+
+
+class LogStorage:
+    # A JSON snapshot plus an append-only log of committed operations. Each
+    # log line is one commit, {"seq": n, "ops": [...]}, so a torn final line
+    # loses at most the commit that was being written.
+    metrics = NULL_METRICS
+
+    def __init__(self, path, sync_every=1, compact_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.log_path = f"{path}.log"
+        self.old_log_path = f"{path}.log.old"
+        # fsync after this many commits, 0 leaves flushing to the OS
+        self.sync_every = sync_every
+        self.compact_bytes = compact_bytes
+        self._seq = 0
+        # Highest seq known to be on disk, see sync()
+        self.synced_seq = 0
+        self._log_offset = 0
+        self._unsynced = 0
+        self._log = None
+        self._stamp = None
+        self._compactor = None
+        # Guards the snapshot swap at the end of a compaction against loads
+        self._files_lock = threading.Lock()
+        # sync() may run outside the Database's write lock, this keeps it
+        # from racing a load or compaction that closes the log
+        self._sync_lock = threading.Lock()
+
+    def create(self):
+        if not os.path.exists(self.path):
+            _write_atomic(self.path, self._encode_snapshot({}))
+
+    def _read_snapshot(self):
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def _encode_snapshot(self, db):
+        # Still one JSON object, but each collection on a line of its own
+        lines = (
+            f"{json.dumps(name)}:{json.dumps(value, separators=(',', ':'), default=_plain)}"
+            for name, value in db.items()
+        )
+        return "{\n" + ",\n".join(lines) + "\n}"
+
+    def _current_stamp(self):
+        return (
+            _file_stamp(self.path),
+            _file_stamp(self.old_log_path),
+            _file_stamp(self.log_path),
+        )
+
+    def changed(self):
+        with self._files_lock:
+            return self._current_stamp() != self._stamp
+
+    def _map_snapshot(self):
+        # Returns (db, spans): the snapshot with the collections of a large
+        # one left out, and {name: (mapped file, start, stop)} for those.
+        # Snapshots are written one collection per line for this. The map
+        # keeps the file's contents even after a compaction replaces it.
+        if os.path.getsize(self.path) < LAZY_SNAPSHOT_BYTES:
+            return self._read_snapshot(), {}
+        with open(self.path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        spans = self._collection_spans(mapped)
+        if spans is None:
+            mapped.close()  # Another layout, e.g. an indented JsonStorage file
+            return self._read_snapshot(), {}
+        db = {}
+        if "__seq__" in spans:
+            _, start, stop = spans.pop("__seq__")
+            db["__seq__"] = json.loads(mapped[start:stop])
+        return db, spans
+
+    def _collection_spans(self, mapped):
+        # {name: (mapped, start, stop)} if every line between the braces is
+        # one "name":value pair as _encode_snapshot writes them, else None.
+        # An indented JsonStorage file also starts with "{\n", but its lines
+        # don't start with the key.
+        if mapped[:2] != b"{\n":
+            return None
+        spans = {}
+        position = 2
+        while True:
+            end = mapped.find(b"\n", position)
+            if end == -1:
+                return None
+            if end == position:
+                # The blank line of an empty store
+                return spans if not spans and mapped[end:] == b"\n}" else None
+            if mapped[end - 1] == ord(","):
+                stop = end - 1
+            elif mapped[end:] == b"\n}":
+                stop = end  # The last collection
+            else:
+                return None
+            key_end = mapped.find(b'":', position, stop) + 1
+            if mapped[position] != ord('"') or not key_end:
+                return None
+            try:
+                name = json.loads(mapped[position:key_end])
+            except ValueError:
+                return None
+            spans[name] = (mapped, key_end + 1, stop)
+            if stop == end:
+                return spans
+            position = end + 1
+
+    def _parse_collection(self, name, mapped, start, stop, ops):
+        with self.metrics.timer("parse"):
+            db = assign_ids({name: json.loads(mapped[start:stop])})
+        return apply_ops(db, ops)[name]
+
+    def _read_log(self, path, snapshot_seq, ops, truncate):
+        # Adds the operations of records newer than the snapshot to ops
+        if not os.path.exists(path):
+            return 0
+        good_offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good_offset += len(line)
+                if record["seq"] > snapshot_seq:
+                    ops.extend(record["ops"])
+                self._seq = max(self._seq, record["seq"])
+            torn = f.tell() != good_offset
+        if torn and truncate:
+            with open(path, "r+b") as f:
+                f.truncate(good_offset)
+        return good_offset
+
+    def load(self):
+        # Collections of a large snapshot are LazyCollections, parsed along
+        # with their share of the log when first used
+        self._close_log()
+        with self._files_lock:
+            with self.metrics.timer("parse"):
+                db, spans = self._map_snapshot()
+            snapshot_seq = db.pop("__seq__", 0)
+            assign_ids(db)
+            self._seq = snapshot_seq
+            ops = []
+            self._read_log(self.old_log_path, snapshot_seq, ops, truncate=False)
+            self._log_offset = self._read_log(
+                self.log_path, snapshot_seq, ops, truncate=True
+            )
+            eager_ops, lazy_ops = [], {name: [] for name in spans}
+            for op in ops:
+                lazy_ops.get(op["c"], eager_ops).append(op)
+            apply_ops(db, eager_ops)
+            for name, span in spans.items():
+                load = partial(self._parse_collection, name, *span, lazy_ops[name])
+                db[name] = LazyCollection(db, name, load)
+            self._stamp = self._current_stamp()
+        if os.path.exists(self.old_log_path):
+            # A previous compaction never finished, fold the rotated log now
+            self._start_compactor()
+        return db
+
+    def checkpoint(self):
+        # Opens the snapshot and logs as they are now and returns (snapshot
+        # file, [(log file, length)]). The caller holds the store's file lock,
+        # so no commit or compaction is halfway done. The files then keep
+        # this content while writers carry on: the snapshot is only ever
+        # replaced whole, and logs are only appended to, renamed or removed.
+        with self._files_lock:
+            snapshot = open(self.path, "rb")
+            logs = []
+            for path in (self.old_log_path, self.log_path):
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    continue
+                logs.append((f, os.fstat(f.fileno()).st_size))
+        return snapshot, logs
+
+    def _snapshot_seq(self, f):
+        # __seq__ is always written last, reading the end of the file will do
+        f.seek(max(0, os.fstat(f.fileno()).st_size - 64))
+        match = re.search(rb'"__seq__":(\d+)\n?}\s*$', f.read())
+        return int(match.group(1)) if match else 0
+
+    def read_tail(self):
+        # Operations other processes appended to the live log since we last
+        # loaded or committed. None when the snapshot or log was swapped out
+        # and the caller has to load() again.
+        with self._files_lock:
+            stamp = self._current_stamp()
+            if stamp[:2] != self._stamp[:2] or stamp[2] is None:
+                return None
+            if self._stamp[2] is not None and stamp[2][0] != self._stamp[2][0]:
+                return None
+            if self._stamp[2] is None:
+                self._log_offset = 0  # The log was created after our last look
+            ops = []
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        return None  # Torn write, load() truncates it
+                    record = json.loads(line)
+                    ops.extend(record["ops"])
+                    self._seq = max(self._seq, record["seq"])
+                    self._log_offset += len(line)
+            self._stamp = stamp
+            return ops
+
+    def commit(self, db, ops, sync=True):
+        # With sync=False the record is only handed to the OS, the caller
+        # makes it durable later with sync(), e.g. once for a group of commits
+        if not ops:
+            return self._seq
+        if self._log is None:
+            self._log = open(self.log_path, "a")
+            self._log.seek(0, os.SEEK_END)
+        seq = self._seq + 1
+        with self.metrics.timer("serialize"):
+            line = json.dumps({"seq": seq, "ops": ops}, separators=(",", ":")) + "\n"
+        with self.metrics.timer("write"):
+            self._log.write(line)
+            self._log.flush()
+        self._log_offset = self._log.tell()
+        # Only published once flushed, so a concurrent sync() that reads it
+        # has the record in the file it fsyncs
+        self._seq = seq
+        self._unsynced += 1
+        if sync and self.sync_every and self._unsynced >= self.sync_every:
+            self.sync()
+        with self._files_lock:
+            self._stamp = self._current_stamp()
+        if self.compact_bytes and self._log_offset >= self.compact_bytes:
+            self.compact()
+        return seq
+
+    def sync(self):
+        # fsync everything written so far. Returns the seq that is now durable.
+        with self._sync_lock:
+            self._sync_locked()
+            return self.synced_seq
+
+    def _sync_locked(self):
+        seq = self._seq
+        if self._log is not None and seq > self.synced_seq:
+            with self.metrics.timer("fsync"):
+                os.fsync(self._log.fileno())
+        self.synced_seq = seq
+        self._unsynced = 0
+
+    def _close_log(self):
+        with self._sync_lock:
+            if self._log is not None:
+                self._sync_locked()
+                self._log.close()
+                self._log = None
+
+    def compact(self, wait=False):
+        # Rotate the live log aside and fold it into a new snapshot on a
+        # background thread. Recovery skips records the snapshot already has.
+        if self._compactor is not None and self._compactor.is_alive():
+            if wait:
+                self._compactor.join()
+            return
+        if os.path.exists(self.old_log_path) or not os.path.exists(self.log_path):
+            return
+        self._close_log()
+        with self._files_lock:
+            os.replace(self.log_path, self.old_log_path)
+            self._log_offset = 0
+            self._stamp = self._current_stamp()
+        self._start_compactor()
+        if wait:
+            self._compactor.join()
+
+    def _start_compactor(self):
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self._write_snapshot, daemon=True)
+        self._compactor.start()
+
+    def _write_snapshot(self):
+        with self.metrics.timer("compact"):
+            self._compact_into_snapshot()
+
+    def _compact_into_snapshot(self):
+        snapshot_stamp = _file_stamp(self.path)
+        old_log_stamp = _file_stamp(self.old_log_path)
+        try:
+            db = self._read_snapshot()
+            with open(self.old_log_path, "rb") as f:
+                records = [json.loads(line) for line in f]
+        except FileNotFoundError:
+            return  # Another process finished this compaction first
+        snapshot_seq = db.pop("__seq__", 0)
+        assign_ids(db)
+        last_seq = snapshot_seq
+        by_id = {}
+        for record in records:
+            if record["seq"] > snapshot_seq:
+                apply_ops(db, record["ops"], by_id)
+            last_seq = max(last_seq, record["seq"])
+        db["__seq__"] = last_seq
+        data = self._encode_snapshot(db)
+        # Other processes may be loading the snapshot and rotated log, swap
+        # them only while holding the store's exclusive file lock
+        file_lock = FileLock(f"{self.path}.lock")
+        try:
+            with file_lock.exclusive(), self._files_lock:
+                if (
+                    _file_stamp(self.path) != snapshot_stamp
+                    or _file_stamp(self.old_log_path) != old_log_stamp
+                ):
+                    return  # Another process finished this compaction first
+                # The in-memory collections already reflect these records, so
+                # the swap must not look like a change made by another writer
+                unchanged = self._current_stamp() == self._stamp
+                _write_atomic(self.path, data)
+                os.remove(self.old_log_path)
+                if unchanged:
+                    self._stamp = self._current_stamp()
+        finally:
+            file_lock.close()
+
+    def replace(self, db):
+        # Overwrite the store with db as a fresh snapshot and an empty log.
+        # A compaction still running is not waited for: it needs the file
+        # lock our caller may hold, and gives up once it sees the new
+        # snapshot.
+        self._close_log()
+        with self._files_lock:
+            _write_atomic(self.path, self._encode_snapshot(dict(db, __seq__=self._seq)))
+            for path in (self.old_log_path, self.log_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._log_offset = 0
+            self._stamp = self._current_stamp()
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+        self._close_log()
+
+
+class MsgpackStorage(LogStorage):
+    # LogStorage with the snapshot packed as MessagePack instead of JSON. The
+    # snapshot is most of what a load parses, the log stays JSON lines.
+    def __init__(self, path, sync_every=1, compact_bytes=16 * 1024 * 1024):
+        if msgpack is None:
+            raise ImportError("The msgpack storage engine needs 'pip install msgpack'")
+        super().__init__(path, sync_every, compact_bytes)
+
+    def _read_snapshot(self):
+        with open(self.path, "rb") as f:
+            return msgpack.unpackb(f.read(), raw=False)
+
+    def _encode_snapshot(self, db):
+        return msgpack.packb(db, use_bin_type=True, default=_plain)
+
+    def _snapshot_seq(self, f):
+        # No way around unpacking all of it
+        f.seek(0)
+        return msgpack.unpackb(f.read(), raw=False).get("__seq__", 0)
+
+
+class SQLiteStorage:
+    # One row per document in an SQLite file, so a commit only writes the
+    # documents its operations touch. Bodies are stored as JSON.
+    metrics = NULL_METRICS
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._data_version = None
+        # The connection is shared by every thread using the Database
+        self._conn_lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            import sqlite3  # Only this engine needs it, and it is slow to import
+
+            self._conn = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        return self._conn
+
+    def create(self):
+        with self._conn_lock:
+            conn = self._connect()
+            conn.execute("CREATE TABLE IF NOT EXISTS collections (name TEXT PRIMARY KEY)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "collection TEXT NOT NULL, id INTEGER NOT NULL, body TEXT NOT NULL, "
+                "PRIMARY KEY (collection, id))"
+            )
+
+    def changed(self):
+        # data_version only moves when another connection commits
+        with self._conn_lock:
+            return self._connect().execute("PRAGMA data_version").fetchone()[0] != (
+                self._data_version
+            )
+
+    def load(self):
+        with self._conn_lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            try:
+                db = {name: [] for (name,) in conn.execute("SELECT name FROM collections")}
+                rows = conn.execute(
+                    "SELECT collection, body FROM documents ORDER BY collection, id"
+                )
+                for name, body in rows:
+                    db.setdefault(name, []).append(json.loads(body))
+                self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            finally:
+                conn.execute("COMMIT")
+        return assign_ids(db)
+
+    def read_tail(self):
+        return None  # Other writers' changes are picked up by a full load
+
+    def commit(self, db, ops):
+        if not ops:
+            return
+        with self._conn_lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                with self.metrics.timer("write"):
+                    for op in ops:
+                        self._apply(conn, op)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            with self.metrics.timer("fsync"):
+                conn.execute("COMMIT")
+            self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _apply(self, conn, op):
+        name = op["c"]
+        if op["op"] == "insert":
+            conn.execute("INSERT OR IGNORE INTO collections VALUES (?)", (name,))
+            conn.execute(
+                "INSERT INTO documents VALUES (?, ?, ?)",
+                (name, op["doc"]["_id"], json.dumps(op["doc"])),
+            )
+        elif op["op"] == "update":
+            row = conn.execute(
+                "SELECT body FROM documents WHERE collection = ? AND id = ?",
+                (name, op["id"]),
+            ).fetchone()
+            if row is not None:
+                doc = json.loads(row[0])
+                doc.update(op["set"])
+                conn.execute(
+                    "UPDATE documents SET body = ? WHERE collection = ? AND id = ?",
+                    (json.dumps(doc), name, op["id"]),
+                )
+        elif op["op"] == "delete":
+            conn.execute(
+                "DELETE FROM documents WHERE collection = ? AND id = ?", (name, op["id"])
+            )
+
+    def replace(self, db):
+        with self._conn_lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM collections")
+                conn.execute("DELETE FROM documents")
+                conn.executemany(
+                    "INSERT INTO collections VALUES (?)", ((name,) for name in db)
+                )
+                conn.executemany(
+                    "INSERT INTO documents VALUES (?, ?, ?)",
+                    (
+                        (name, doc["_id"], json.dumps(doc, default=_plain))
+                        for name, collection in db.items()
+                        for doc in collection
+                    ),
+                )
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+STORAGE_ENGINES = {
+    "json": JsonStorage,
+    "log": LogStorage,
+    "msgpack": MsgpackStorage,
+    "sqlite": SQLiteStorage,
+}
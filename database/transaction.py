@@ -0,0 +1,10 @@
+class Transaction:
+    def __init__(self):
+        self.ops = []
+        # (kind, collection_name, ...) entries replayed in reverse on rollback
+        self.undo = []
+        self.rollback_only = False
+
+    def rollback(self):
+        # Discard every change made in this transaction when the block exits
+        self.rollback_only = True
@@ -1,16 +1,22 @@
+import argparse
 import random
 import re
 from getpass import getpass
 
 from colorama import Fore, Style, init
 
-from account_manager import AccountManager
+import bulk
+from account_manager import AccountManager, SessionError
+from database import Database, ShardedDatabase
+from database.metrics import Metrics
 
 # Initialize colorama
 init(autoreset=True)
 
 
 class Menu:
+    HISTORY_PAGE_SIZE = 20
+
     def __init__(self, account_manager):
         self.account_manager = account_manager
 
@@ -30,37 +36,45 @@ class Menu:
 
             choice = input(Fore.YELLOW + "Enter your choice (1-9): ")
 
-            match choice:
-                case "1":
-                    self.create_account()
-                case "2":
-                    self.deposit_money()
-                case "3":
-                    self.withdraw_money()
-                case "4":
-                    self.transfer_credits()
-                case "5":
-                    self.account_details()
-                case "6":
-                    self.show_transaction_history()
-                case "7":
-                    self.edit_account_details()
-                case "8":
-                    self.check_balance()
-                case "9":
-                    print(Fore.RED + "Exiting the system. Goodbye!")
-                    break
-                case _:
-                    print(Fore.RED + "Invalid choice. Please select a valid option.")
+            try:
+                match choice:
+                    case "1":
+                        self.create_account()
+                    case "2":
+                        self.deposit_money()
+                    case "3":
+                        self.withdraw_money()
+                    case "4":
+                        self.transfer_credits()
+                    case "5":
+                        self.account_details()
+                    case "6":
+                        self.show_transaction_history()
+                    case "7":
+                        self.edit_account_details()
+                    case "8":
+                        self.check_balance()
+                    case "9":
+                        print(Fore.RED + "Exiting the system. Goodbye!")
+                        break
+                    case _:
+                        print(Fore.RED + "Invalid choice. Please select a valid option.")
+            except SessionError as e:
+                # E.g. left at a prompt until the session expired
+                print(Fore.RED + f"{e}. Please sign in again.")
+            except (TypeError, ValueError) as e:
+                # E.g. an edit the schema rejects, back to the menu instead of exiting
+                print(Fore.RED + f"Error: {e}")
 
     def validate_account_number(self, account_number):
         return account_number.isdigit() and len(account_number) == 13
 
     def validate_amount(self, amount):
+        # Credits are whole numbers, "100" and "100.00" are both accepted
         try:
             amount = float(amount)
-            return amount > 0
-        except ValueError:
+            return amount > 0 and amount.is_integer()
+        except (OverflowError, ValueError):
             return False
 
     def validate_password(self, password):
@@ -104,7 +118,7 @@ class Menu:
 
         print(Fore.RED + "Too many invalid attempts. Returning to menu.")
 
-    def verify_password(self, account_number):
+    def read_password(self):
         for attempt in range(2):
             password = getpass(
                 # Secure input
@@ -116,10 +130,32 @@ class Menu:
                 if attempt < 1:  # Only prompt again if this isn't the last attempt
                     print(Fore.YELLOW + "Please try again.")
             else:
-                return self.account_manager.check_password(account_number, password)
+                return password
 
         print(Fore.RED + "Too many invalid attempts. Returning to menu.")
-        return False
+        return None
+
+    def sign_in(self):
+        # Asks for an account number and password and returns an
+        # AccountSession for them, so the operation that follows doesn't look
+        # the account up again to check each
+        for attempt in range(2):
+            account_number = input(Fore.YELLOW + "Enter account number (13 digits): ")
+            if not self.validate_account_number(account_number):
+                print(Fore.RED + "Account number must be a 13-digit number.")
+            else:
+                password = self.read_password()
+                if password is None:
+                    return None
+                session = self.account_manager.open_session(account_number, password)
+                if session is not None:
+                    return session
+                print(Fore.RED + "Incorrect account number or password.")
+            if attempt < 1:  # Only prompt again if this isn't the last attempt
+                print(Fore.YELLOW + "Please try again.")
+
+        print(Fore.RED + "Too many invalid attempts. Returning to menu.")
+        return None
 
     def verify_account(self):
         for attempt in range(2):
@@ -140,155 +176,106 @@ class Menu:
         print(Fore.RED + "Too many invalid attempts. Returning to menu.")
         return None  # Return None if all attempts fail
 
-    def deposit_money(self):
+    def read_amount(self, prompt):
         for attempt in range(2):
-            account_number = self.verify_account()  # Call the updated function
-            if account_number is None:
-                return
-
-            amount = input(Fore.YELLOW + "Enter amount to deposit: ")
-            if not self.validate_amount(amount):
-                print(Fore.RED + "Invalid amount entered. Please enter a valid number.")
-                if attempt < 1:  # Only prompt again if this isn't the last attempt
-                    print(Fore.YELLOW + "Please try again.")
-                continue
-
-            amount = float(amount)  # Convert to float after validation
-
-            # Verify password
-            if not self.verify_password(account_number):
-                print(Fore.RED + "Incorrect password. Operation denied.")
-                return
-
-            print(Fore.GREEN + self.account_manager.deposit(account_number, amount))
-            return  # Exit after successful deposit
+            amount = input(Fore.YELLOW + prompt)
+            if self.validate_amount(amount):
+                return int(float(amount))  # Convert to credits after validation
+            print(Fore.RED + "Invalid amount entered. Please enter a whole number of credits.")
+            if attempt < 1:  # Only prompt again if this isn't the last attempt
+                print(Fore.YELLOW + "Please try again.")
 
         print(Fore.RED + "Too many invalid attempts. Returning to menu.")
+        return None
 
-    def withdraw_money(self):
-        for attempt in range(2):
-            account_number = self.verify_account()  # Call the updated function
-            if account_number is None:
-                return
-
-            amount = input(Fore.YELLOW + "Enter amount to withdraw: ")
-            if not self.validate_amount(amount):
-                print(Fore.RED + "Invalid amount entered. Please enter a valid number.")
-                if attempt < 1:  # Only prompt again if this isn't the last attempt
-                    print(Fore.YELLOW + "Please try again.")
-                continue
-
-            amount = float(amount)  # Convert to float after validation
-
-            # Fetch the current balance
-            current_balance = self.account_manager.get_balance(account_number)
-
-            if amount > current_balance:
-                print(
-                    Fore.RED
-                    + f"Insufficient balance. Your current balance is {current_balance}"
-                )
-                return
+    def deposit_money(self):
+        session = self.sign_in()
+        if session is None:
+            return
+        amount = self.read_amount("Enter amount to deposit: ")
+        if amount is None:
+            return
+        print(Fore.GREEN + session.deposit(amount))
 
-            # Verify password
-            if not self.verify_password(account_number):
-                print(Fore.RED + "Incorrect password. Operation denied.")
-                return
+    def withdraw_money(self):
+        session = self.sign_in()
+        if session is None:
+            return
+        amount = self.read_amount("Enter amount to withdraw: ")
+        if amount is None:
+            return
 
-            print(Fore.GREEN + self.account_manager.withdraw(account_number, amount))
-            return  # Exit after successful withdrawal
+        # The balance as of signing in, withdraw() checks it again
+        current_balance = session.user["credits"]
+        if amount > current_balance:
+            print(
+                Fore.RED
+                + f"Insufficient balance. Your current balance is {current_balance}"
+            )
+            return
 
-        print(Fore.RED + "Too many invalid attempts. Returning to menu.")
+        print(Fore.GREEN + session.withdraw(amount))
 
     def transfer_credits(self):
-        for attempt in range(2):
-            sender_account = self.verify_account()  # Call the updated function
-            if sender_account is None:
-                return
-
-            recipient_account = self.verify_account()  # Call the updated function
-            if recipient_account is None:
-                return
-
-            amount = input(Fore.YELLOW + "Enter amount to transfer: ")
-            if not self.validate_amount(amount):
-                print(Fore.RED + "Invalid amount entered. Please enter a valid number.")
-                if attempt < 1:  # Only prompt again if this isn't the last attempt
-                    print(Fore.YELLOW + "Please try again.")
-                continue
-
-            amount = float(amount)  # Convert to float after validation
+        session = self.sign_in()
+        if session is None:
+            return
 
-            # Verify sender's password
-            if not self.verify_password(sender_account):
-                print(Fore.RED + "Incorrect password. Operation denied.")
-                return
+        recipient_account = self.verify_account()  # Call the updated function
+        if recipient_account is None:
+            return
 
-            # Check if sender has enough credits
-            sender_details = self.account_manager.account_details(sender_account)
-            if sender_details["credits"] < amount:
-                print(Fore.RED + "Insufficient credits. Transfer aborted.")
-                return
+        amount = self.read_amount("Enter amount to transfer: ")
+        if amount is None:
+            return
 
-            # Perform the transfer if all checks pass
-            print(
-                Fore.GREEN
-                + self.account_manager.transfer_credits(
-                    sender_account, recipient_account, amount
-                )
-            )
-            return  # Exit after successful transfer
+        # Check if sender has enough credits
+        if session.user["credits"] < amount:
+            print(Fore.RED + "Insufficient credits. Transfer aborted.")
+            return
 
-        print(Fore.RED + "Too many invalid attempts. Returning to menu.")
+        # Perform the transfer if all checks pass
+        print(Fore.GREEN + session.transfer(recipient_account, amount))
 
     def account_details(self):
-        account_number = self.verify_account()  # Call the updated function
-        if account_number is None:
+        session = self.sign_in()
+        if session is None:
             return
-
-        # Verify password
-        if not self.verify_password(account_number):
-            print(Fore.RED + "Incorrect password. Operation denied.")
-            return
-        details = self.account_manager.account_details(account_number)
-        if isinstance(details, dict):
-            print(Fore.CYAN + Style.BRIGHT + "\n=== Account Details ===")
-            print(
-                Fore.MAGENTA
-                + f"Name: {details['name']}\nAge: {details['age']}\nBirth_date: {details['birth_date']}\nPhone_number: {
-                  details['phone_number']}\nCredits: {details['credits']}\nAccount_number: {details['account_number']}"
-            )
-        else:
-            print(Fore.RED + details)
+        details = session.details()
+        print(Fore.CYAN + Style.BRIGHT + "\n=== Account Details ===")
+        print(
+            Fore.MAGENTA
+            + f"Name: {details['name']}\nAge: {details['age']}\nBirth_date: {details['birth_date']}\nPhone_number: {
+              details['phone_number']}\nCredits: {details['credits']}\nAccount_number: {details['account_number']}"
+        )
         return  # Exit after displaying account details
 
     def show_transaction_history(self):
-        account_number = self.verify_account()  # Call the updated function
-        if account_number is None:
-            return
-
-        # Verify password
-        if not self.verify_password(account_number):
-            print(Fore.RED + "Incorrect password. Operation denied.")
+        session = self.sign_in()
+        if session is None:
             return
-        transactions = self.account_manager.get_transaction_history(account_number)
-        if transactions:
-            print(Fore.CYAN + Style.BRIGHT + "\n=== Transaction History ===")
-            for trans in transactions:
-                trans_type = trans["type"]
-                amount = trans["amount"]
-                date = trans["date"]
-                print(Fore.MAGENTA + f"{trans_type:<10} {amount:<10} {date:<20}")
-        else:
-            print(Fore.RED + "No transactions found or account not found.")
+        shown = 0
+        for trans in session.history():
+            if shown == 0:
+                print(Fore.CYAN + Style.BRIGHT + "\n=== Transaction History ===")
+            elif shown % self.HISTORY_PAGE_SIZE == 0:
+                more = input(Fore.YELLOW + "Press Enter for more, or 'q' to stop: ")
+                if more.lower() == "q":
+                    return
+            trans_type = trans["type"]
+            amount = trans["amount"]
+            date = trans["date"]
+            print(Fore.MAGENTA + f"{trans_type:<10} {amount:<10} {date:<20}")
+            shown += 1
+        if shown == 0:
+            print(Fore.RED + "No transactions found.")
         return
 
     def edit_account_details(self):
+        session = self.sign_in()
+        if session is None:
+            return
         for attempt in range(2):
-            account_number = self.verify_account()  # Call the updated function
-            if account_number is None:
-                return
-
             new_details = {}
             if (
                 input(Fore.YELLOW + "Do you want to edit the name? (y/n): ").lower()
@@ -317,36 +304,122 @@ class Menu:
                     Fore.YELLOW + "Enter new phone number: "
                 )
 
-            # Verify password
-            if not self.verify_password(account_number):
-                print(Fore.RED + "Incorrect password. Operation denied.")
-                return
-
             # Update account details
-            self.account_manager.edit_account_details(account_number, new_details)
+            session.edit_details(new_details)
             print(Fore.GREEN + "Account details updated successfully.")
             return  # Exit after updating account details
 
         print(Fore.RED + "Too many invalid attempts. Returning to menu.")
 
     def check_balance(self):
-        account_number = self.verify_account()  # Call the updated function
-        if account_number is None:
+        session = self.sign_in()
+        if session is None:
             return
+        print(Fore.GREEN + f"Current balance: {session.balance()}")
+        return
 
-        # Verify password
-        if not self.verify_password(account_number):
-            print(Fore.RED + "Incorrect password. Operation denied.")
-            return
-        balance = self.account_manager.get_balance(account_number)
-        if balance is not None:
-            print(Fore.GREEN + f"Current balance: {balance}")
+
+def run_bulk(account_manager, path, report_path):
+    results = bulk.apply_file(account_manager, path, report_path)
+    failed = [result for result in results if not result["ok"]]
+    for result in failed:
+        print(Fore.RED + f"Row {result['row']}: {result['message']}")
+    print(
+        Fore.GREEN
+        + f"Applied {len(results) - len(failed)} of {len(results)} operations."
+    )
+
+
+def run_verify_stats(account_manager, repair):
+    drift = account_manager.verify_stats(repair=repair)
+    for record in drift:
+        if record["stored"] is None:
+            problem = "no stats"
+        elif record["balance_drift"]:
+            problem = f"balance off by {record['balance_drift']}"
         else:
-            print(Fore.RED + "Account not found.")
-        return
+            problem = "stats differ from history"
+        print(Fore.RED + f"{record['account_number']}: {problem}")
+    fixed = " and repaired" if repair else ""
+    print(Fore.GREEN + f"Verified{fixed} account stats, {len(drift)} accounts drifted.")
 
 
 if __name__ == "__main__":
-    account_manager = AccountManager()
-    menu = Menu(account_manager)
-    menu.display()
+    parser = argparse.ArgumentParser(description="Bank Management System")
+    parser.add_argument(
+        "--bulk",
+        metavar="FILE",
+        help="apply deposits, withdrawals and transfers from a CSV or JSONL file",
+    )
+    parser.add_argument(
+        "--report", metavar="FILE", help="write per-row --bulk results as JSONL"
+    )
+    parser.add_argument(
+        "--serve", action="store_true", help="serve the HTTP/JSON API instead of the menu"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address for --serve")
+    parser.add_argument("--port", type=int, default=8080, help="port for --serve")
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="record timings and write them to FILE in Prometheus text format",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="cProfile every 100th database operation and write the stats to FILE",
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="hold accounts in memory column by column, for very large stores",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="split the store into this many files by account number",
+    )
+    parser.add_argument(
+        "--changes",
+        action="store_true",
+        help="publish every change to database.json.changes for python -m database.changes",
+    )
+    parser.add_argument(
+        "--verify-stats",
+        action="store_true",
+        help="rebuild every account's stats from its history and report drift",
+    )
+    parser.add_argument(
+        "--repair", action="store_true", help="with --verify-stats, rewrite drifted stats"
+    )
+    args = parser.parse_args()
+
+    metrics = None
+    if args.metrics or args.profile:
+        metrics = Metrics(sample_every=100 if args.profile else 0, profile=bool(args.profile))
+        if args.metrics and args.serve:
+            metrics.export_every(args.metrics)
+    if args.shards > 1:
+        db = ShardedDatabase(shards=args.shards, metrics=metrics, changes=args.changes)
+    else:
+        db = Database(metrics=metrics, changes=args.changes)
+    account_manager = AccountManager(db_instance=db, columnar=args.columnar)
+    try:
+        if args.bulk:
+            run_bulk(account_manager, args.bulk, args.report)
+        elif args.verify_stats:
+            run_verify_stats(account_manager, args.repair)
+        elif args.serve:
+            print(Fore.GREEN + f"Serving on http://{args.host}:{args.port}")
+            import server  # asyncio is only needed when serving
+
+            server.serve(account_manager, args.host, args.port)
+        else:
+            menu = Menu(account_manager)
+            menu.display()
+    finally:
+        if args.metrics:
+            metrics.write_prometheus(args.metrics)
+        if args.profile:
+            metrics.dump_profile(args.profile)
@@ -0,0 +1,290 @@
+# End-of-day reports over the users and the transactions ledger: the money
+# supply, a histogram of balances, and the count and amount of each
+# transaction type per day.
+#
+#   python -m reporting --db database.json --cache database.json.extract
+#
+# The ledger is read into a LedgerExtract, one array each for the day, type
+# and amount of every transaction. With --cache it is saved between runs, and
+# each run only reads the transactions added since the last one. The
+# aggregates use NumPy when it is installed and plain Python otherwise. A
+# sharded store (--shards) is reported on shard by shard, in parallel, and
+# the reports are merged.
+import argparse
+import bisect
+import json
+import os
+from array import array
+
+from database import Database, ShardedDatabase
+from database.shard import shard_path
+from database.storage import STORAGE_ENGINES
+
+try:
+    import numpy
+except ImportError:  # Optional, the fallback computes the same numbers
+    numpy = None
+
+BALANCE_EDGES = (0, 100, 1000, 10000, 100000, 1000000)
+
+
+class LedgerExtract:
+    def __init__(self):
+        # None until the first update, which also reads the transaction
+        # history kept on user documents from before the ledger
+        self.last_id = None
+        self.days = []
+        self.types = []
+        self.day = array("i")  # Index into days
+        self.type = array("b")  # Index into types
+        self.amount = array("d")
+
+    def __len__(self):
+        return len(self.amount)
+
+    def update(self, db):
+        # Reads the transactions added since the last update. Returns how
+        # many were added, or None if the ledger was replaced and the caller
+        # has to start a new extract.
+        if self.last_id:
+            # The last transaction read must still be there
+            query = {"_id": {"$gte": self.last_id, "$lte": self.last_id}}
+            if not db.find("transactions", query, limit=1, projection=["_id"]):
+                return None
+        before = len(self)
+        if self.last_id is None:
+            self.last_id = 0
+            for user in db.iter_find("users"):
+                self._extend(user.get("transaction_history", ()))
+        entries = db.iter_find("transactions", {"_id": {"$gt": self.last_id}})
+        self._extend(entries)
+        return len(self) - before
+
+    def _extend(self, entries):
+        day_codes = {day: code for code, day in enumerate(self.days)}
+        type_codes = {kind: code for code, kind in enumerate(self.types)}
+        day, kind, amount = self.day.append, self.type.append, self.amount.append
+        for entry in entries:
+            date = entry["date"][:10]
+            code = day_codes.get(date)
+            if code is None:
+                code = day_codes[date] = len(self.days)
+                self.days.append(date)
+            day(code)
+            code = type_codes.get(entry["type"])
+            if code is None:
+                code = type_codes[entry["type"]] = len(self.types)
+                self.types.append(entry["type"])
+            kind(code)
+            amount(entry["amount"])
+            if "_id" in entry:
+                self.last_id = entry["_id"]
+
+    def save(self, path):
+        # A JSON header line followed by the raw arrays
+        header = {
+            "last_id": self.last_id,
+            "days": self.days,
+            "types": self.types,
+            "count": len(self),
+            "typecodes": [self.day.typecode, self.type.typecode, self.amount.typecode],
+            "itemsizes": [self.day.itemsize, self.type.itemsize, self.amount.itemsize],
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            for values in (self.day, self.type, self.amount):
+                values.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        extract = cls()
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            columns = (extract.day, extract.type, extract.amount)
+            if header["itemsizes"] != [values.itemsize for values in columns]:
+                raise ValueError(f"{path} was written on an incompatible platform")
+            for values in columns:
+                values.fromfile(f, header["count"])
+        extract.last_id = header["last_id"]
+        extract.days = header["days"]
+        extract.types = header["types"]
+        return extract
+
+
+def _numpy_array(values):
+    kind = "f" if values.typecode == "d" else "i"
+    return numpy.frombuffer(values, dtype=f"{kind}{values.itemsize}")
+
+
+def daily_volume(extract):
+    # {day: {type: {"count": n, "amount": total}}}, days in order
+    width = len(extract.types)
+    size = len(extract.days) * width
+    if numpy is not None and len(extract):
+        keys = _numpy_array(extract.day).astype("i8") * width + _numpy_array(extract.type)
+        counts = numpy.bincount(keys, minlength=size).tolist()
+        totals = numpy.bincount(
+            keys, weights=_numpy_array(extract.amount), minlength=size
+        ).tolist()
+    else:
+        counts, totals = [0] * size, [0.0] * size
+        for day, kind, amount in zip(extract.day, extract.type, extract.amount):
+            key = day * width + kind
+            counts[key] += 1
+            totals[key] += amount
+    volume = {}
+    for code, day in sorted(enumerate(extract.days), key=lambda item: item[1]):
+        volume[day] = {
+            kind: {"count": counts[code * width + i], "amount": _number(totals[code * width + i])}
+            for i, kind in enumerate(extract.types)
+            if counts[code * width + i]
+        }
+    return volume
+
+
+def balance_histogram(balances, edges=BALANCE_EDGES):
+    # Accounts per [edges[i], edges[i + 1]) bucket, the last one open ended.
+    # Balances below edges[0] count towards the first bucket.
+    if numpy is not None:
+        positions = numpy.searchsorted(numpy.asarray(edges), balances, side="right") - 1
+        counts = numpy.bincount(positions.clip(0), minlength=len(edges)).tolist()
+    else:
+        counts = [0] * len(edges)
+        for balance in balances:
+            counts[max(bisect.bisect_right(edges, balance) - 1, 0)] += 1
+    return [
+        {
+            "from": low,
+            "to": edges[i + 1] if i + 1 < len(edges) else None,
+            "accounts": counts[i],
+        }
+        for i, low in enumerate(edges)
+    ]
+
+
+def _number(value):
+    return int(value) if float(value).is_integer() else value
+
+
+def build_report(db, extract=None, edges=BALANCE_EDGES):
+    # Brings extract up to date first, a fresh one reads the whole ledger.
+    # On a ShardedDatabase extract is a list of one per shard, and each
+    # shard's report is built on its own worker.
+    if isinstance(db, ShardedDatabase):
+        extracts = extract or [None] * len(db.shards)
+        results = db.map(build_report, edges, shard_args=[(e,) for e in extracts])
+        return merge_reports([report for report, _ in results]), [e for _, e in results]
+    if extract is None or extract.update(db) is None:
+        extract = LedgerExtract()
+        extract.update(db)
+    balances = array("d", (user.get("credits", 0) for user in db.iter_find("users")))
+    report = {
+        "accounts": len(balances),
+        "money_supply": _number(sum(balances)),
+        "transactions": len(extract),
+        "balance_histogram": balance_histogram(balances, edges),
+        "daily_volume": daily_volume(extract),
+    }
+    return report, extract
+
+
+def merge_reports(reports):
+    # One report from those of separate parts of the store
+    volume = {}
+    for report in reports:
+        for day, kinds in report["daily_volume"].items():
+            totals = volume.setdefault(day, {})
+            for kind, total in kinds.items():
+                merged = totals.setdefault(kind, {"count": 0, "amount": 0})
+                merged["count"] += total["count"]
+                merged["amount"] = _number(merged["amount"] + total["amount"])
+    histogram = [dict(bucket, accounts=0) for bucket in reports[0]["balance_histogram"]]
+    for report in reports:
+        for merged, bucket in zip(histogram, report["balance_histogram"]):
+            merged["accounts"] += bucket["accounts"]
+    return {
+        "accounts": sum(report["accounts"] for report in reports),
+        "money_supply": _number(sum(report["money_supply"] for report in reports)),
+        "transactions": sum(report["transactions"] for report in reports),
+        "balance_histogram": histogram,
+        "daily_volume": dict(sorted(volume.items())),
+    }
+
+
+def format_report(report):
+    lines = [
+        f"Accounts:      {report['accounts']}",
+        f"Money supply:  {report['money_supply']}",
+        f"Transactions:  {report['transactions']}",
+        "",
+        "Balances",
+    ]
+    for bucket in report["balance_histogram"]:
+        high = "and up" if bucket["to"] is None else f"to {bucket['to']}"
+        lines.append(f"  {bucket['from']:>10} {high:<12}{bucket['accounts']:>10}")
+    kinds = sorted({kind for day in report["daily_volume"].values() for kind in day})
+    lines += ["", "Daily volume, count / amount", f"  {'day':<12}"]
+    lines[-1] += "".join(f"{kind:>24}" for kind in kinds)
+    for day, volume in report["daily_volume"].items():
+        cells = []
+        for kind in kinds:
+            total = volume.get(kind, {"count": 0, "amount": 0})
+            cells.append(f"{total['count']} / {total['amount']}".rjust(24))
+        lines.append(f"  {day:<12}" + "".join(cells))
+    return "\n".join(lines)
+
+
+def _load_extract(path):
+    if path and os.path.exists(path):
+        try:
+            return LedgerExtract.load(path)
+        except (OSError, ValueError, KeyError):
+            pass  # Unreadable, rebuilt from the ledger
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-of-day balance and volume report")
+    parser.add_argument("--db", default="database.json", help="store to report on")
+    parser.add_argument("--storage", default="log", choices=STORAGE_ENGINES)
+    parser.add_argument(
+        "--cache", metavar="FILE", help="keep the ledger extract in FILE between runs"
+    )
+    parser.add_argument(
+        "--edges",
+        default=",".join(map(str, BALANCE_EDGES)),
+        help="comma separated lower bounds of the balance buckets",
+    )
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--shards", type=int, default=1, help="shards the store is split into")
+    args = parser.parse_args()
+    if not os.path.exists(args.db if args.shards == 1 else shard_path(args.db, 0)):
+        raise SystemExit(f"No store at {args.db}")
+    try:
+        edges = sorted(int(edge) for edge in args.edges.split(","))
+    except ValueError:
+        raise SystemExit("--edges takes comma separated integers")
+
+    if args.shards == 1:
+        db = Database(args.db, storage=args.storage)
+        extract = _load_extract(args.cache)
+    else:
+        db = ShardedDatabase(args.db, shards=args.shards, storage=args.storage)
+        # One cache file per shard, FILE.0, FILE.1, ...
+        extract = [_load_extract(args.cache and f"{args.cache}.{i}") for i in range(args.shards)]
+    try:
+        report, extract = build_report(db, extract, edges)
+    finally:
+        db.close()
+    if args.cache and args.shards == 1:
+        extract.save(args.cache)
+    elif args.cache:
+        for i, shard_extract in enumerate(extract):
+            shard_extract.save(f"{args.cache}.{i}")
+    print(json.dumps(report, indent=4) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
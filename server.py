@@ -0,0 +1,335 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import parse_qsl, urlsplit
+
+from account_manager import AccountSession, SessionError
+
+# Requests are JSON objects, sent as a POST body or as query parameters:
+#   /deposit   account_number, password, amount
+#   /withdraw  account_number, password, amount
+#   /transfer  account_number, password, recipient, amount
+#   /balance   account_number, password
+#   /details   account_number, password
+#   /history   account_number, password, [since, until, type, limit, offset]
+#   /stats     account_number, password
+# Every response is a JSON object with "ok" and either a "message" or the
+# requested data.
+
+MAX_BODY_BYTES = 64 * 1024
+# Open AccountSessions kept for clients that send the same credentials again
+MAX_SESSIONS = 10000
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class BankServer:
+    # Serves AccountManager over HTTP/JSON from one event loop. Storage calls
+    # block, so they run on a bounded thread pool; writes that arrive during
+    # the same loop tick share one database transaction and one commit.
+    def __init__(self, account_manager, max_workers=8, max_pending=1024):
+        self.account_manager = account_manager
+        self.db = account_manager.db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Caps the requests handed to the pool, further ones wait their turn
+        # on the event loop instead of piling up unbounded work
+        self._pending = asyncio.Semaphore(max_pending)
+        self._writes = []
+        self._flushing = False
+        self._flush_scheduled = False
+        self._server = None
+        # {(account_number, password): AccountSession}, oldest first
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self.routes = {
+            "/deposit": self._deposit,
+            "/withdraw": self._withdraw,
+            "/transfer": self._transfer,
+            "/balance": self._balance,
+            "/details": self._details,
+            "/history": self._history,
+            "/stats": self._stats,
+        }
+        self._write_routes = {"/deposit", "/withdraw", "/transfer"}
+
+    async def start(self, host="127.0.0.1", port=8080):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server
+
+    async def serve_forever(self, host="127.0.0.1", port=8080):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        self._executor.shutdown(wait=True)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except RequestError as e:
+                    body = {"ok": False, "message": str(e)}
+                    await self._respond(writer, e.status, body, False)
+                    break
+                if request is None:
+                    break
+                path, params, keep_alive = request
+                status, body = await self._dispatch(path, params)
+                await self._respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise RequestError(400, "Request headers too large")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None  # The client closed an idle keep-alive connection
+            raise
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise RequestError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise RequestError(400, "Content-Length must be a whole number of bytes")
+        if length > MAX_BODY_BYTES:
+            raise RequestError(413, "Request body too large")
+        if length:
+            body = await reader.readexactly(length)
+            try:
+                data = json.loads(body)
+            except ValueError:
+                raise RequestError(400, "Request body must be a JSON object")
+            if not isinstance(data, dict):
+                raise RequestError(400, "Request body must be a JSON object")
+            params.update(data)
+        elif method not in ("GET", "POST"):
+            raise RequestError(400, f"Unsupported method {method}")
+
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.1":
+            keep_alive = connection != "close"
+        else:
+            keep_alive = connection == "keep-alive"
+        return url.path, params, keep_alive
+
+    async def _respond(self, writer, status, body, keep_alive):
+        payload = json.dumps(body).encode()
+        head = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode() + payload)
+        await writer.drain()
+
+    async def _dispatch(self, path, params):
+        handler = self.routes.get(path)
+        if handler is None:
+            return 404, {"ok": False, "message": f"Unknown endpoint {path}"}
+        try:
+            async with self._pending:
+                if path in self._write_routes:
+                    result = await self._submit_write(handler, params)
+                else:
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        self._executor, handler, params
+                    )
+        except RequestError as e:
+            return e.status, {"ok": False, "message": str(e)}
+        except Exception as e:
+            return 500, {"ok": False, "message": f"Internal error: {e}"}
+        return 200, result
+
+    # Write coalescing
+
+    def _submit_write(self, handler, params):
+        future = asyncio.get_running_loop().create_future()
+        self._writes.append((handler, params, future))
+        self._schedule_flush()
+        return future
+
+    def _schedule_flush(self):
+        # Everything queued before the callback runs goes into one batch. While
+        # a batch is committing, new writes wait and form the next one.
+        if self._flush_scheduled or self._flushing or not self._writes:
+            return
+        self._flush_scheduled = True
+        asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        batch, self._writes = self._writes, []
+        self._flushing = True
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(self._executor, self._apply_writes, batch)
+        job.add_done_callback(lambda job: self._finish_flush(batch, job))
+
+    def _apply_writes(self, batch):
+        # Only the batch's accounts are locked on a sharded store
+        keys = set()
+        for _, params, _ in batch:
+            keys.add(str(params.get("account_number", "")))
+            if params.get("recipient") is not None:
+                keys.add(str(params["recipient"]))
+        results = []
+        with self.db.transaction(keys=keys):
+            for handler, params, _ in batch:
+                try:
+                    results.append((True, handler(params)))
+                except Exception as e:
+                    results.append((False, e))
+        return results
+
+    def _finish_flush(self, batch, job):
+        self._flushing = False
+        error = job.exception()
+        for i, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue  # The client went away
+            if error is not None:
+                future.set_exception(error)  # The commit itself failed
+                continue
+            ok, result = job.result()[i]
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        self._schedule_flush()
+
+    # Endpoints, called on the executor
+
+    def _session(self, params):
+        # An open session for the request's credentials, reused across
+        # requests so only the first one pays for the password check
+        account_number = str(params.get("account_number", ""))
+        password = params.get("password")
+        if not account_number or password is None:
+            raise RequestError(400, "account_number and password are required")
+        credentials = (account_number, str(password))
+        with self._sessions_lock:
+            session = self._sessions.get(credentials)
+        if session is not None and not session.closed:
+            return session
+        session = self.account_manager.open_session(*credentials)
+        if session is None:
+            raise RequestError(401, "Invalid account number or password")
+        with self._sessions_lock:
+            if len(self._sessions) >= MAX_SESSIONS:
+                self._sessions.pop(next(iter(self._sessions)))
+            self._sessions[credentials] = session
+        return session
+
+    def _with_session(self, params, operation):
+        try:
+            return operation(self._session(params))
+        except SessionError:
+            # Expired, or the account changed since: authenticate afresh
+            return operation(self._session(params))
+
+    def _amount(self, params):
+        amount = params.get("amount")
+        if isinstance(amount, str) and amount.isdigit():
+            amount = int(amount)
+        if not isinstance(amount, int) or isinstance(amount, bool) or amount <= 0:
+            raise RequestError(400, "amount must be a positive whole number")
+        return amount
+
+    def _deposit(self, params):
+        amount = self._amount(params)
+        message = self._with_session(params, lambda session: session.deposit(amount))
+        return {"ok": message.startswith("Deposited"), "message": message}
+
+    def _withdraw(self, params):
+        amount = self._amount(params)
+        message = self._with_session(params, lambda session: session.withdraw(amount))
+        return {"ok": message.startswith("Withdrew"), "message": message}
+
+    def _transfer(self, params):
+        recipient = str(params.get("recipient", ""))
+        if not recipient:
+            raise RequestError(400, "recipient is required")
+        amount = self._amount(params)
+        message = self._with_session(params, lambda session: session.transfer(recipient, amount))
+        return {"ok": message.startswith("Transferred"), "message": message}
+
+    def _balance(self, params):
+        return {"ok": True, "balance": self._with_session(params, AccountSession.balance)}
+
+    def _details(self, params):
+        return {"ok": True, "details": self._with_session(params, AccountSession.details)}
+
+    def _history(self, params):
+        try:
+            limit = int(params["limit"]) if params.get("limit") is not None else None
+            offset = int(params.get("offset") or 0)
+        except (TypeError, ValueError):
+            raise RequestError(400, "limit and offset must be whole numbers")
+        filters = {field: params.get(field) for field in ("since", "until", "type")}
+        if any(value is not None and not isinstance(value, str) for value in filters.values()):
+            raise RequestError(400, "since, until and type must be strings")
+        transactions = self._with_session(
+            params,
+            lambda session: session.history(
+                since=filters["since"],
+                until=filters["until"],
+                trans_type=filters["type"],
+                limit=None if limit is None else offset + limit,
+            ),
+        )
+        history = list(islice(transactions, offset, None))
+        return {"ok": True, "history": history}
+
+    def _stats(self, params):
+        return {"ok": True, "stats": self._with_session(params, AccountSession.stats)}
+
+
+def serve(account_manager, host="127.0.0.1", port=8080, max_workers=8):
+    server = BankServer(account_manager, max_workers=max_workers)
+    try:
+        asyncio.run(server.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        account_manager.db.close()
@@ -0,0 +1,18 @@
+from account_manager import AccountManager
+from database import Database
+
+
+def test_account_stats_hold_no_internal_id(tmp_path):
+    db = Database(str(tmp_path / "database.json"))
+    manager = AccountManager(db_instance=db)
+    account = manager.create_account("Ada", 36, "1990-01-01", "5550100", 100)["account_number"]
+    manager.deposit(account, 50)
+    manager.withdraw(account, 20)
+
+    stats = manager.account_stats(account)
+
+    assert "_id" not in stats
+    assert stats["opening"] == 100
+    assert stats["count"] == 2
+    assert stats["totals"] == {"deposit": 50, "withdraw": 20}
+    db.close()
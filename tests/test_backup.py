@@ -0,0 +1,55 @@
+import pytest
+
+from database import Database, ShardedDatabase
+from database.backup import backup, restore
+
+
+def counters(db):
+    return sorted(doc["n"] for doc in db.find("counters", {}))
+
+
+def test_full_and_incremental_restore(tmp_path):
+    backups = str(tmp_path / "backups")
+    db = Database(str(tmp_path / "database.json"))
+    for n in range(3):
+        db.insert("counters", {"n": n})
+    full = backup(db, backups)
+    db.update_one("counters", {"n": 1}, {"n": 10})
+    db.insert("counters", {"n": 3})
+    incremental = backup(db, backups)
+    db.delete_one("counters", {"n": 0})
+    latest = backup(db, backups)
+    assert backup(db, backups) == latest  # Nothing new to back up
+    db.close()
+
+    assert full["kind"] == "full"
+    assert incremental["kind"] == latest["kind"] == "incremental"
+
+    for seq, expected in (
+        (full["seq"], [0, 1, 2]),
+        (incremental["seq"], [0, 2, 3, 10]),
+        (None, [2, 3, 10]),
+    ):
+        target = str(tmp_path / f"restored-{seq}.json")
+        restore(backups, target, seq=seq)
+        restored = Database(target)
+        assert counters(restored) == expected
+        restored.close()
+
+
+def test_restore_refuses_to_overwrite(tmp_path):
+    backups = str(tmp_path / "backups")
+    db = Database(str(tmp_path / "database.json"))
+    db.insert("counters", {"n": 1})
+    backup(db, backups)
+    db.close()
+    with pytest.raises(ValueError):
+        restore(backups, str(tmp_path / "database.json"))
+
+
+def test_sharded_store_is_backed_up_per_shard(tmp_path):
+    db = ShardedDatabase(db_path=str(tmp_path / "database.json"), shards=2)
+    db.insert("counters", {"n": 1})
+    with pytest.raises(ValueError, match="one shard at a time"):
+        backup(db, str(tmp_path / "backups"))
+    db.close()
@@ -0,0 +1,47 @@
+import bulk
+from account_manager import AccountManager
+from database import Database
+
+
+def test_amounts_must_be_positive_whole_numbers(tmp_path):
+    db = Database(str(tmp_path / "database.json"))
+    manager = AccountManager(db_instance=db)
+    sender = manager.create_account("Ada", 36, "1990-01-01", "5550100", 100)["account_number"]
+    recipient = manager.create_account("Bob", 40, "1986-01-01", "5550101", 100)["account_number"]
+    path = tmp_path / "operations.csv"
+    path.write_text(
+        "op,account_number,amount,recipient\n"
+        f"transfer,{sender},-50,{recipient}\n"
+        f"deposit,{sender},-500,\n"
+        f"deposit,{sender},12.5,\n"
+        f"withdraw,{sender},0,\n"
+        f"deposit,{sender},20.0,\n"
+        f"transfer,{sender},30,{recipient}\n"
+    )
+
+    results = bulk.apply_file(manager, str(path))
+
+    assert [result["ok"] for result in results] == [False] * 4 + [True] * 2
+    assert "positive whole number, got 12.5" in results[2]["message"]
+    assert manager.get_balance(sender) == 90
+    assert manager.get_balance(recipient) == 130
+    db.close()
+
+
+def test_malformed_json_line_is_a_failed_row(tmp_path):
+    db = Database(str(tmp_path / "database.json"))
+    manager = AccountManager(db_instance=db)
+    account = manager.create_account("Ada", 36, "1990-01-01", "5550100", 100)["account_number"]
+    path = tmp_path / "operations.jsonl"
+    path.write_text(
+        f'{{"op": "deposit", "account_number": "{account}", "amount": 10}}\n'
+        '{"op": "deposit", "account_number": \n'
+        f'{{"op": "withdraw", "account_number": "{account}", "amount": 30}}\n'
+    )
+
+    results = bulk.apply_file(manager, str(path))
+
+    assert [result["ok"] for result in results] == [True, False, True]
+    assert "line 2 is not valid JSON" in results[1]["message"]
+    assert manager.get_balance(account) == 80
+    db.close()
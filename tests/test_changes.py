@@ -0,0 +1,18 @@
+from database import Database
+
+
+def test_failing_subscriber_does_not_fail_the_write(tmp_path, caplog):
+    db = Database(str(tmp_path / "database.json"), changes=True)
+    seen = []
+
+    def broken(event):
+        raise RuntimeError("consumer is down")
+
+    db.subscribe(broken)
+    db.subscribe(seen.append)
+    db.insert("counters", {"n": 1})
+
+    assert [event["doc"]["n"] for event in seen] == [1]
+    assert db.find("counters", {})[0]["n"] == 1
+    assert "consumer is down" in caplog.text
+    db.close()
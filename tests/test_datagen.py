@@ -0,0 +1,14 @@
+from account_manager import AccountManager
+from database import Database
+
+from benchmarks.datagen import create_store
+
+
+def test_generated_stats_match_the_ledger(tmp_path):
+    path = str(tmp_path / "database.json")
+    accounts = create_store(path, 50, 4)
+    db = Database(path)
+    manager = AccountManager(db_instance=db)
+    assert manager.verify_stats(processes=1) == []
+    assert manager.account_stats(accounts[0][0])["count"] == 4
+    db.close()
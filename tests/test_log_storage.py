@@ -0,0 +1,141 @@
+import os
+import threading
+
+from database import Database
+from database.storage import LAZY_SNAPSHOT_BYTES, STORAGE_ENGINES, LazyCollection, LogStorage
+
+
+def open_db(path, compact_bytes=16 * 1024 * 1024):
+    return Database(storage=LogStorage(path, compact_bytes=compact_bytes))
+
+
+def counters(db):
+    return sorted(doc["n"] for doc in db.find("counters", {}))
+
+
+def test_snapshot_and_log_replay(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = open_db(path)
+    for n in range(10):
+        db.insert("counters", {"n": n})
+    db.update_one("counters", {"n": 3}, {"n": 30})
+    db.delete_one("counters", {"n": 4})
+    db.close()
+
+    reopened = open_db(path)
+    assert counters(reopened) == [0, 1, 2, 5, 6, 7, 8, 9, 30]
+    reopened.close()
+
+
+def test_torn_last_log_line_is_dropped(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = open_db(path)
+    for n in range(5):
+        db.insert("counters", {"n": n})
+    db.close()
+    # A writer that crashed part way through its record
+    with open(f"{path}.log", "ab") as f:
+        f.write(b'{"seq":6,"ops":[{"op":"insert","c":"counters","doc":{"n":99')
+
+    db = open_db(path)
+    assert counters(db) == [0, 1, 2, 3, 4]
+    db.insert("counters", {"n": 5})
+    db.close()
+
+    with open(f"{path}.log", "rb") as f:
+        assert f.read().endswith(b"\n")
+    reopened = open_db(path)
+    assert counters(reopened) == [0, 1, 2, 3, 4, 5]
+    reopened.close()
+
+
+def test_other_writers_changes_are_reloaded(tmp_path):
+    path = str(tmp_path / "db.json")
+    first, second = open_db(path), open_db(path)
+    first.insert("counters", {"n": 1})
+    assert counters(second) == [1]
+    second.insert("counters", {"n": 2})
+    assert counters(first) == [1, 2]
+    first.close()
+    second.close()
+
+
+def test_compaction_racing_writers(tmp_path):
+    # Small logs compact all the time, while two writers keep committing
+    path = str(tmp_path / "db.json")
+    writers = [open_db(path, compact_bytes=2000) for _ in range(2)]
+    errors = []
+
+    def write(db, start):
+        try:
+            for n in range(start, start + 200):
+                db.insert("counters", {"n": n})
+        except Exception as e:  # Surfaced by the assert below
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=write, args=(db, i * 1000)) for i, db in enumerate(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for db in writers:
+        db.storage.compact(wait=True)
+        db.close()
+
+    assert not errors
+    assert os.path.exists(path)
+    reopened = open_db(path)
+    assert counters(reopened) == list(range(200)) + list(range(1000, 1200))
+    reopened.close()
+
+
+def test_replayed_updates_and_deletes_add_no_index(tmp_path):
+    path = str(tmp_path / "db.json")
+    first, second = open_db(path), open_db(path)
+    for n in range(5):
+        first.insert("counters", {"n": n})
+    assert counters(second) == [0, 1, 2, 3, 4]
+    first.update_one("counters", {"n": 1}, {"n": 10})
+    first.delete_one("counters", {"n": 3})
+    assert counters(second) == [0, 2, 4, 10]
+    assert "_id" not in second._indexes.get("counters", {})
+    first.close()
+    second.close()
+
+
+def large_store(db, count=15000):
+    db.insert_many("counters", [{"n": n, "pad": "x" * 60} for n in range(count)])
+
+
+def test_large_snapshot_is_parsed_on_first_use(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = open_db(path)
+    large_store(db)
+    db.storage.compact(wait=True)
+    db.close()
+    assert os.path.getsize(path) > LAZY_SNAPSHOT_BYTES
+
+    storage = LogStorage(path)
+    loaded = storage.load()
+    assert isinstance(loaded["counters"], LazyCollection)
+    assert len(loaded["counters"]) == 15000
+    storage.close()
+
+
+def test_large_indented_json_store_is_read_whole(tmp_path):
+    # A database.json left by the json engine, from before the log engine
+    path = str(tmp_path / "db.json")
+    legacy = Database(storage=STORAGE_ENGINES["json"](path))
+    large_store(legacy)
+    legacy.close()
+    assert os.path.getsize(path) > LAZY_SNAPSHOT_BYTES
+
+    db = open_db(path)
+    assert counters(db) == list(range(15000))
+    db.insert("counters", {"n": 15000})
+    db.close()
+    reopened = open_db(path)
+    assert len(reopened.find("counters", {})) == 15001
+    reopened.close()
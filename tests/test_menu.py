@@ -0,0 +1,77 @@
+import builtins
+import sys
+
+import pytest
+
+pytest.importorskip("colorama")
+if sys.version_info < (3, 12):
+    pytest.skip("main.py needs Python 3.12", allow_module_level=True)
+
+import main  # noqa: E402
+from account_manager import AccountManager  # noqa: E402
+from database import Database  # noqa: E402
+
+
+@pytest.fixture
+def menu(tmp_path):
+    db = Database(str(tmp_path / "database.json"))
+    yield main.Menu(AccountManager(db_instance=db))
+    db.close()
+
+
+def open_account(menu, credits):
+    return menu.account_manager.create_account("Ada", 36, "1990-01-01", "5550100", credits)
+
+
+def answer(monkeypatch, *replies, password):
+    replies = iter(replies)
+    monkeypatch.setattr(builtins, "input", lambda prompt="": next(replies))
+    monkeypatch.setattr(main, "getpass", lambda prompt="": password)
+
+
+def balance(menu, account):
+    return menu.account_manager.get_balance(account["account_number"])
+
+
+def test_deposit_withdraw_and_transfer(menu, monkeypatch, capsys):
+    sender, recipient = open_account(menu, 1000), open_account(menu, 50)
+
+    answer(monkeypatch, sender["account_number"], "250", password=sender["password"])
+    menu.deposit_money()
+    assert balance(menu, sender) == 1250
+
+    answer(monkeypatch, sender["account_number"], "100.00", password=sender["password"])
+    menu.withdraw_money()
+    assert balance(menu, sender) == 1150
+
+    answer(
+        monkeypatch,
+        sender["account_number"],
+        recipient["account_number"],
+        "150",
+        password=sender["password"],
+    )
+    menu.transfer_credits()
+    assert balance(menu, sender) == 1000
+    assert balance(menu, recipient) == 200
+    assert "Error" not in capsys.readouterr().out
+
+
+def test_fractional_amounts_are_asked_again(menu, monkeypatch, capsys):
+    account = open_account(menu, 1000)
+    answer(monkeypatch, account["account_number"], "12.5", "-3", password=account["password"])
+    menu.deposit_money()
+    assert balance(menu, account) == 1000
+    assert "whole number" in capsys.readouterr().out
+
+
+def test_errors_return_to_the_menu(menu, monkeypatch, capsys):
+    def fail():
+        raise ValueError("age must be a whole number")
+
+    monkeypatch.setattr(menu, "edit_account_details", fail)
+    answer(monkeypatch, "7", "9", password="")
+    menu.display()
+    out = capsys.readouterr().out
+    assert "Error: age must be a whole number" in out
+    assert "Goodbye" in out
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from account_manager import AccountManager
+from database import Database
+from server import BankServer, RequestError
+
+
+def read_request(tmp_path, raw):
+    db = Database(str(tmp_path / "database.json"))
+    server = BankServer(AccountManager(db_instance=db), max_workers=1)
+
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await server._read_request(reader)
+
+    try:
+        return asyncio.run(read())
+    finally:
+        server.close()
+        db.close()
+
+
+def test_body_is_read_by_content_length(tmp_path):
+    raw = b'POST /balance HTTP/1.1\r\nContent-Length: 7\r\n\r\n{"a":1}'
+    assert read_request(tmp_path, raw) == ("/balance", {"a": 1}, True)
+
+
+@pytest.mark.parametrize("length", ["abc", "-5", "1.5"])
+def test_invalid_content_length_is_a_bad_request(tmp_path, length):
+    raw = f"POST /balance HTTP/1.1\r\nContent-Length: {length}\r\n\r\n{{}}".encode()
+    with pytest.raises(RequestError) as e:
+        read_request(tmp_path, raw)
+    assert e.value.status == 400
+
+
+def test_oversized_body_is_refused(tmp_path):
+    raw = b"POST /balance HTTP/1.1\r\nContent-Length: 10000000\r\n\r\n"
+    with pytest.raises(RequestError) as e:
+        read_request(tmp_path, raw)
+    assert e.value.status == 413
+
+
+@pytest.mark.parametrize("field", ["since", "until", "type"])
+def test_history_filters_must_be_strings(tmp_path, field):
+    db = Database(str(tmp_path / "database.json"))
+    manager = AccountManager(db_instance=db)
+    account = manager.create_account("Ada", 36, "1990-01-01", "5550100", 100)
+    server = BankServer(manager, max_workers=1)
+    params = {**account, field: 20240101}
+    try:
+        with pytest.raises(RequestError) as e:
+            server._history(params)
+        assert e.value.status == 400
+    finally:
+        server.close()
+        db.close()